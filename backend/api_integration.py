@@ -1,17 +1,44 @@
+import asyncio
+import logging
 import os
+import random
+import time
 from datetime import datetime
-from typing import List, Dict
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional, Tuple
 
-import requests
-from sqlalchemy.orm import Session
-from dotenv import load_dotenv
+from sqlalchemy import insert, or_, select, tuple_
+from sqlalchemy.orm import Session, aliased
 
+import cache
+import metrics
 import models
+import predictions
+from database import dialect_insert
 
-load_dotenv()
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger("uvicorn.error")
 
 API_KEY = os.getenv("SPORTS_API_KEY", "d8ccd0d282c783d88e87dd347f9db9e0")
-BASE_URL = "https://api.the-odds-api.com/v4/sports/americanfootball_nfl/odds"
+BASE_URL = os.getenv("ODDS_API_BASE_URL", "https://api.the-odds-api.com/v4/sports")
+
+SPORTS = [s.strip() for s in os.getenv("ODDS_SPORTS", "americanfootball_nfl").split(",") if s.strip()]
+MARKETS = [m.strip() for m in os.getenv("ODDS_MARKETS", "h2h,spreads,totals").split(",") if m.strip()]
+REGIONS = os.getenv("ODDS_REGIONS", "us")
+
+PROVIDER_CONCURRENCY = int(os.getenv("ODDS_PROVIDER_CONCURRENCY", "4"))
+PROVIDER_MAX_RETRIES = int(os.getenv("ODDS_PROVIDER_MAX_RETRIES", "3"))
+PROVIDER_BACKOFF_SECONDS = float(os.getenv("ODDS_PROVIDER_BACKOFF_SECONDS", "0.5"))
+# Stop calling the provider once x-requests-remaining drops below this.
+PROVIDER_QUOTA_FLOOR = int(os.getenv("ODDS_PROVIDER_QUOTA_FLOOR", "25"))
+
+# Provider sport key -> Sport.sport_name. Unknown keys fall back to the event's sport_title.
+SPORT_NAMES = {
+    "americanfootball_nfl": "American Football",
+}
+
+MARKET_KEYS = ("h2h", "spreads", "totals")
 
 
 def _parse_commence_time(s: str) -> datetime:
@@ -21,118 +48,462 @@ def _parse_commence_time(s: str) -> datetime:
     return datetime.fromisoformat(s).replace(tzinfo=None)
 
 
-def fetch_provider_json() -> List[Dict]:
-    params = {
-        "apiKey": API_KEY,
-        "regions": "us",
-        "markets": "h2h",
-        "oddsFormat": "decimal",
-    }
-    r = requests.get(BASE_URL, params=params, timeout=20)
-    if r.status_code != 200:
-        raise RuntimeError(f"Provider error {r.status_code}: {r.text[:200]}")
-    data = r.json()
-    if not isinstance(data, list):
-        raise RuntimeError("Provider returned non-list")
-    return data
+class OddsApiClient:
+    """
+    Async client for the Odds API with a persistent connection pool.
+
+    Requests for every (sport, market) pair run concurrently, bounded by a
+    semaphore. Transport errors, 429s and 5xx responses are retried with
+    jittered exponential backoff. The quota headers of every response are
+    tracked, and calls are skipped while the remaining budget is below
+    PROVIDER_QUOTA_FLOOR. If the provider sends an ETag, the next request
+    for the same pair is conditional and a 304 reuses the cached payload.
+    """
 
+    def __init__(
+        self,
+        api_key: str = API_KEY,
+        base_url: str = BASE_URL,
+        max_concurrency: int = PROVIDER_CONCURRENCY,
+        max_retries: int = PROVIDER_MAX_RETRIES,
+        quota_floor: int = PROVIDER_QUOTA_FLOOR,
+        transport: Optional["httpx.AsyncBaseTransport"] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.quota_floor = quota_floor
+        self._transport = transport
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._max_concurrency = max_concurrency
+        self._sem = asyncio.Semaphore(max_concurrency)
+        # (sport, market) -> (etag, payload)
+        self._cache: Dict[Tuple[str, str], Tuple[Optional[str], List[Dict]]] = {}
+        self.requests_remaining: Optional[int] = None
+        self.requests_used: Optional[int] = None
+        self.calls = 0
+        self.skipped = 0
+        self.not_modified = 0
 
-def fetch_and_store_odds(db: Session) -> None:
-    events = fetch_provider_json()
+    def _http(self) -> "httpx.AsyncClient":
+        # httpx is imported with the first provider call, not at startup.
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=20,
+                limits=httpx.Limits(
+                    max_connections=self._max_concurrency,
+                    max_keepalive_connections=self._max_concurrency,
+                ),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _record_quota(self, headers: "httpx.Headers") -> None:
+        remaining = headers.get("x-requests-remaining")
+        used = headers.get("x-requests-used")
+        if remaining is not None:
+            self.requests_remaining = int(float(remaining))
+        if used is not None:
+            self.requests_used = int(float(used))
+
+    def quota_low(self) -> bool:
+        return self.requests_remaining is not None and self.requests_remaining < self.quota_floor
+
+    async def _get(self, path: str, params: Dict, etag: Optional[str]) -> "httpx.Response":
+        import httpx
+
+        headers = {"If-None-Match": etag} if etag else {}
+        endpoint = path.rsplit("/", 1)[-1]
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self._sem:
+                    self.calls += 1
+                    started = time.perf_counter()
+                    try:
+                        r = await self._http().get(path, params=params, headers=headers)
+                    except httpx.TransportError:
+                        metrics.observe_provider_call(endpoint, "error", time.perf_counter() - started, None)
+                        raise
+                self._record_quota(r.headers)
+                metrics.observe_provider_call(
+                    endpoint, str(r.status_code), time.perf_counter() - started, self.requests_remaining
+                )
+                if r.status_code != 429 and r.status_code < 500:
+                    return r
+                if attempt == self.max_retries:
+                    return r
+                retry_after = r.headers.get("retry-after")
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+            else:
+                # Full jitter: uniform over [0, base * 2^attempt].
+                delay = random.uniform(0, PROVIDER_BACKOFF_SECONDS * (2 ** attempt))
+            await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def fetch_odds(self, sport: str, market: str) -> List[Dict]:
+        key = (sport, market)
+        etag, cached = self._cache.get(key, (None, None))
+        if self.quota_low():
+            self.skipped += 1
+            logger.warning(
+                "odds provider quota low (%s remaining), skipping %s/%s", self.requests_remaining, sport, market
+            )
+            return cached or []
 
-    sport = db.query(models.Sport).filter_by(sport_name="American Football").first()
-    if not sport:
-        sport = models.Sport(sport_name="American Football")
-        db.add(sport)
-        db.commit()
-        db.refresh(sport)
+        params = {
+            "apiKey": self.api_key,
+            "regions": REGIONS,
+            "markets": market,
+            "oddsFormat": "decimal",
+        }
+        r = await self._get(f"/{sport}/odds", params, etag)
+        if r.status_code == 304 and cached is not None:
+            self.not_modified += 1
+            return cached
+        if r.status_code != 200:
+            raise RuntimeError(f"Provider error {r.status_code}: {r.text[:200]}")
+        data = r.json()
+        if not isinstance(data, list):
+            raise RuntimeError("Provider returned non-list")
+        for ev in data:
+            ev.setdefault("sport_key", sport)
+        self._cache[key] = (r.headers.get("etag"), data)
+        return data
 
+    async def fetch_scores(self, sport: str, days_from: int = 3) -> List[Dict]:
+        """Recent and live games for `sport`; finished ones have completed=True and a scores list."""
+        if self.quota_low():
+            self.skipped += 1
+            logger.warning("odds provider quota low (%s remaining), skipping %s scores", self.requests_remaining, sport)
+            return []
+        r = await self._get(f"/{sport}/scores", {"apiKey": self.api_key, "daysFrom": days_from}, None)
+        if r.status_code != 200:
+            raise RuntimeError(f"Provider error {r.status_code}: {r.text[:200]}")
+        data = r.json()
+        if not isinstance(data, list):
+            raise RuntimeError("Provider returned non-list")
+        return data
+
+    async def fetch_all(self, sports: Optional[List[str]] = None, markets: Optional[List[str]] = None) -> List[Dict]:
+        """Fetch every sport x market pair concurrently and merge them into one event list."""
+        pairs = [(s, m) for s in (sports or SPORTS) for m in (markets or MARKETS)]
+        results = await asyncio.gather(*(self.fetch_odds(s, m) for s, m in pairs), return_exceptions=True)
+
+        payloads = []
+        errors = []
+        for (sport, market), res in zip(pairs, results):
+            if isinstance(res, Exception):
+                logger.error("odds provider fetch %s/%s failed: %s", sport, market, res)
+                errors.append(res)
+            else:
+                payloads.append(res)
+        if errors and not payloads:
+            raise errors[0]
+        return merge_events(payloads)
+
+    def status(self) -> Dict:
+        return {
+            "requests_remaining": self.requests_remaining,
+            "requests_used": self.requests_used,
+            "quota_floor": self.quota_floor,
+            "calls": self.calls,
+            "skipped": self.skipped,
+            "not_modified": self.not_modified,
+        }
+
+
+def merge_events(payloads: List[List[Dict]]) -> List[Dict]:
+    """Combine per-market payloads so each event carries every market per bookmaker."""
+    merged: Dict = {}
+    for payload in payloads:
+        for ev in payload:
+            ev_id = ev.get("id") or (ev.get("home_team"), ev.get("away_team"), ev.get("commence_time"))
+            target = merged.get(ev_id)
+            if target is None:
+                merged[ev_id] = {**ev, "bookmakers": [dict(bk) for bk in ev.get("bookmakers") or []]}
+                continue
+            books = {bk.get("key") or bk.get("title"): bk for bk in target["bookmakers"]}
+            for bk in ev.get("bookmakers") or []:
+                existing = books.get(bk.get("key") or bk.get("title"))
+                if existing is None:
+                    target["bookmakers"].append(dict(bk))
+                else:
+                    existing["markets"] = (existing.get("markets") or []) + (bk.get("markets") or [])
+    return list(merged.values())
+
+
+def _market_prices(market: Dict, home: str, away: str) -> Optional[Tuple[float, float, Optional[float]]]:
+    """
+    Return (price_1, price_2, point) for one market.
+
+    h2h and spreads are priced home/away (point is the home handicap for spreads);
+    totals are priced over/under with point as the total.
+    """
+    outcomes = market.get("outcomes") or []
+    if market.get("key") == "totals":
+        by_name = {str(o.get("name")).lower(): o for o in outcomes}
+        o1, o2 = by_name.get("over"), by_name.get("under")
+    else:
+        by_name = {str(o.get("name")): o for o in outcomes if "name" in o}
+        o1, o2 = by_name.get(home), by_name.get(away)
+        if (o1 is None or o2 is None) and len(outcomes) >= 2:
+            o1 = o1 if o1 is not None else outcomes[0]
+            o2 = o2 if o2 is not None else outcomes[1]
+    if o1 is None or o2 is None or o1.get("price") is None or o2.get("price") is None:
+        return None
+    point = o1.get("point")
+    return float(o1["price"]), float(o2["price"]), float(point) if point is not None else None
+
+
+def parse_events(events: List[Dict]) -> List[Dict]:
+    """Flatten the provider payload into one dict per event with its prices per (book, market)."""
+    parsed = []
     for ev in events:
         home = ev.get("home_team")
         away = ev.get("away_team")
         ct = ev.get("commence_time")
-        books = ev.get("bookmakers")  
+        books = ev.get("bookmakers")
 
         if not (home and away and ct):
             continue
 
-        when = _parse_commence_time(ct) 
-
-        # Teams
-        t1 = db.query(models.SportsTeam).filter_by(team_name=home).first()
-        if not t1:
-            t1 = models.SportsTeam(sport_id=sport.sport_id, team_name=home)
-            db.add(t1)
-            db.commit()
-            db.refresh(t1)
-
-        t2 = db.query(models.SportsTeam).filter_by(team_name=away).first()
-        if not t2:
-            t2 = models.SportsTeam(sport_id=sport.sport_id, team_name=away)
-            db.add(t2)
-            db.commit()
-            db.refresh(t2)
-
-        match = (
-            db.query(models.Match)
-            .filter(
-                models.Match.sport_id == sport.sport_id,
-                models.Match.team1_id == t1.sports_teamsid,
-                models.Match.team2_id == t2.sports_teamsid,
-                models.Match.match_date == when,
-            )
-            .first()
-        )
-        if not match:
-            match = models.Match(
-                sport_id=sport.sport_id,
-                team1_id=t1.sports_teamsid,
-                team2_id=t2.sports_teamsid,
-                match_date=when,
-                location="TBD",
-            )
-            db.add(match)
-            db.commit()
-            db.refresh(match)
-
+        sport_key = ev.get("sport_key") or "americanfootball_nfl"
+        prices = {}
         if isinstance(books, list):
             for bk in books:
                 book_name = bk.get("title") or bk.get("key") or "Unknown"
-                markets = bk.get("markets") or []
-                h2h = next((m for m in markets if m.get("key") == "h2h"), None)
-                if not h2h:
-                    continue
-
-                outcomes = h2h.get("outcomes") or []
-                prices = {str(o.get("name")): o.get("price") for o in outcomes if "name" in o}
-                o1 = prices.get(home)
-                o2 = prices.get(away)
-                if o1 is None or o2 is None and len(outcomes) >= 2:
-                    o1 = o1 if o1 is not None else outcomes[0].get("price")
-                    o2 = o2 if o2 is not None else outcomes[1].get("price")
-                if o1 is None or o2 is None:
-                    continue
-
-                existing = (
-                    db.query(models.BettingOdds)
-                    .filter(
-                        models.BettingOdds.match_id == match.match_id,
-                        models.BettingOdds.sports_books == book_name,
-                    )
-                    .first()
-                )
-                if existing:
-                    existing.odds_team1 = float(o1)
-                    existing.odds_team2 = float(o2)
-                    existing.updated_at = datetime.utcnow()
-                else:
-                    db.add(
-                        models.BettingOdds(
-                            match_id=match.match_id,
-                            sports_books=book_name,
-                            odds_team1=float(o1),
-                            odds_team2=float(o2),
-                            updated_at=datetime.utcnow(),
-                        )
-                    )
-            db.commit()
+                for market in bk.get("markets") or []:
+                    if market.get("key") not in MARKET_KEYS:
+                        continue
+                    quote = _market_prices(market, home, away)
+                    if quote:
+                        prices[(book_name, market["key"])] = quote
+
+        parsed.append({
+            "sport_name": SPORT_NAMES.get(sport_key) or ev.get("sport_title") or sport_key,
+            "home": home,
+            "away": away,
+            "when": _parse_commence_time(ct),
+            "prices": prices,
+        })
+    return parsed
+
+
+def store_odds(db: Session, events: List[Dict]) -> Dict:
+    """
+    Upsert a whole provider payload with set-based statements in one transaction:
+    one round trip each for sports, teams, matches and odds, plus an id lookup for
+    each of them. Odds rows are only rewritten when a price actually changed.
+    """
+    parsed = parse_events(events)
+    now = datetime.utcnow()
+
+    # Sports
+    sport_names = sorted({ev["sport_name"] for ev in parsed})
+    if sport_names:
+        db.execute(
+            dialect_insert(db, models.Sport)
+            .values([{"sport_name": n} for n in sport_names])
+            .on_conflict_do_nothing(index_elements=["sport_name"])
+        )
+    sport_ids = dict(db.execute(
+        select(models.Sport.sport_name, models.Sport.sport_id).where(models.Sport.sport_name.in_(sport_names))
+    ).all()) if sport_names else {}
+
+    # Teams
+    team_sport = {}
+    for ev in parsed:
+        for name in (ev["home"], ev["away"]):
+            team_sport.setdefault(name, sport_ids[ev["sport_name"]])
+    if team_sport:
+        db.execute(
+            dialect_insert(db, models.SportsTeam)
+            .values([{"sport_id": sid, "team_name": n} for n, sid in sorted(team_sport.items())])
+            .on_conflict_do_nothing(index_elements=["team_name"])
+        )
+    team_ids = dict(db.execute(
+        select(models.SportsTeam.team_name, models.SportsTeam.sports_teamsid)
+        .where(models.SportsTeam.team_name.in_(list(team_sport)))
+    ).all()) if team_sport else {}
+
+    # Matches
+    fixtures = {
+        (sport_ids[ev["sport_name"]], team_ids[ev["home"]], team_ids[ev["away"]], ev["when"]): ev
+        for ev in parsed
+    }
+    if fixtures:
+        db.execute(
+            dialect_insert(db, models.Match)
+            .values([
+                {"sport_id": s, "team1_id": t1, "team2_id": t2, "match_date": when, "location": "TBD"}
+                for (s, t1, t2, when) in fixtures
+            ])
+            .on_conflict_do_nothing(index_elements=["sport_id", "team1_id", "team2_id", "match_date"])
+        )
+    fixture_cols = (
+        models.Match.sport_id,
+        models.Match.team1_id,
+        models.Match.team2_id,
+        models.Match.match_date,
+    )
+    match_ids = {
+        tuple(r[:4]): r.match_id
+        for r in db.execute(
+            select(*fixture_cols, models.Match.match_id).where(tuple_(*fixture_cols).in_(list(fixtures)))
+        ).all()
+    } if fixtures else {}
+
+    # Odds
+    odds_rows = {}
+    for key, ev in fixtures.items():
+        for (book_name, market), (o1, o2, point) in ev["prices"].items():
+            odds_rows[(match_ids[key], book_name, market)] = {
+                "match_id": match_ids[key],
+                "sports_books": book_name,
+                "market": market,
+                "odds_team1": o1,
+                "odds_team2": o2,
+                "point": point,
+                "updated_at": now,
+            }
+
+    changed = []
+    if odds_rows:
+        ins = dialect_insert(db, models.BettingOdds).values(list(odds_rows.values()))
+        table = models.BettingOdds.__table__
+        stmt = ins.on_conflict_do_update(
+            index_elements=["match_id", "sports_books", "market"],
+            set_={
+                "odds_team1": ins.excluded.odds_team1,
+                "odds_team2": ins.excluded.odds_team2,
+                "point": ins.excluded.point,
+                "updated_at": ins.excluded.updated_at,
+            },
+            where=or_(
+                table.c.odds_team1.is_distinct_from(ins.excluded.odds_team1),
+                table.c.odds_team2.is_distinct_from(ins.excluded.odds_team2),
+                table.c.point.is_distinct_from(ins.excluded.point),
+            ),
+        ).returning(
+            table.c.match_id,
+            table.c.sports_books,
+            table.c.market,
+            table.c.odds_team1,
+            table.c.odds_team2,
+            table.c.point,
+        )
+        changed = [tuple(r) for r in db.execute(stmt).all()]
+
+    # New and repriced rows are exactly what RETURNING gave us, so history only grows on change.
+    # render_nulls keeps this one executemany: otherwise the ORM drops None keys
+    # and rows with and without a point would go out as separate statements.
+    if changed:
+        db.execute(
+            insert(models.OddsSnapshot),
+            [
+                {
+                    "match_id": match_id,
+                    "sports_books": book,
+                    "market": market,
+                    "odds_team1": o1,
+                    "odds_team2": o2,
+                    "point": point,
+                    "captured_at": now,
+                }
+                for match_id, book, market, o1, o2, point in changed
+            ],
+            execution_options={"render_nulls": True},
+        )
+
+    db.commit()
+    upcoming = [ev["when"] for ev in parsed if ev["when"] >= now]
+    return {
+        "events": len(parsed),
+        "teams": len(team_ids),
+        "matches": len(match_ids),
+        "odds_seen": len(odds_rows),
+        "odds_changed": len(changed),
+        "changed": changed,
+        "match_sports": {match_ids[key]: ev["sport_name"] for key, ev in fixtures.items()},
+        "next_kickoff": min(upcoming) if upcoming else None,
+    }
+
+
+def store_scores(db: Session, events: List[Dict]) -> Dict:
+    """Write the final score of every completed event we have a match for, then update ratings."""
+    # ratings (and bets and backtest behind it) is only needed once scores arrive, not at startup.
+    import ratings
+
+    finals = {}
+    for ev in events:
+        home, away, ct = ev.get("home_team"), ev.get("away_team"), ev.get("commence_time")
+        points = {s.get("name"): s.get("score") for s in ev.get("scores") or []}
+        if not (ev.get("completed") and home and away and ct) or points.get(home) is None or points.get(away) is None:
+            continue
+        finals[(home, away, _parse_commence_time(ct))] = (int(points[home]), int(points[away]))
+    if not finals:
+        return ratings.record_final_scores(db, {})
+
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    key = (team1.team_name, team2.team_name, models.Match.match_date)
+    rows = db.execute(
+        select(models.Match.match_id, *key)
+        .join(team1, models.Match.team1_id == team1.sports_teamsid)
+        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+        .where(tuple_(*key).in_(list(finals)))
+    ).all()
+    return ratings.record_final_scores(db, {r.match_id: finals[tuple(r[1:])] for r in rows})
+
+
+def _store_in_new_session(session_factory: Callable[[], Session], events: List[Dict]) -> Dict:
+    db = session_factory()
+    try:
+        stats = store_odds(db, events)
+        # New matches and repriced matches are the only ones whose predictions can be stale.
+        changed_matches = {row[0] for row in stats["changed"]}
+        stats["predictions_written"] = (
+            predictions.materialize_predictions(db, match_ids=changed_matches) if changed_matches else 0
+        )
+        if stats["odds_changed"] or stats["predictions_written"]:
+            stats["data_version"] = cache.bump_data_version()
+        return stats
+    finally:
+        db.close()
+
+
+async def fetch_and_store_odds(session_factory: Callable[[], Session], client: OddsApiClient) -> Dict:
+    """Fetch every configured sport/market and store it off the event loop."""
+    events = await client.fetch_all()
+    return await asyncio.to_thread(_store_in_new_session, session_factory, events)
+
+
+def _store_scores_in_new_session(session_factory: Callable[[], Session], events: List[Dict]) -> Dict:
+    db = session_factory()
+    try:
+        stats = store_scores(db, events)
+        if stats["scores_written"] or stats["predictions_written"]:
+            stats["data_version"] = cache.bump_data_version()
+        return stats
+    finally:
+        db.close()
+
+
+async def fetch_and_store_scores(session_factory: Callable[[], Session], client: OddsApiClient) -> Dict:
+    """Pull recent final scores for every configured sport and feed them to the rating engine."""
+    results = await asyncio.gather(*(client.fetch_scores(s) for s in SPORTS))
+    events = [ev for payload in results for ev in payload]
+    return await asyncio.to_thread(_store_scores_in_new_session, session_factory, events)
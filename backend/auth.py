@@ -1,28 +1,170 @@
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from jose import jwt
-from passlib.context import CryptContext
-from dotenv import load_dotenv
-
-load_dotenv()
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 
+import cache
+import models
 
 SECRET_KEY = os.getenv("JWT_SECRET", "dev_secret_change_me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
-_pwd = CryptContext(schemes=["argon2"], deprecated="auto")
+# Principal caches: decoded tokens by token hash, and profile fields by user id.
+# Profiles are dropped when any worker commits a write to the user row
+# (cluster.py relays it); the TTL bounds how long a write can go unseen if that
+# message is lost.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "4096"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "300"))
+
+# argon2 cost (defaults are passlib's). Hashes made with other parameters still
+# verify and are upgraded on the next successful login; benchmarks/bench_hashing.py
+# measures candidate settings.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# Hashing runs on its own thread pool (argon2 releases the GIL) so a login burst
+# cannot occupy the request threadpool. At most WORKERS + QUEUE_DEPTH hashes are
+# admitted; past that callers get HashingOverloaded.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "16"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
+@lru_cache(maxsize=None)
+def _pwd():
+    """Built on first use, so passlib and argon2 are not imported until a password is hashed or checked."""
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["argon2"],
+        deprecated="auto",
+        argon2__rounds=ARGON2_TIME_COST,
+        argon2__memory_cost=ARGON2_MEMORY_COST,
+        argon2__parallelism=ARGON2_PARALLELISM,
+    )
 
 def hash_password(password: str) -> str:
-    return _pwd.hash(password)
+    return _pwd().hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    return _pwd.verify(password, hashed)
+    return _pwd().verify(password, hashed)
+
+def verify_and_update_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(matches, replacement hash if the stored one uses outdated parameters)."""
+    return _pwd().verify_and_update(password, hashed)
+
+
+class HashingOverloaded(RuntimeError):
+    """The hashing pool is full; retry after PASSWORD_HASH_RETRY_AFTER seconds."""
+
+
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_DEPTH)
+
+def _offload(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashingOverloaded()
+    future = _hash_pool.submit(fn, *args)
+    # Freed when the hash finishes, not when the caller stops waiting.
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return asyncio.wrap_future(future)
+
+async def hash_password_async(password: str) -> str:
+    return await _offload(hash_password, password)
+
+async def verify_and_update_password_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return await _offload(verify_and_update_password, password, hashed)
+
+# python-jose is imported on first use rather than at startup.
 
 def create_access_token(data: dict, minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
+    from jose import jwt
+
     to_encode = data.copy()
     to_encode["exp"] = datetime.utcnow() + timedelta(minutes=minutes)
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def decode_access_token(token: str) -> dict:
+    from jose import jwt
+
     return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
+_token_cache = cache.TTLCache(AUTH_TOKEN_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+
+def decode_access_token_cached(token: str) -> dict:
+    """decode_access_token, remembered until the cache TTL or the token's own exp, whichever is first."""
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = _token_cache.get(key)
+    if payload is None:
+        payload = decode_access_token(token)
+        exp = payload.get("exp")
+        _token_cache.put(key, payload, ttl=exp - time.time() if exp is not None else None)
+    return payload
+
+
+class Principal(NamedTuple):
+    id: int
+    name: str
+    email: str
+    role: Optional[str]
+
+
+_user_cache = cache.TTLCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+_user_lock = threading.Lock()
+_user_generation = 0
+
+def principal_generation() -> int:
+    """Read before loading a user, and pass to remember_principal()."""
+    return _user_generation
+
+def cached_principal(user_id: int) -> Optional[Principal]:
+    return _user_cache.get(user_id)
+
+def remember_principal(user: "models.User", generation: int) -> Principal:
+    principal = Principal(user.user_id, user.name, user.email, user.role)
+    with _user_lock:
+        # Skip the store if a user row was written while this one was being loaded.
+        if generation == _user_generation:
+            _user_cache.put(user.user_id, principal)
+    return principal
+
+def forget_principal(user_id: int, propagate: bool = True) -> None:
+    global _user_generation
+    with _user_lock:
+        _user_generation += 1
+        _user_cache.pop(user_id)
+    if propagate:
+        cache.notify_invalidation("user", user_id)
+
+# A write is only visible once committed: forgetting at flush would let a
+# concurrent request re-cache the old row before the commit. So the flush
+# notes the user ids and the commit forgets them. Ids noted in a transaction
+# that rolls back are forgotten at the session's next commit, which only costs
+# a cache miss.
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        forget_principal(target.user_id)
+        return
+    session.info.setdefault("changed_users", set()).add(target.user_id)
+
+@event.listens_for(Session, "after_commit")
+def _forget_committed_users(session):
+    for user_id in session.info.pop("changed_users", ()):
+        forget_principal(user_id)
+
+def cache_stats() -> dict:
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
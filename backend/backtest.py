@@ -0,0 +1,432 @@
+"""
+Backtest the logistic rating model against finished matches.
+
+Matches with a final score are loaded once into parallel columns (rating
+difference at kickoff, outcome, best h2h price per side at kickoff) and
+replayed in kickoff order. With numpy installed, grid_search scores the whole
+(scale x match) grid as array operations; without it, each scale is one pass
+over the columns and the ROI of every min-edge threshold comes from a single
+sort plus suffix sums. Either way large grids over several seasons stay cheap.
+
+CLI:
+    python backtest.py --from 2023-09-01 --scale-min 4 --scale-max 40 --steps 145
+"""
+import argparse
+import bisect
+import math
+import re
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session, aliased
+
+import models
+from predictions import RATING_SCALE
+
+CALIBRATION_BUCKETS = 10
+_EPS = 1e-15
+_SCORE_RE = re.compile(r"^\s*(\d+)\s*[-:]\s*(\d+)\s*$")
+
+
+def parse_final_score(final_score: Optional[str]):
+    """'24-17' (team1 first) -> (24, 17); anything else -> None."""
+    if not final_score:
+        return None
+    m = _SCORE_RE.match(final_score)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+class History(NamedTuple):
+    """Columnar view of finished matches, oldest first. Ties are left out."""
+    match_id: List[int]
+    match_date: List[datetime]
+    rating_diff: List[float]
+    team1_won: List[int]
+    odds_team1: List[Optional[float]]
+    odds_team2: List[Optional[float]]
+
+    @property
+    def size(self) -> int:
+        return len(self.match_id)
+
+
+def load_history(
+    db: Session,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    book: Optional[str] = None,
+) -> History:
+    """
+    Only what was known at kickoff is loaded. A team's rating is the one its
+    materialized Prediction recorded if that was computed before kickoff,
+    otherwise its rating after its last earlier match in TeamRatingHistory
+    (regressed over an off-season gap, as the rating engine does), or its
+    prior. Prices are each book's last h2h snapshot captured by kickoff, best
+    per side across books (or from `book` only).
+    """
+    import ratings  # ratings imports this module
+
+    m = models.Match
+    s = models.OddsSnapshot
+    h = models.TeamRatingHistory
+    window = [m.final_score.is_not(None)]
+    if date_from is not None:
+        window.append(m.match_date >= date_from)
+    if date_to is not None:
+        window.append(m.match_date <= date_to)
+
+    latest = func.row_number().over(
+        partition_by=(s.match_id, s.sports_books), order_by=(s.captured_at.desc(), s.snapshot_id.desc())
+    )
+    closing = (
+        select(s.match_id, s.odds_team1, s.odds_team2, latest.label("rn"))
+        .join(m, m.match_id == s.match_id)
+        .where(s.market == "h2h", s.captured_at <= m.match_date, *window)
+    )
+    if book is not None:
+        closing = closing.where(s.sports_books == book)
+    closing = closing.subquery()
+    prices = (
+        select(
+            closing.c.match_id,
+            func.max(closing.c.odds_team1).label("odds_team1"),
+            func.max(closing.c.odds_team2).label("odds_team2"),
+        )
+        .where(closing.c.rn == 1)
+        .group_by(closing.c.match_id)
+        .subquery()
+    )
+
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    before_kickoff = models.Prediction.computed_at <= m.match_date
+    rows = db.execute(
+        select(
+            m.match_id,
+            m.match_date,
+            m.final_score,
+            team1.team_name.label("team1"),
+            team2.team_name.label("team2"),
+            case((before_kickoff, models.Prediction.rating_team1)).label("rating1"),
+            case((before_kickoff, models.Prediction.rating_team2)).label("rating2"),
+            prices.c.odds_team1,
+            prices.c.odds_team2,
+        )
+        .join(team1, m.team1_id == team1.sports_teamsid)
+        .join(team2, m.team2_id == team2.sports_teamsid)
+        .outerjoin(models.Prediction, models.Prediction.match_id == m.match_id)
+        .outerjoin(prices, prices.c.match_id == m.match_id)
+        .where(m.match_date.is_not(None), *window)
+        .order_by(m.match_date, m.match_id)
+    ).all()
+    if not rows:
+        return History([], [], [], [], [], [])
+
+    # Walk the rating history alongside the matches, so each team's state is
+    # exactly what had been rated before the match being loaded.
+    history = db.execute(
+        select(h.team_name, h.rated_at, h.offense_rating, h.defense_rating, h.overall_rating)
+        .where(h.rated_at < rows[-1].match_date)
+        .order_by(h.rated_at, h.match_id)
+    ).all()
+    state: Dict[str, tuple] = {}
+    seen = 0
+
+    def at_kickoff(name: str, when: datetime) -> float:
+        rated = state.get(name)
+        if rated is None:
+            return ratings.prior(name).overall
+        r, last = rated
+        return (ratings.regress(r) if (when - last).days >= ratings.SEASON_GAP_DAYS else r).overall
+
+    out = History([], [], [], [], [], [])
+    for r in rows:
+        while seen < len(history) and history[seen].rated_at < r.match_date:
+            row = history[seen]
+            rating = ratings.Rating(row.offense_rating, row.defense_rating, row.overall_rating)
+            state[row.team_name] = (rating, row.rated_at)
+            seen += 1
+        score = parse_final_score(r.final_score)
+        if score is None or score[0] == score[1]:
+            continue
+        rating1 = r.rating1 if r.rating1 is not None else at_kickoff(r.team1, r.match_date)
+        rating2 = r.rating2 if r.rating2 is not None else at_kickoff(r.team2, r.match_date)
+        out.match_id.append(r.match_id)
+        out.match_date.append(r.match_date)
+        out.rating_diff.append(rating1 - rating2)
+        out.team1_won.append(1 if score[0] > score[1] else 0)
+        out.odds_team1.append(r.odds_team1 if r.odds_team1 and r.odds_team1 > 1.0 else None)
+        out.odds_team2.append(r.odds_team2 if r.odds_team2 and r.odds_team2 > 1.0 else None)
+    return out
+
+
+def _probs(diffs: Sequence[float], scale: float) -> List[float]:
+    exp = math.exp
+    return [1.0 / (1.0 + exp(-d / scale)) for d in diffs]
+
+
+def _value_bets(h: History, p1s: Sequence[float]):
+    """(edge in percentage points, profit on a 1-unit stake, index) of the value side of every priced match."""
+    bets = []
+    for i, (p1, o1, o2, won) in enumerate(zip(p1s, h.odds_team1, h.odds_team2, h.team1_won)):
+        e1 = (p1 - 1.0 / o1) * 100 if o1 is not None else -math.inf
+        e2 = ((1.0 - p1) - 1.0 / o2) * 100 if o2 is not None else -math.inf
+        if e1 == -math.inf and e2 == -math.inf:
+            continue
+        if e1 >= e2:
+            bets.append((e1, o1 - 1.0 if won else -1.0, i))
+        else:
+            bets.append((e2, o2 - 1.0 if not won else -1.0, i))
+    return bets
+
+
+def _scores(h: History, p1s: Sequence[float]) -> Dict[str, float]:
+    log = math.log
+    ll = brier = hits = 0.0
+    for p, y in zip(p1s, h.team1_won):
+        p = min(max(p, _EPS), 1.0 - _EPS)
+        ll -= log(p) if y else log(1.0 - p)
+        brier += (p - y) ** 2
+        hits += (p >= 0.5) == bool(y)
+    n = len(p1s) or 1
+    return {"log_loss": ll / n, "brier": brier / n, "accuracy": hits / n}
+
+
+def calibration(h: History, p1s: Sequence[float], buckets: int = CALIBRATION_BUCKETS) -> List[Dict]:
+    """Mean predicted vs observed team1 win rate per probability bucket."""
+    n = [0] * buckets
+    pred = [0.0] * buckets
+    obs = [0] * buckets
+    for p, y in zip(p1s, h.team1_won):
+        b = min(int(p * buckets), buckets - 1)
+        n[b] += 1
+        pred[b] += p
+        obs[b] += y
+    return [
+        {
+            "bucket": f"{b / buckets:.1f}-{(b + 1) / buckets:.1f}",
+            "matches": n[b],
+            "predicted": pred[b] / n[b],
+            "observed": obs[b] / n[b],
+        }
+        for b in range(buckets)
+        if n[b]
+    ]
+
+
+def replay_roi(h: History, p1s: Sequence[float], min_edge: float = 0.0) -> Dict:
+    """Flat 1-unit stakes on the value side, in kickoff order, whenever the edge exceeds min_edge."""
+    bankroll = peak = drawdown = 0.0
+    bets = wins = 0
+    for edge, profit, _ in _value_bets(h, p1s):
+        if edge <= min_edge:
+            continue
+        bets += 1
+        wins += profit > 0
+        bankroll += profit
+        peak = max(peak, bankroll)
+        drawdown = max(drawdown, peak - bankroll)
+    return {
+        "bets": bets,
+        "win_rate": wins / bets if bets else None,
+        "profit": bankroll,
+        "roi": bankroll / bets if bets else None,
+        "max_drawdown": drawdown,
+    }
+
+
+def evaluate(h: History, scale: float = RATING_SCALE, min_edge: float = 0.0) -> Dict:
+    p1s = _probs(h.rating_diff, scale)
+    return {
+        "scale": scale,
+        "matches": h.size,
+        **_scores(h, p1s),
+        "calibration": calibration(h, p1s),
+        "value_bets": replay_roi(h, p1s, min_edge),
+    }
+
+
+def _prepare(h: History):
+    """Scale-independent columns for grid_search: outcome-signed rating diffs, book probabilities, payouts."""
+    inf = math.inf
+    signed = [d if y else -d for d, y in zip(h.rating_diff, h.team1_won)]
+    book1 = [1.0 / o if o is not None else inf for o in h.odds_team1]
+    book2 = [1.0 / o if o is not None else inf for o in h.odds_team2]
+    pay1 = [(o - 1.0 if y else -1.0) if o is not None else 0.0 for o, y in zip(h.odds_team1, h.team1_won)]
+    pay2 = [(o - 1.0 if not y else -1.0) if o is not None else 0.0 for o, y in zip(h.odds_team2, h.team1_won)]
+    hits = sum((d >= 0) == bool(y) for d, y in zip(h.rating_diff, h.team1_won))
+    return signed, h.team1_won, book1, book2, pay1, pay2, hits
+
+
+def _numpy():
+    """
+    numpy, or None if it is not installed. Imported on first use: bets, ratings
+    and simulation import this module, and numpy alone would add more to the
+    server's start-up than all of them.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _grid_arrays(np, h: History, scales: Sequence[float], thresholds: Sequence[float]) -> List[Dict]:
+    """grid_search with numpy: every scale at once as a (scales x matches) array."""
+    *columns, hits = _prepare(h)
+    signed, won, book1, book2, pay1, pay2 = (np.asarray(c, dtype=float) for c in columns)
+    n = h.size
+    z = -signed[None, :] / np.asarray(scales, dtype=float)[:, None]
+    # exp overflow past 700: the realized outcome had ~0 model probability.
+    overflow = z > 700.0
+    e = np.exp(np.minimum(z, 700.0))
+    q = np.where(overflow, 0.0, 1.0 / (1.0 + e))  # model probability of what actually happened
+    ll = np.where(overflow, -math.log(_EPS), np.log1p(e)).sum(axis=1)
+    brier = np.where(overflow, 1.0, (e * q) ** 2).sum(axis=1)
+    p1 = np.where(won == 1, q, 1.0 - q)
+    e1 = (p1 - book1) * 100
+    e2 = (1.0 - p1 - book2) * 100
+    team1_side = e1 >= e2
+    edge = np.where(team1_side, e1, e2)
+    pay = np.where(team1_side, pay1, pay2)
+    out = []
+    for i, scale in enumerate(scales):
+        scores = {"log_loss": ll[i] / n, "brier": brier[i] / n, "accuracy": hits / n}
+        for t in thresholds:
+            taken = edge[i] > t
+            count = int(taken.sum())
+            profit = float(pay[i][taken].sum())
+            out.append({
+                "scale": scale,
+                "min_edge": t,
+                **{k: float(v) for k, v in scores.items()},
+                "bets": count,
+                "profit": profit,
+                "roi": profit / count if count else None,
+            })
+    return out
+
+
+def grid_search(h: History, scales: Sequence[float], min_edges: Sequence[float] = (0.0,)) -> List[Dict]:
+    """
+    Score every (scale, min_edge) pair. Without numpy each scale is one pass
+    over the prepared columns (one exp per match gives log-loss, Brier and
+    both edges); the value bets are then sorted by edge once so the bet count
+    and profit above any threshold are a bisect into suffix sums.
+    """
+    n = h.size
+    if not n:
+        return []
+    thresholds = sorted(min_edges)
+    np = _numpy()
+    if np is not None:
+        return _grid_arrays(np, h, scales, thresholds)
+    signed, won, book1, book2, pay1, pay2, hits = _prepare(h)
+    exp, log1p, inf = math.exp, math.log1p, math.inf
+    out = []
+    for scale in scales:
+        ll = brier = 0.0
+        bets = []
+        for x, y, b1, b2, w1, w2 in zip(signed, won, book1, book2, pay1, pay2):
+            z = -x / scale
+            if z > 700.0:
+                # exp overflow: the realized outcome had ~0 model probability.
+                ll -= math.log(_EPS)
+                brier += 1.0
+                q = 0.0
+            else:
+                e = exp(z)
+                ll += log1p(e)
+                q = 1.0 / (1.0 + e)  # model probability of what actually happened
+                brier += (e * q) ** 2
+            p1 = q if y else 1.0 - q
+            e1 = (p1 - b1) * 100
+            e2 = (1.0 - p1 - b2) * 100
+            if e1 >= e2:
+                if e1 != -inf:
+                    bets.append((e1, w1))
+            else:
+                bets.append((e2, w2))
+        bets.sort()
+        edges = [b[0] for b in bets]
+        suffix = [0.0] * (len(bets) + 1)
+        running = 0.0
+        for i in range(len(bets) - 1, -1, -1):
+            running += bets[i][1]
+            suffix[i] = running
+        scores = {"log_loss": ll / n, "brier": brier / n, "accuracy": hits / n}
+        for t in thresholds:
+            start = bisect.bisect_right(edges, t)
+            count = len(bets) - start
+            out.append({
+                "scale": scale,
+                "min_edge": t,
+                **scores,
+                "bets": count,
+                "profit": suffix[start],
+                "roi": suffix[start] / count if count else None,
+            })
+    return out
+
+
+def scale_grid(scale_min: float, scale_max: float, steps: int) -> List[float]:
+    if steps <= 1:
+        return [scale_min]
+    step = (scale_max - scale_min) / (steps - 1)
+    return [scale_min + i * step for i in range(steps)]
+
+
+def run(
+    db: Session,
+    scales: Sequence[float],
+    min_edges: Sequence[float] = (0.0,),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    book: Optional[str] = None,
+) -> Dict:
+    """The current model's report, the full grid, and the best scale by log-loss and by ROI."""
+    h = load_history(db, date_from, date_to, book)
+    grid = grid_search(h, scales, min_edges)
+    by_ll = min(grid, key=lambda g: g["log_loss"]) if grid else None
+    with_bets = [g for g in grid if g["bets"]]
+    by_roi = max(with_bets, key=lambda g: g["roi"]) if with_bets else None
+    return {
+        "matches": h.size,
+        "current": evaluate(h, RATING_SCALE) if h.size else None,
+        "best_log_loss": evaluate(h, by_ll["scale"]) if by_ll else None,
+        "best_roi": by_roi,
+        "grid": grid,
+    }
+
+
+def main() -> None:
+    from database import ReadSessionLocal
+    import json
+
+    parser = argparse.ArgumentParser(description="Backtest the rating model over finished matches.")
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat)
+    parser.add_argument("--book")
+    parser.add_argument("--scale-min", type=float, default=4.0)
+    parser.add_argument("--scale-max", type=float, default=40.0)
+    parser.add_argument("--steps", type=int, default=73)
+    parser.add_argument("--min-edge", type=float, nargs="+", default=[0.0, 2.0, 5.0])
+    parser.add_argument("--full-grid", action="store_true", help="print every grid point")
+    args = parser.parse_args()
+
+    db = ReadSessionLocal()
+    try:
+        report = run(
+            db, scale_grid(args.scale_min, args.scale_max, args.steps), args.min_edge,
+            args.date_from, args.date_to, args.book,
+        )
+    finally:
+        db.close()
+    if not args.full_grid:
+        report.pop("grid")
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
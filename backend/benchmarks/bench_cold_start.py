@@ -0,0 +1,205 @@
+"""
+Cold start benchmark: how long a fresh `uvicorn main:app` process takes to
+answer its first request, and where the time goes.
+
+    python benchmarks/bench_cold_start.py --database-url postgresql://... --runs 5
+    python benchmarks/bench_cold_start.py --no-bytecode-cache --importtime
+
+Each run starts a new server process and polls --route until it gets a 200;
+time to first request is measured from just before the process is spawned.
+The app's own view (importing main, the lifespan's startup work, first
+response) comes from app_startup_seconds on /metrics, and a bare
+`python -c pass` is timed as the floor for interpreter start-up.
+
+--no-bytecode-cache gives every run an empty __pycache__ (PYTHONPYCACHEPREFIX),
+like a fresh container image without compiled bytecode. --importtime prints the
+slowest imports under main, from `python -X importtime`, and the CPU time and
+module count of `import main`, which are steadier on a busy machine than the
+wall-clock timings and show what deferring an import saved. The scheduler is off
+in the benchmarked processes, so no provider calls are made. Without
+--database-url a throwaway SQLite database is used.
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+import httpx
+
+_STARTUP_LINE = re.compile(r'^app_startup_seconds\{phase="([^"]+)"\} (\S+)$', re.M)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def interpreter_ms(runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def cold_start(env: Dict[str, str], route: str, timeout: float) -> Dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        with httpx.Client(base_url=base, timeout=timeout) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"server exited with {proc.returncode}: {proc.stderr.read().decode()[-2000:]}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"no response from {route} within {timeout:.0f}s")
+                try:
+                    sent = time.perf_counter()
+                    r = client.get(route)
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if r.status_code == 200:
+                    break
+                raise RuntimeError(f"{route} answered {r.status_code}: {r.text[:200]}")
+            done = time.perf_counter()
+            phases = {k: float(v) * 1000 for k, v in _STARTUP_LINE.findall(client.get("/metrics").text)}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return {
+        "first_request_ms": (done - started) * 1000,
+        "first_request_latency_ms": (done - sent) * 1000,
+        "import_ms": phases.get("import"),
+        "lifespan_ms": phases.get("lifespan"),
+        "app_first_response_ms": phases.get("first_request"),
+    }
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict]:
+    """Top-level imports of main by cumulative time (us), slowest first."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in out.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        # Depth 1 (two spaces) is what main imports directly.
+        if m and len(m.group(3)) == 2:
+            rows.append({"module": m.group(4), "self_us": int(m.group(1)), "cumulative_us": int(m.group(2))})
+    return sorted(rows, key=lambda r: r["cumulative_us"], reverse=True)[:top]
+
+
+def import_footprint(env: Dict[str, str], runs: int) -> Dict:
+    """Median CPU time of `import main` and the number of modules it leaves loaded."""
+    code = "import time; t = time.process_time(); import sys, main; print(time.process_time() - t, len(sys.modules))"
+    samples, modules = [], 0
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        samples.append(float(out[0]) * 1000)
+        modules = int(out[1])
+    return {"cpu_ms": statistics.median(samples), "modules": modules}
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    keys = [k for k in runs[0] if all(r.get(k) is not None for r in runs)]
+    return {k: {"median": statistics.median(r[k] for r in runs), "min": min(r[k] for r in runs)} for k in keys}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--route", default="/odds?upcoming=true", help="the first request to time")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--no-bytecode-cache", action="store_true", help="start every run with an empty __pycache__")
+    parser.add_argument("--importtime", action="store_true", help="also print the slowest imports under main")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change in time to first request")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.database_url or f"sqlite:///{scratch.name}/cold_start.db",
+        "ODDS_SCHEDULER_ENABLED": "false",
+    }
+    runs = []
+    for i in range(args.runs):
+        run_env = dict(env)
+        if args.no_bytecode_cache:
+            run_env["PYTHONPYCACHEPREFIX"] = os.path.join(scratch.name, f"pycache-{i}")
+        runs.append(cold_start(run_env, args.route, args.timeout))
+        print(", ".join(f"{k} {v:.0f}" for k, v in runs[-1].items() if v is not None))
+
+    results = {
+        "route": args.route,
+        "bytecode_cache": not args.no_bytecode_cache,
+        "interpreter_ms": interpreter_ms(args.runs),
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+    print(f"\ninterpreter start {results['interpreter_ms']:.0f} ms (python -c pass)")
+    for key, stats in results["summary"].items():
+        print(f"{key:26s} median {stats['median']:7.0f} ms   min {stats['min']:7.0f} ms")
+
+    if args.importtime:
+        results["imports"] = slowest_imports(env, 15)
+        print("\nslowest imports under main (cumulative ms):")
+        for row in results["imports"]:
+            print(f"  {row['module']:32s} {row['cumulative_us'] / 1000:7.1f}")
+        results["import_footprint"] = import_footprint(env, max(args.runs, 5))
+        footprint = results["import_footprint"]
+        print(f"\nimport main: {footprint['cpu_ms']:.0f} ms CPU (median), {footprint['modules']} modules loaded")
+
+    regressed: Optional[str] = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        base = baseline["summary"]["first_request_ms"]["median"]
+        now = results["summary"]["first_request_ms"]["median"]
+        print(f"\ntime to first request {now:.0f} ms vs baseline {base:.0f} ms ({now / base:.2f}x)")
+        if "import_footprint" in results and "import_footprint" in baseline:
+            was, footprint = baseline["import_footprint"], results["import_footprint"]
+            print(
+                f"import main {footprint['cpu_ms']:.0f} ms CPU vs {was['cpu_ms']:.0f} ms, "
+                f"{footprint['modules']} modules vs {was['modules']}"
+            )
+        if now > base * (1 + args.tolerance):
+            regressed = f"time to first request {now:.0f} ms vs {base:.0f} ms"
+            print(f"REGRESSION: {regressed}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    scratch.cleanup()
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Cost of candidate argon2 parameters, to pick ARGON2_TIME_COST / ARGON2_MEMORY_COST /
+ARGON2_PARALLELISM for this hardware.
+
+    python benchmarks/bench_hashing.py --threads 4
+
+For every combination it reports the median hash time and the hashes/second the
+pool sustains with --threads workers. Aim for a median well under the login
+latency budget while hashes/second still covers the expected login burst
+(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_DEPTH are admitted at once).
+"""
+import argparse
+import itertools
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import argon2
+
+
+def bench(time_cost: int, memory_cost: int, parallelism: int, samples: int, threads: int):
+    handler = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    stored = handler.hash("correct horse battery staple")
+
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.verify("correct horse battery staple", stored)
+        times.append(time.perf_counter() - start)
+
+    burst = samples * threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: handler.verify("correct horse battery staple", stored), range(burst)))
+    throughput = burst / (time.perf_counter() - start)
+    return statistics.median(times) * 1000, throughput
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--time-cost", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--memory-cost", type=int, nargs="+", default=[19456, 65536], help="KiB")
+    parser.add_argument("--parallelism", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'time':>5} {'memory KiB':>11} {'par':>4} {'median ms':>10} {'hashes/s':>9}")
+    for t, m, p in itertools.product(args.time_cost, args.memory_cost, args.parallelism):
+        median_ms, per_second = bench(t, m, p, args.samples, args.threads)
+        print(f"{t:5d} {m:11d} {p:4d} {median_ms:10.1f} {per_second:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
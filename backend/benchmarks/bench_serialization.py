@@ -0,0 +1,177 @@
+"""
+Micro-benchmark of the /odds and /ai-predictions response bodies: the cost per
+row of turning a 500-row page of query results into JSON bytes, the way the
+endpoints used to (a dict per row built from Row attributes, isoformat() per
+row, json.dumps) and through serialize.py (column-wise, one encoder pass), plus
+what compressing the body costs and saves.
+
+    python benchmarks/bench_serialization.py --rows 500 --repeat 200
+
+The rows come from queries.odds_rows / queries.prediction_rows against a
+throwaway SQLite database seeded with benchmarks/fixtures.py, so the timings
+cover the real Row objects and exclude the query itself. Set DATABASE_URL to
+run against another (empty) database instead.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import fixtures
+
+
+def legacy_odds(rows) -> List[Dict]:
+    return [
+        {
+            "match_id": r.match_id,
+            "team1": r.team1,
+            "team2": r.team2,
+            "sports_books": r.sports_books,
+            "odds_team1": r.odds_team1,
+            "odds_team2": r.odds_team2,
+            "point": r.point,
+            "match_date": r.match_date.isoformat() if isinstance(r.match_date, datetime) else r.match_date,
+        }
+        for r in rows
+    ]
+
+
+def legacy_predictions(rows) -> List[Dict]:
+    import predictions
+
+    scored = predictions.score_slate(
+        [r.model_prob_team1 for r in rows],
+        [r.odds_team1 for r in rows],
+        [r.odds_team2 for r in rows],
+    )
+    out = []
+    for i, r in enumerate(rows):
+        side = scored["value_side"][i]
+        out.append({
+            "match_id": r.match_id,
+            "team1": r.team1,
+            "team2": r.team2,
+            "sports_books": r.sports_books,
+            "odds_team1": r.odds_team1,
+            "odds_team2": r.odds_team2,
+            "match_date": r.match_date.isoformat() if hasattr(r.match_date, "isoformat") else r.match_date,
+            "model_prob_team1": scored["model_prob_team1"][i],
+            "model_prob_team2": scored["model_prob_team2"][i],
+            "book_prob_team1": scored["book_prob_team1"][i],
+            "book_prob_team2": scored["book_prob_team2"][i],
+            "edge_team1": scored["edge_team1"][i],
+            "edge_team2": scored["edge_team2"][i],
+            "best_edge": scored["best_edge"][i],
+            "value_side": r.team1 if side == "team1" else r.team2 if side == "team2" else None,
+        })
+    return out
+
+
+def legacy_dumps(content) -> bytes:
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def lean_odds(rows) -> List[Dict]:
+    import main
+    import serialize
+
+    cols = serialize.columns(rows)
+    cols["match_date"] = serialize.iso(cols["match_date"])
+    return serialize.records(main.ODDS_FIELDS, [cols[n] for n in main.ODDS_FIELDS])
+
+
+def per_row_us(fn: Callable[[], bytes], rows: int, repeat: int) -> float:
+    fn()
+    best = float("inf")
+    # Best of five batches: the least disturbed estimate of the steady-state cost.
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return best / rows * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200, help="encodes per timing batch")
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    scratch = None
+    if not os.getenv("DATABASE_URL"):
+        scratch = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{scratch.name}/bench_serialization.db"
+    os.environ.setdefault("ODDS_SCHEDULER_ENABLED", "false")
+
+    import database
+    import predictions
+    import queries
+    import serialize
+
+    fixtures.reset_schema(database.engine)
+    db = database.SessionLocal()
+    try:
+        fixtures.seed(db, seasons=1, books=args.books, snapshots=0, users=0)
+        window = (datetime.min, datetime.max)
+        odds = db.execute(queries.odds_rows(*window, "h2h", args.rows)).all()[:args.rows]
+        preds = db.execute(queries.prediction_rows(*window, args.rows)).all()[:args.rows]
+    finally:
+        db.close()
+        database.engine.dispose()
+
+    if lean_odds(odds) != legacy_odds(odds) or predictions.rows_with_predictions(preds) != legacy_predictions(preds):
+        sys.exit("lean and legacy bodies differ")
+
+    results = {"rows": len(odds), "encoder": "orjson" if serialize.orjson is not None else "json", "endpoints": {}}
+    cases = {
+        "/odds": (odds, lambda: legacy_dumps(legacy_odds(odds)), lambda: serialize.dumps(lean_odds(odds))),
+        "/ai-predictions": (
+            preds,
+            lambda: legacy_dumps(legacy_predictions(preds)),
+            lambda: serialize.dumps(predictions.rows_with_predictions(preds)),
+        ),
+    }
+    for route, (rows, before, after) in cases.items():
+        body = after()
+        entry = {
+            "before_us_per_row": per_row_us(before, len(rows), args.repeat),
+            "after_us_per_row": per_row_us(after, len(rows), args.repeat),
+            "bytes": len(body),
+        }
+        entry["speedup"] = entry["before_us_per_row"] / entry["after_us_per_row"]
+        for coding in ("gzip", "br"):
+            if coding == "br" and serialize.brotli is None:
+                continue
+            entry[f"{coding}_bytes"] = len(serialize.compress(body, coding))
+            entry[f"{coding}_us_per_row"] = per_row_us(lambda: serialize.compress(body, coding), len(rows), max(1, args.repeat // 4))
+        results["endpoints"][route] = entry
+
+    print(f"{results['rows']} rows per response, encoder: {results['encoder']}")
+    for route, entry in results["endpoints"].items():
+        line = (
+            f"{route:16s} before {entry['before_us_per_row']:6.2f} us/row  after {entry['after_us_per_row']:6.2f} us/row"
+            f"  ({entry['speedup']:.1f}x)  {entry['bytes']} bytes"
+        )
+        for coding in ("gzip", "br"):
+            if f"{coding}_bytes" in entry:
+                line += f", {coding} {entry[f'{coding}_bytes']} (+{entry[f'{coding}_us_per_row']:.2f} us/row)"
+        print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if scratch is not None:
+        scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
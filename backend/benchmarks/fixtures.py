@@ -0,0 +1,189 @@
+"""
+Synthetic, seeded database for benchmarks: several NFL seasons of matches with
+odds from every book in all three markets, h2h price history, final scores for
+the games already played, ratings and predictions rebuilt from those results,
+and benchmark users.
+
+    python benchmarks/fixtures.py --database-url postgresql://... --seasons 5 --books 10 --reset
+
+The latest season is centred on today, so /odds?upcoming=true and
+/ai-predictions have two weeks of fixtures ahead of them. The same --seed gives
+the same schedule, prices and scores on any database.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WEEKS = 18
+MARKETS = ("h2h", "spreads", "totals")
+BENCH_PASSWORD = "benchmark-password"
+
+
+def bench_email(i: int) -> str:
+    return f"bench{i:04d}@example.com"
+
+
+def price(p: float, vig: float) -> float:
+    """Decimal odds for win probability p with the book's margin; a heavy favourite still pays at least 1.01."""
+    return max(1.01, round(1 / (p * vig), 2))
+
+
+def seed(db, seasons: int = 3, books: int = 8, snapshots: int = 4, users: int = 50, rng_seed: int = 0) -> Dict:
+    """Fill an empty schema through `db` (a Session) and return row counts."""
+    from sqlalchemy import insert
+
+    import auth
+    import models
+    import predictions
+    import ratings
+
+    rng = random.Random(rng_seed)
+    started = time.perf_counter()
+
+    sport_id = db.scalar(insert(models.Sport).values(sport_name="American Football").returning(models.Sport.sport_id))
+    names = [r["team_name"] for r in ratings.NFL_INITIAL_RATINGS]
+    team_ids = dict(zip(names, db.scalars(
+        insert(models.SportsTeam).returning(models.SportsTeam.sports_teamsid, sort_by_parameter_order=True),
+        [{"sport_id": sport_id, "team_name": n} for n in names],
+    )))
+    strength = {n: rng.gauss(0, 6) for n in names}
+
+    # Weekly slates; the last season's middle week is this week.
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    current_kickoff = now - timedelta(weeks=WEEKS // 2)
+    fixtures = []
+    for s in range(seasons):
+        season_start = current_kickoff - timedelta(weeks=52 * (seasons - 1 - s))
+        for week in range(WEEKS):
+            order = rng.sample(names, len(names))
+            for g in range(0, len(order), 2):
+                when = season_start + timedelta(weeks=week, minutes=5 * g)
+                home, away = order[g], order[g + 1]
+                score = None
+                if when < now:
+                    margin = strength[home] - strength[away] + 2.5 + rng.gauss(0, 13)
+                    base = rng.randint(13, 27)
+                    score = f"{max(0, round(base + margin / 2))}-{max(0, round(base - margin / 2))}"
+                fixtures.append({
+                    "sport_id": sport_id,
+                    "team1_id": team_ids[home],
+                    "team2_id": team_ids[away],
+                    "match_date": when,
+                    "final_score": score,
+                    "_p": 1 / (1 + 10 ** (-(strength[home] - strength[away] + 2.5) / 20)),
+                })
+    # render_nulls: upcoming matches have no final_score, and without it every
+    # switch between NULL and non-NULL rows would start a new statement.
+    bulk = {"render_nulls": True}
+    match_ids = list(db.scalars(
+        insert(models.Match).returning(models.Match.match_id, sort_by_parameter_order=True),
+        [{k: v for k, v in f.items() if k != "_p"} for f in fixtures],
+        execution_options=bulk,
+    ))
+
+    odds_rows, snapshot_rows = [], []
+    for match_id, f in zip(match_ids, fixtures):
+        p = f["_p"]
+        for b in range(books):
+            book = f"Book {b:02d}"
+            vig = rng.uniform(1.03, 1.06)
+            drift = [rng.gauss(0, 0.02) for _ in range(snapshots)]
+            for k in range(snapshots):
+                q = min(max(p + sum(drift[:k + 1]), 0.03), 0.97)
+                snapshot_rows.append({
+                    "match_id": match_id,
+                    "sports_books": book,
+                    "market": "h2h",
+                    "odds_team1": price(q, vig),
+                    "odds_team2": price(1 - q, vig),
+                    "captured_at": f["match_date"] - timedelta(hours=24 * (snapshots - k)),
+                })
+            last = snapshot_rows[-1] if snapshots else None
+            for market in MARKETS:
+                if market == "h2h":
+                    o1 = last["odds_team1"] if last else price(p, vig)
+                    o2 = last["odds_team2"] if last else price(1 - p, vig)
+                    point = None
+                else:
+                    o1 = o2 = 1.91
+                    point = round((0.5 - p) * 28 * 2) / 2 if market == "spreads" else 44.5
+                odds_rows.append({
+                    "match_id": match_id, "sports_books": book, "market": market,
+                    "odds_team1": o1, "odds_team2": o2, "point": point, "updated_at": now,
+                })
+    db.execute(insert(models.BettingOdds), odds_rows, execution_options=bulk)
+    if snapshot_rows:
+        db.execute(insert(models.OddsSnapshot), snapshot_rows)
+
+    password_hash = auth.hash_password(BENCH_PASSWORD)
+    if users:
+        db.execute(insert(models.User), [
+            {"name": f"bench{i}", "email": bench_email(i), "role": "user", "password_hash": password_hash}
+            for i in range(users)
+        ])
+    db.commit()
+
+    rated = ratings.rebuild(db)
+    written = predictions.materialize_predictions(db)
+    return {
+        "matches": len(match_ids),
+        "finished": sum(1 for f in fixtures if f["final_score"]),
+        "odds": len(odds_rows),
+        "snapshots": len(snapshot_rows),
+        "users": users,
+        "matches_rated": rated["matches_rated"],
+        "predictions": written,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def reset_schema(engine) -> None:
+    from sqlalchemy import text
+
+    import models
+
+    models.Base.metadata.drop_all(bind=engine)
+    if engine.dialect.name == "postgresql":
+        # Otherwise prepare_schema() would take the recreated tables as fully migrated.
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_state"))
+    models.Base.metadata.create_all(bind=engine)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--snapshots", type=int, default=4, help="h2h price history rows per match and book")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate every table first")
+    args = parser.parse_args()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import database
+    import migrations
+    import models
+
+    if args.reset:
+        reset_schema(database.engine)
+    migrations.prepare_schema(database.engine)
+    db = database.SessionLocal()
+    try:
+        if db.query(models.Match).first() is not None:
+            parser.error("database already has matches; pass --reset to start from an empty schema")
+        print(seed(db, args.seasons, args.books, args.snapshots, args.users, args.seed))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
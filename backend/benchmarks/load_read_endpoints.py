@@ -0,0 +1,111 @@
+"""
+Closed-loop load generator for the read endpoints.
+
+Run the API (e.g. `uvicorn main:app --workers 1`) and point this at it:
+
+    python benchmarks/load_read_endpoints.py --base-url http://127.0.0.1:8000 \
+        --concurrency 200 --duration 20 --output after.json --compare before.json
+
+Each path gets its own run. Record a baseline from the sync-handler build
+first (--output before.json), then compare the async build against it.
+--bust-cache varies `limit` per request so every call misses the response
+cache and reaches the database.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_PATHS = ["/odds?upcoming=true", "/ai-predictions", "/debug/counts"]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+async def run_path(
+    client: httpx.AsyncClient, path: str, concurrency: int, duration: float, bust_cache: bool, headers: Dict
+) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            url = path
+            if bust_cache:
+                url += ("&" if "?" in path else "?") + f"limit={random.randint(1, 500)}"
+            start = time.perf_counter()
+            try:
+                r = await client.get(url, headers=headers)
+                if r.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def print_results(results: Dict[str, Dict], baseline: Optional[Dict[str, Dict]]) -> None:
+    print(f"{'path':40} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for path, r in results.items():
+        print(f"{path:40} {r['rps']:10.1f} {r['p50_ms']:10.2f} {r['p99_ms']:10.2f} {r['errors']:8d}")
+        base = (baseline or {}).get(path)
+        if base:
+            print(
+                f"{'  vs baseline':40} {r['rps'] / base['rps'] if base['rps'] else 0:9.2f}x"
+                f" {r['p50_ms'] - base['p50_ms']:+10.2f} {r['p99_ms'] - base['p99_ms']:+10.2f}"
+            )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", action="append", dest="paths", help="repeatable; defaults to the hot read paths")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per path")
+    parser.add_argument("--token", help="bearer token, needed for /auth/me")
+    parser.add_argument("--bust-cache", action="store_true")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON written by an earlier --output")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        for path in args.paths or DEFAULT_PATHS:
+            results[path] = await run_path(client, path, args.concurrency, args.duration, args.bust_cache, headers)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,318 @@
+"""
+Offline benchmark suite: ingestion against the stub provider, then closed-loop
+load on /odds, /ai-predictions and /auth/login, compared with a stored baseline.
+
+    python benchmarks/run_suite.py --database-url sqlite:////tmp/bench.db --reset \
+        --output results.json --baseline benchmarks/baseline.json
+
+    # record a new baseline after an intentional change
+    python benchmarks/run_suite.py ... --save-baseline benchmarks/baseline.json
+
+--reset drops the schema and seeds it with benchmarks/fixtures.py at the given
+scale. Ingestion runs fetch_and_store_odds against benchmarks/stub_provider.py:
+a cold cycle that inserts everything, --cycles repriced cycles, and one
+unchanged cycle (all 304s). The load scenarios run the app in process over
+httpx's ASGI transport unless --base-url points at a running server (started
+with the same DATABASE_URL). Queries per request come from /metrics either way.
+
+Throughput and latency are only comparable between runs on the same machine.
+Query counts do not depend on the machine: half a query more per request (an
+N+1 creeping in), or more queries in any ingestion cycle, is a regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import httpx
+
+import fixtures
+import stub_provider
+from load_read_endpoints import percentile
+
+SCENARIOS = ("odds", "ai-predictions", "login")
+ROUTES = {"odds": "/odds", "ai-predictions": "/ai-predictions", "login": "/auth/login"}
+_METRIC_LINE = re.compile(r'^(http_request_db_queries_(?:sum|count))\{route="([^"]*)"\} (\S+)$')
+
+
+def db_query_totals(metrics_text: str) -> Dict[str, List[float]]:
+    """route -> [queries, requests] from a /metrics scrape."""
+    totals: Dict[str, List[float]] = {}
+    for line in metrics_text.splitlines():
+        m = _METRIC_LINE.match(line)
+        if m:
+            entry = totals.setdefault(m.group(2), [0.0, 0.0])
+            entry[0 if m.group(1).endswith("_sum") else 1] = float(m.group(3))
+    return totals
+
+
+async def run_ingestion(feed: stub_provider.Feed, cycles: int) -> Dict:
+    import api_integration
+    import database
+    import metrics
+
+    runs = []
+    with stub_provider.StubProvider(feed) as base_url:
+        client = api_integration.OddsApiClient(base_url=base_url, quota_floor=0)
+        try:
+            for i in range(cycles + 2):
+                kind = "cold" if i == 0 else "unchanged" if i == cycles + 1 else "repriced"
+                if kind == "repriced":
+                    feed.tick()
+                with metrics.track_queries() as stats:
+                    started = time.perf_counter()
+                    result = await api_integration.fetch_and_store_odds(database.SessionLocal, client)
+                    elapsed = time.perf_counter() - started
+                runs.append({
+                    "kind": kind,
+                    "seconds": elapsed,
+                    "queries": stats.queries,
+                    "db_seconds": stats.db_seconds,
+                    "odds_changed": result["odds_changed"],
+                })
+        finally:
+            await client.aclose()
+
+    repriced = [r for r in runs if r["kind"] == "repriced"]
+    return {
+        "events": len(feed.events),
+        "books": len(feed.events[0]["bookmakers"]) if feed.events else 0,
+        "cold_s": runs[0]["seconds"],
+        "cold_queries": runs[0]["queries"],
+        "repriced_p50_s": statistics.median(r["seconds"] for r in repriced) if repriced else None,
+        "repriced_queries": max((r["queries"] for r in repriced), default=None),
+        "unchanged_s": runs[-1]["seconds"],
+        "unchanged_queries": runs[-1]["queries"],
+        "cycles": runs,
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, send: Callable, route: str, concurrency: int, duration: float
+) -> Dict:
+    latencies: List[float] = []
+    ok = rejected = errors = 0
+    before = db_query_totals((await client.get("/metrics")).text).get(route, [0.0, 0.0])
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal ok, rejected, errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                r = await send(client)
+                if r.status_code < 400:
+                    ok += 1
+                elif r.status_code in (429, 503):
+                    rejected += 1
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = db_query_totals((await client.get("/metrics")).text).get(route, [0.0, 0.0])
+
+    latencies.sort()
+    served = after[1] - before[1]
+    return {
+        "requests": len(latencies),
+        "ok": ok,
+        "rejected": rejected,
+        "errors": errors,
+        "rps": ok / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_request": (after[0] - before[0]) / served if served else 0.0,
+    }
+
+
+def scenario_senders(users: int, bust_cache: bool) -> Dict[str, Callable]:
+    def limit_param():
+        return {"limit": random.randint(1, 500)} if bust_cache else {}
+
+    return {
+        "odds": lambda c: c.get("/odds", params={"upcoming": "true", **limit_param()}),
+        "ai-predictions": lambda c: c.get("/ai-predictions", params=limit_param()),
+        "login": lambda c: c.post("/auth/login", json={
+            "email": fixtures.bench_email(random.randrange(max(users, 1))),
+            "password": fixtures.BENCH_PASSWORD,
+        }),
+    }
+
+
+async def run_load(args) -> Dict:
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        import main
+        transport, base_url = httpx.ASGITransport(app=main.app), "http://bench"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    senders = scenario_senders(args.users, args.bust_cache)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits, timeout=60) as client:
+        for name in args.scenarios:
+            concurrency = args.login_concurrency if name == "login" else args.concurrency
+            results[name] = await run_scenario(client, senders[name], ROUTES[name], concurrency, args.duration)
+    if transport is not None:
+        # The app's lifespan never ran; close its async pools on this loop before it ends.
+        import database
+        await database.dispose_async_engines()
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Print results next to the baseline; return the regressions."""
+    regressions = []
+    print(f"{'scenario':16} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10} {'q/req':>7} {'rejected':>9} {'errors':>7}")
+    for name, r in results["scenarios"].items():
+        print(
+            f"{name:16} {r['rps']:10.1f} {r['p50_ms']:10.2f} {r['p99_ms']:10.2f}"
+            f" {r['queries_per_request']:7.2f} {r['rejected']:9d} {r['errors']:7d}"
+        )
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if not base:
+            continue
+        print(
+            f"{'  vs baseline':16} {r['rps'] / base['rps'] if base['rps'] else 0:9.2f}x"
+            f" {r['p50_ms'] - base['p50_ms']:+10.2f} {r['p99_ms'] - base['p99_ms']:+10.2f}"
+            f" {r['queries_per_request'] - base['queries_per_request']:+7.2f}"
+        )
+        if base["rps"] and r["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {r['rps']:.1f} vs {base['rps']:.1f} rps")
+        if base["p99_ms"] and r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {r['p99_ms']:.1f} vs {base['p99_ms']:.1f} ms")
+        if r["queries_per_request"] > base["queries_per_request"] + 0.5:
+            regressions.append(
+                f"{name}: {r['queries_per_request']:.2f} queries/request vs {base['queries_per_request']:.2f}"
+            )
+
+    ing, base_ing = results.get("ingestion"), (baseline or {}).get("ingestion")
+    if ing:
+        print(
+            f"ingestion {ing['events']} events x {ing['books']} books: cold {ing['cold_s']:.2f}s"
+            f" ({ing['cold_queries']} queries), repriced p50 {ing['repriced_p50_s'] or 0:.2f}s"
+            f" ({ing['repriced_queries']} queries), unchanged {ing['unchanged_s']:.2f}s"
+        )
+        if base_ing:
+            print(
+                f"  vs baseline: cold {ing['cold_s'] - base_ing['cold_s']:+.2f}s,"
+                f" repriced {(ing['repriced_p50_s'] or 0) - (base_ing['repriced_p50_s'] or 0):+.2f}s"
+            )
+            for key in ("cold_s", "repriced_p50_s"):
+                if base_ing.get(key) and ing.get(key) and ing[key] > base_ing[key] * (1 + tolerance):
+                    regressions.append(f"ingestion: {key} {ing[key]:.2f} vs {base_ing[key]:.2f}")
+            for key in ("cold_queries", "repriced_queries", "unchanged_queries"):
+                if base_ing.get(key) is not None and (ing.get(key) or 0) > base_ing[key]:
+                    regressions.append(f"ingestion: {key} {ing[key]} vs {base_ing[key]}")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--reset", action="store_true", help="drop the schema and seed fixtures first")
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--snapshots", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--events", type=int, default=64, help="stub provider events per ingestion cycle")
+    parser.add_argument("--event-books", type=int, default=10, help="stub provider books per event")
+    parser.add_argument("--change-rate", type=float, default=0.1)
+    parser.add_argument("--replay", help="recorded /odds payload for the stub provider to scale up")
+    parser.add_argument("--cycles", type=int, default=3, help="repriced ingestion cycles")
+    parser.add_argument("--skip-ingestion", action="store_true")
+    parser.add_argument("--scenario", action="append", dest="scenarios", choices=SCENARIOS)
+    parser.add_argument("--base-url", help="benchmark a running server instead of the app in process")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--bust-cache", action="store_true", help="vary limit so reads miss the response cache")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative throughput/latency change")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("ODDS_SCHEDULER_ENABLED", "false")
+    random.seed(args.seed)
+
+    import database
+    import migrations
+
+    results = {
+        "meta": {
+            "at": datetime.utcnow().isoformat(),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "database": database.engine.dialect.name,
+            "scale": {k: getattr(args, k) for k in ("seasons", "books", "snapshots", "users", "events", "event_books")},
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "bust_cache": args.bust_cache,
+        },
+    }
+
+    if args.reset:
+        fixtures.reset_schema(database.engine)
+        migrations.prepare_schema(database.engine)
+        db = database.SessionLocal()
+        try:
+            results["fixtures"] = fixtures.seed(db, args.seasons, args.books, args.snapshots, args.users, args.seed)
+        finally:
+            db.close()
+        print(f"seeded {results['fixtures']}")
+    else:
+        migrations.prepare_schema(database.engine)
+
+    if not args.skip_ingestion:
+        feed = stub_provider.build_feed(args.events, args.event_books, args.change_rate, args.seed, args.replay)
+        results["ingestion"] = asyncio.run(run_ingestion(feed, args.cycles))
+    results["scenarios"] = asyncio.run(run_load(args))
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print("regressions:\n  " + "\n  ".join(regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Offline stand-in for the Odds API, for benchmarking ingestion without a key or
+network access.
+
+    python benchmarks/stub_provider.py --port 8787 --events 64 --books 10
+    ODDS_API_BASE_URL=http://127.0.0.1:8787/v4/sports uvicorn main:app
+
+GET /v4/sports/{sport}/odds?markets=... serves `--events` events with
+`--books` bookmakers each, deterministically from --seed. With --replay it
+serves a recorded /odds response instead, cloned (shifted a day per copy, and
+with numbered bookmakers) until it reaches the requested scale. Every
+--tick-seconds the feed reprices `--change-rate` of the markets and changes its
+ETags, like a live feed; between ticks conditional requests get 304.
+/v4/sports/{sport}/scores returns an empty list.
+"""
+import argparse
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+NFL_TEAMS = [
+    "Arizona Cardinals", "Atlanta Falcons", "Baltimore Ravens", "Buffalo Bills", "Carolina Panthers",
+    "Chicago Bears", "Cincinnati Bengals", "Cleveland Browns", "Dallas Cowboys", "Denver Broncos",
+    "Detroit Lions", "Green Bay Packers", "Houston Texans", "Indianapolis Colts", "Jacksonville Jaguars",
+    "Kansas City Chiefs", "Las Vegas Raiders", "Los Angeles Chargers", "Los Angeles Rams", "Miami Dolphins",
+    "Minnesota Vikings", "New England Patriots", "New Orleans Saints", "New York Giants", "New York Jets",
+    "Philadelphia Eagles", "Pittsburgh Steelers", "San Francisco 49ers", "Seattle Seahawks",
+    "Tampa Bay Buccaneers", "Tennessee Titans", "Washington Commanders",
+]
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def synthetic_events(n_events: int, n_books: int, seed: int = 0, start: Optional[datetime] = None) -> List[Dict]:
+    """
+    Events in the provider's shape with h2h, spreads and totals for every book.
+    Sixteen games per day from `start` (default: tomorrow), NFL team names.
+    """
+    rng = random.Random(seed)
+    start = start or (datetime.utcnow() + timedelta(days=1)).replace(hour=17, minute=0, second=0, microsecond=0)
+    events = []
+    for i in range(n_events):
+        day, slot = divmod(i, len(NFL_TEAMS) // 2)
+        order = random.Random(f"{seed}:{day}").sample(NFL_TEAMS, len(NFL_TEAMS))
+        home, away = order[2 * slot], order[2 * slot + 1]
+        p_home = rng.uniform(0.25, 0.75)
+        line = round((0.5 - p_home) * 28 * 2) / 2
+        total = rng.choice([38.5, 41.5, 44.5, 47.5, 50.5])
+        books = []
+        for b in range(n_books):
+            vig = rng.uniform(1.03, 1.06)
+            books.append({
+                "key": f"book{b:02d}",
+                "title": f"Book {b:02d}",
+                "last_update": _iso(start),
+                "markets": [
+                    {"key": "h2h", "outcomes": [
+                        {"name": home, "price": round(1 / (p_home * vig), 2)},
+                        {"name": away, "price": round(1 / ((1 - p_home) * vig), 2)},
+                    ]},
+                    {"key": "spreads", "outcomes": [
+                        {"name": home, "price": 1.91, "point": line},
+                        {"name": away, "price": 1.91, "point": -line},
+                    ]},
+                    {"key": "totals", "outcomes": [
+                        {"name": "Over", "price": 1.91, "point": total},
+                        {"name": "Under", "price": 1.91, "point": total},
+                    ]},
+                ],
+            })
+        events.append({
+            "id": f"stub{i:05d}",
+            "sport_key": "americanfootball_nfl",
+            "sport_title": "NFL",
+            "commence_time": _iso(start + timedelta(days=day, minutes=10 * slot)),
+            "home_team": home,
+            "away_team": away,
+            "bookmakers": books,
+        })
+    return events
+
+
+def scale_recorded(recorded: List[Dict], n_events: int, n_books: int) -> List[Dict]:
+    """Clone a recorded payload up to n_events events and n_books bookmakers per event."""
+    if not recorded:
+        return []
+    events = []
+    for i in range(n_events):
+        copy, ev = divmod(i, len(recorded))
+        ev = json.loads(json.dumps(recorded[ev]))
+        if copy:
+            when = datetime.strptime(ev["commence_time"], "%Y-%m-%dT%H:%M:%SZ") + timedelta(days=copy)
+            ev["commence_time"] = _iso(when)
+            ev["id"] = f"{ev.get('id', 'ev')}-{copy}"
+        books = ev.get("bookmakers") or []
+        scaled = []
+        for b in range(n_books if books else 0):
+            bk = books[b % len(books)]
+            if b >= len(books):
+                bk = {**json.loads(json.dumps(bk)), "key": f"{bk.get('key')}-{b}", "title": f"{bk.get('title')} {b}"}
+            scaled.append(bk)
+        ev["bookmakers"] = scaled
+        events.append(ev)
+    return events
+
+
+class Feed:
+    """The full payload plus a generation counter; each bump reprices a share of the outcomes."""
+
+    def __init__(self, events: List[Dict], change_rate: float, seed: int = 0, remaining: int = 100_000):
+        self.events = events
+        self.change_rate = change_rate
+        self.generation = 0
+        self.remaining = remaining
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _move(self) -> None:
+        for ev in self.events:
+            for bk in ev.get("bookmakers") or []:
+                for market in bk.get("markets") or []:
+                    if self._rng.random() < self.change_rate:
+                        for o in market.get("outcomes") or []:
+                            o["price"] = round(max(1.01, o["price"] * self._rng.uniform(0.97, 1.03)), 2)
+
+    def market(self, market: str, if_none_match: Optional[str]):
+        """(status, body or None, etag) for one market, filtered out of the full payload."""
+        with self._lock:
+            self.requests += 1
+            self.remaining -= 1
+            etag = f'"{market}-{self.generation}"'
+            if if_none_match == etag:
+                return 304, None, etag
+            payload = [
+                {**ev, "bookmakers": [
+                    {**bk, "markets": [m for m in bk.get("markets") or [] if m.get("key") == market]}
+                    for bk in ev.get("bookmakers") or []
+                ]}
+                for ev in self.events
+            ]
+            return 200, json.dumps(payload).encode(), etag
+
+    def tick(self) -> None:
+        with self._lock:
+            if self.change_rate:
+                self.generation += 1
+                self._move()
+
+
+def make_handler(feed: Feed):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes = b"", etag: Optional[str] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("x-requests-remaining", str(feed.remaining))
+            self.send_header("x-requests-used", str(feed.requests))
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if len(parts) != 4 or parts[:2] != ["v4", "sports"]:
+                self._send(404, b"[]")
+            elif parts[3] == "scores":
+                self._send(200, b"[]")
+            elif parts[3] == "odds":
+                market = parse_qs(url.query).get("markets", ["h2h"])[0]
+                status, body, etag = feed.market(market, self.headers.get("If-None-Match"))
+                self._send(status, body or b"", etag)
+            else:
+                self._send(404, b"[]")
+
+    return Handler
+
+
+class StubProvider:
+    """The stub server on a background thread: `with StubProvider(feed) as url: ...`."""
+
+    def __init__(self, feed: Feed, host: str = "127.0.0.1", port: int = 0):
+        self.feed = feed
+        self.server = ThreadingHTTPServer((host, port), make_handler(feed))
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v4/sports"
+
+    def __enter__(self) -> str:
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-provider", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def build_feed(events: int, books: int, change_rate: float, seed: int, replay: Optional[str] = None) -> Feed:
+    if replay:
+        with open(replay) as f:
+            payload = scale_recorded(json.load(f), events, books)
+    else:
+        payload = synthetic_events(events, books, seed)
+    return Feed(payload, change_rate, seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--events", type=int, default=64)
+    parser.add_argument("--books", type=int, default=10)
+    parser.add_argument("--change-rate", type=float, default=0.1, help="share of markets repriced per tick")
+    parser.add_argument("--tick-seconds", type=float, default=5.0, help="how often the feed moves")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="recorded /odds response (JSON list) to scale up instead of synthetic events")
+    args = parser.parse_args()
+
+    feed = build_feed(args.events, args.books, args.change_rate, args.seed, args.replay)
+    with StubProvider(feed, args.host, args.port) as url:
+        print(f"serving {len(feed.events)} events x {args.books} books at {url}")
+        stop = threading.Event()
+        try:
+            while not stop.wait(args.tick_seconds):
+                feed.tick()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Bet settlement, per-user bankroll analytics and parlay pricing.
+
+Bets are h2h: a side ("team1"/"team2") of a match at one book's decimal price.
+The dashboard is built from a single query over the user's bets (the closing
+price comes from a correlated lookup on ix_odds_snapshots_match_book_time) and
+aggregated in one pass over the rows; user.bets is never loaded.
+"""
+import math
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, func, select, update as sql_update
+from sqlalchemy.orm import Session
+
+import models
+from backtest import parse_final_score
+
+SELECTIONS = ("team1", "team2")
+
+# Edge buckets in probability points (model_prob - implied prob of the price taken).
+EDGE_BUCKETS = [0.0, 2.0, 5.0, 10.0]
+EDGE_LABELS = ["<0", "0-2", "2-5", "5-10", "10+"]
+
+
+def settle(selection: str, amount: float, odds_taken: float, score: Tuple[int, int]) -> Tuple[str, float]:
+    """(outcome, profit_loss) of an h2h bet given the final score; a tie is a push."""
+    if score[0] == score[1]:
+        return "push", 0.0
+    won = (score[0] > score[1]) == (selection == "team1")
+    return ("win", amount * (odds_taken - 1.0)) if won else ("loss", -amount)
+
+
+def settle_bets(db: Session, match_ids: Iterable[int]) -> int:
+    """(Re)settle every bet on the given matches from their final_score, in one batched UPDATE."""
+    match_ids = list(match_ids)
+    if not match_ids:
+        return 0
+    b = models.Bet
+    rows = db.execute(
+        select(b.bet_id, b.selection, b.amount, b.odds_taken, models.Match.final_score)
+        .join(models.Match, models.Match.match_id == b.match_id)
+        .where(b.match_id.in_(match_ids), b.selection.in_(SELECTIONS), b.odds_taken.is_not(None))
+    ).all()
+    updates = []
+    for r in rows:
+        score = parse_final_score(r.final_score)
+        if score is None:
+            continue
+        outcome, profit = settle(r.selection, r.amount or 0.0, r.odds_taken, score)
+        updates.append({"bet_id": r.bet_id, "outcome": outcome, "profit_loss": profit})
+    if updates:
+        db.execute(sql_update(models.Bet), updates)
+        db.commit()
+    return len(updates)
+
+
+def _side(selection, team1, team2):
+    return case((selection == "team1", team1), else_=team2)
+
+
+def closing_price():
+    """
+    Scalar subquery: the last price the bet's book showed for its side at or
+    before kickoff, falling back to the BettingOdds row if it was last updated
+    before kickoff (a later update may be an in-play price). NULL until the
+    match has started, or when no pre-kickoff price exists.
+    """
+    b, snap, odds = models.Bet, models.OddsSnapshot, models.BettingOdds
+    last_snapshot = (
+        select(_side(b.selection, snap.odds_team1, snap.odds_team2))
+        .where(
+            snap.match_id == b.match_id,
+            snap.sports_books == b.sports_books,
+            snap.market == "h2h",
+            snap.captured_at <= models.Match.match_date,
+        )
+        .order_by(snap.captured_at.desc(), snap.snapshot_id.desc())
+        .limit(1)
+        .correlate(b, models.Match)
+        .scalar_subquery()
+    )
+    current = (
+        select(_side(b.selection, odds.odds_team1, odds.odds_team2))
+        .where(
+            odds.match_id == b.match_id,
+            odds.sports_books == b.sports_books,
+            odds.market == "h2h",
+            odds.updated_at <= models.Match.match_date,
+        )
+        .correlate(b, models.Match)
+        .scalar_subquery()
+    )
+    return case(
+        (models.Match.match_date <= datetime.utcnow(), func.coalesce(last_snapshot, current)),
+        else_=None,
+    )
+
+
+def _roi(entry: Dict) -> Dict:
+    entry["roi"] = entry["profit"] / entry["staked"] if entry["staked"] else None
+    return entry
+
+
+def user_dashboard(db: Session, user_id: int) -> Dict:
+    """
+    Summary, daily cumulative P&L with max drawdown, ROI by book and by edge
+    bucket, and closing-line value for one user's bets.
+    """
+    b = models.Bet
+    rows = db.execute(
+        select(
+            b.amount,
+            b.outcome,
+            b.profit_loss,
+            b.sports_books,
+            b.odds_taken,
+            b.model_prob,
+            models.Match.match_date,
+            closing_price().label("closing"),
+        )
+        .join(models.Match, models.Match.match_id == b.match_id)
+        .where(b.user_id == user_id)
+        .order_by(models.Match.match_date, b.bet_id)
+    )
+
+    summary = {"bets": 0, "open": 0, "settled": 0, "wins": 0, "losses": 0, "pushes": 0, "staked": 0.0, "profit": 0.0}
+    daily: List[Dict] = []
+    peak = drawdown = 0.0
+    by_book: Dict[str, Dict] = {}
+    by_edge = [{"edge": label, "bets": 0, "staked": 0.0, "profit": 0.0} for label in EDGE_LABELS]
+    clv_sum, clv_n, beat_close = 0.0, 0, 0
+
+    for r in rows:
+        summary["bets"] += 1
+        if r.odds_taken and r.closing and r.closing > 1.0:
+            clv_sum += (r.odds_taken / r.closing - 1.0) * 100
+            clv_n += 1
+            beat_close += r.odds_taken > r.closing
+        if r.outcome is None or r.profit_loss is None:
+            summary["open"] += 1
+            continue
+
+        stake, profit = r.amount or 0.0, r.profit_loss
+        summary["settled"] += 1
+        summary[{"win": "wins", "loss": "losses"}.get(r.outcome, "pushes")] += 1
+        summary["staked"] += stake
+        summary["profit"] += profit
+
+        day = r.match_date.date().isoformat()
+        if not daily or daily[-1]["date"] != day:
+            daily.append({"date": day, "bets": 0, "profit": 0.0, "cumulative": 0.0})
+        daily[-1]["bets"] += 1
+        daily[-1]["profit"] += profit
+        daily[-1]["cumulative"] = summary["profit"]
+        peak = max(peak, summary["profit"])
+        drawdown = max(drawdown, peak - summary["profit"])
+
+        book = by_book.setdefault(r.sports_books, {"sports_books": r.sports_books, "bets": 0, "staked": 0.0, "profit": 0.0})
+        book["bets"] += 1
+        book["staked"] += stake
+        book["profit"] += profit
+
+        if r.model_prob is not None and r.odds_taken and r.odds_taken > 1.0:
+            bucket = by_edge[bisect_right(EDGE_BUCKETS, (r.model_prob - 1.0 / r.odds_taken) * 100)]
+            bucket["bets"] += 1
+            bucket["staked"] += stake
+            bucket["profit"] += profit
+
+    decided = summary["wins"] + summary["losses"]
+    summary["win_rate"] = summary["wins"] / decided if decided else None
+    return {
+        "summary": _roi(summary),
+        "pnl": {"daily": daily, "max_drawdown": drawdown},
+        "by_book": sorted((_roi(e) for e in by_book.values()), key=lambda e: e["sports_books"] or ""),
+        "by_edge": [_roi(e) for e in by_edge],
+        "clv": {
+            "bets": clv_n,
+            "avg_pct": clv_sum / clv_n if clv_n else None,
+            "beat_close_rate": beat_close / clv_n if clv_n else None,
+        },
+    }
+
+
+def parlay_probability(probs: Sequence[float], correlation: float = 0.0) -> float:
+    """
+    P(every leg wins) for legs with marginal probabilities `probs` and a common
+    pairwise correlation between leg outcomes: the Bahadur expansion truncated
+    at second order, clamped to the Frechet bounds.
+    """
+    joint = math.prod(probs)
+    if correlation and len(probs) > 1:
+        z = [math.sqrt((1.0 - p) / p) for p in probs]
+        pairs = (sum(z) ** 2 - sum(x * x for x in z)) / 2
+        joint *= 1.0 + correlation * pairs
+    lower = max(0.0, sum(probs) - (len(probs) - 1))
+    return min(max(joint, lower), min(probs))
+
+
+def parlay_quote(
+    legs: Sequence[Tuple[int, str]],
+    markets: Dict[int, Dict],
+    correlation: float = 0.0,
+    offered_odds: Optional[float] = None,
+) -> Dict:
+    """
+    Price a parlay of (match_id, selection) legs from consensus.summarize_matches
+    output keyed by match_id. Without `offered_odds` the offered price is the
+    product of the best available price on each leg. Raises ValueError for a
+    repeated match or a match without prices.
+    """
+    if len({m for m, _ in legs}) != len(legs):
+        raise ValueError("each match can appear in only one leg")
+    out_legs = []
+    for match_id, selection in legs:
+        m = markets.get(match_id)
+        if m is None:
+            raise ValueError(f"no h2h prices for match {match_id}")
+        best = m[f"best_{selection}"]
+        out_legs.append({
+            "match_id": match_id,
+            "selection": selection,
+            "team": m[selection],
+            "consensus_prob": m[f"consensus_prob_{selection}"],
+            "best_price": best["price"],
+            "best_book": best["book"],
+        })
+
+    probs = [leg["consensus_prob"] for leg in out_legs]
+    prob = parlay_probability(probs, correlation)
+    offered = offered_odds if offered_odds is not None else math.prod(leg["best_price"] for leg in out_legs)
+    ev = prob * offered - 1.0
+    return {
+        "legs": out_legs,
+        "correlation": correlation,
+        "prob_independent": math.prod(probs),
+        "prob": prob,
+        "fair_odds": 1.0 / prob if prob > 0 else None,
+        "offered_odds": offered,
+        "ev_per_unit": ev,
+        "kelly_fraction": max(ev / (offered - 1.0), 0.0) if offered > 1.0 else 0.0,
+    }
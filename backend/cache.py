@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+# Upper bound on entry age, for responses whose window is relative to "now" (upcoming=true).
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "60"))
+# How long a coalesced operation's result is reused after it finishes (0: only while it runs).
+COALESCE_SECONDS = float(os.getenv("COALESCE_SECONDS", "5"))
+
+_version_lock = threading.Lock()
+_data_version = 0
+_listeners: List[Callable[[str, object], None]] = []
+
+
+def data_version() -> int:
+    return _data_version
+
+
+def add_invalidation_listener(fn: Callable[[str, object], None]) -> None:
+    """
+    Call `fn(kind, key)` after every invalidation made by this process ("data"
+    for a data version bump, "user" for a forgotten principal), so other
+    processes can be told about it. Invalidations they send back are applied
+    with propagate=False and do not reach the listeners again.
+    """
+    _listeners.append(fn)
+
+
+def notify_invalidation(kind: str, key: object = None) -> None:
+    for fn in _listeners:
+        fn(kind, key)
+
+
+def bump_data_version(propagate: bool = True) -> int:
+    """Invalidate every cached response. Call after any write that changes what the read endpoints return."""
+    global _data_version
+    with _version_lock:
+        _data_version += 1
+        version = _data_version
+    if propagate:
+        notify_invalidation("data", version)
+    return version
+
+
+class CachedBody(NamedTuple):
+    version: int
+    stored_at: float
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    # Compressed copies of body by content coding, filled on first request.
+    # No defaults: a shared {} would hand one entry's copies to every other.
+    encoded: Dict[str, bytes]
+
+
+class ResponseCache:
+    """
+    Bounded LRU of pre-serialized response bodies.
+
+    An entry is only served while the data version it was built under is still
+    current and it is younger than the TTL, so a version bump invalidates
+    everything at once without walking the cache.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != _data_version or time.monotonic() - entry.stored_at > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes, version: int, headers: Optional[Dict[str, str]] = None) -> CachedBody:
+        """
+        Store `body` built under `version` (read data_version() *before* querying).
+
+        The ETag depends only on the body and headers, not on the version: the
+        version is per process, and another worker behind the same load
+        balancer must produce the same ETag for the same content.
+        """
+        digest = hashlib.blake2b(body, digest_size=12)
+        for name, value in sorted((headers or {}).items()):
+            digest.update(b"\0%s:%s" % (name.encode("latin-1"), value.encode("latin-1")))
+        etag = '"%s"' % digest.hexdigest()
+        entry = CachedBody(version, time.monotonic(), body, etag, dict(headers or {}), {})
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "data_version": _data_version,
+        }
+
+
+class TTLCache:
+    """Thread-safe LRU whose entries also expire after `ttl` seconds (or earlier, per put())."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Hashable, value, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """
+    Coalesces calls of the same async operation: the first call for a key runs
+    it, and calls made while it runs, or within `ttl` seconds of it succeeding,
+    get its result instead of running it again. A failure goes to the calls
+    already waiting and is not kept.
+    """
+
+    def __init__(self, ttl: float = COALESCE_SECONDS):
+        self.ttl = ttl
+        self._running: Dict[Hashable, asyncio.Future] = {}
+        self._results: Dict[Hashable, tuple] = {}
+        self.runs: Counter = Counter()
+        self.shared: Counter = Counter()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        done = self._results.get(key)
+        if done is not None and done[0] > time.monotonic():
+            self.shared[key] += 1
+            return done[1]
+        task = self._running.get(key)
+        if task is None:
+            task = self._running[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._finished(key, t))
+            self.runs[key] += 1
+        else:
+            self.shared[key] += 1
+        # A caller that goes away must not cancel the run the others are waiting on.
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future) -> None:
+        self._running.pop(key, None)
+        # exception() also marks a failure nobody is left to await as retrieved.
+        if not task.cancelled() and task.exception() is None and self.ttl > 0:
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+
+    def stats(self) -> dict:
+        return {str(k): {"runs": self.runs[k], "shared": self.shared[k]} for k in self.runs}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
@@ -0,0 +1,284 @@
+"""
+Coordination between the worker processes of one deployment
+(`uvicorn main:app --workers N`, or several hosts on the same database).
+
+Each worker keeps one dedicated Postgres connection, outside the pools, that
+
+- tries pg_try_advisory_lock(LEADER_LOCK_KEY) every CLUSTER_POLL_SECONDS. The
+  worker holding it is the ingestion leader: the only one running the odds
+  scheduler, and the one that runs manual refreshes the other workers forward
+  to it. The lock belongs to the session, so when the leader dies or loses its
+  connection the lock is released and another worker takes over on its next
+  poll.
+- LISTENs on CLUSTER_CHANNEL. Cache invalidations (data version bumps,
+  forgotten principals) and odds deltas published by one worker are NOTIFYed
+  there and applied by all the others, so every worker's response cache and
+  WebSocket subscribers follow the leader's ingestion.
+
+A NOTIFY payload is limited to 8000 bytes, so a large batch of odds deltas
+goes out as several parts in one transaction and is published once all have
+arrived. Whenever the connection is re-established, notifications may have
+been missed, so the worker drops its cached responses and tells its
+subscribers to resync.
+
+Manual refreshes are coalesced twice: on each worker, so a burst of requests
+sends one forward, and on the leader, so forwards from every worker share one
+provider fetch. Either way a result is reused for COALESCE_SECONDS after it
+arrives.
+
+On any other database (SQLite for local runs) there is only one process, which
+is always the leader, and nothing is sent.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+import auth
+import cache
+from scheduler import OddsRefresher
+from stream import OddsBroadcaster
+
+logger = logging.getLogger("uvicorn.error")
+
+CLUSTER_ENABLED = os.getenv("CLUSTER_COORDINATION", "true").lower() in ("1", "true", "yes")
+CLUSTER_CHANNEL = os.getenv("CLUSTER_CHANNEL", "sports_betting_cluster")
+LEADER_LOCK_KEY = int(os.getenv("CLUSTER_LEADER_LOCK_KEY", "7340002"))
+CLUSTER_POLL_SECONDS = float(os.getenv("CLUSTER_POLL_SECONDS", "5"))
+# How long a follower waits for the leader to answer a forwarded manual refresh.
+REFRESH_FORWARD_TIMEOUT = float(os.getenv("CLUSTER_REFRESH_TIMEOUT_SECONDS", "120"))
+NOTIFY_MAX_BYTES = 7500
+
+
+def _parts(changes: List[Dict], limit: int = NOTIFY_MAX_BYTES) -> List[List[list]]:
+    """Split a batch of deltas into compact row lists whose JSON fits in one NOTIFY each."""
+    parts: List[List[list]] = [[]]
+    size = 0
+    for c in changes:
+        row = [c["match_id"], c["sport"], c["book"], c["market"], c["odds_team1"], c["odds_team2"], c["point"]]
+        n = len(json.dumps(row)) + 1
+        if parts[-1] and size + n > limit - 200:
+            parts.append([])
+            size = 0
+        parts[-1].append(row)
+        size += n
+    return parts
+
+
+class Coordinator:
+    def __init__(self, async_url: str, refresher: OddsRefresher, broadcaster: OddsBroadcaster, schedule: bool):
+        self.enabled = CLUSTER_ENABLED and async_url.startswith("postgresql")
+        self.worker = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._url = async_url
+        self._refresher = refresher
+        self._broadcaster = broadcaster
+        self._schedule = schedule
+        self.is_leader = False
+        self.leader_since: Optional[datetime] = None
+        self.connected = False
+        self.sent = 0
+        self.received = 0
+        self._outbox: Optional[asyncio.Queue] = None
+        self._unsent: List[str] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._partial: Dict[int, Dict[int, List[list]]] = {}
+        self._flights = cache.SingleFlight()
+
+    async def _elected(self) -> None:
+        self.is_leader = True
+        self.leader_since = datetime.utcnow()
+        logger.info("cluster: worker %s is the ingestion leader", self.worker)
+        if self._schedule:
+            self._refresher.start()
+
+    async def _deposed(self, shutdown: bool = False) -> None:
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        self.leader_since = None
+        if not shutdown:
+            logger.warning("cluster: worker %s lost ingestion leadership", self.worker)
+        await self._refresher.stop()
+
+    async def start(self) -> None:
+        if not self.enabled:
+            await self._elected()
+            return
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        cache.add_invalidation_listener(self._send_invalidation)
+        self._broadcaster.relay = self._send_changes
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._deposed(shutdown=True)
+
+    async def _run(self) -> None:
+        engine = create_async_engine(self._url, poolclass=NullPool)
+        try:
+            while True:
+                try:
+                    async with engine.connect() as conn:
+                        raw = (await conn.get_raw_connection()).driver_connection
+                        await self._session(raw)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("cluster: coordination connection failed: %s", e)
+                finally:
+                    self.connected = False
+                    await self._deposed(shutdown=self._loop is None)
+                await asyncio.sleep(CLUSTER_POLL_SECONDS)
+        finally:
+            await engine.dispose()
+
+    async def _session(self, raw) -> None:
+        """One connection's lifetime: listen, contend for the lock, and send what is queued, until it fails."""
+        await raw.add_listener(CLUSTER_CHANNEL, self._on_notify)
+        self.connected = True
+        # Anything sent while this worker was disconnected is lost.
+        cache.bump_data_version(propagate=False)
+        self._broadcaster.resync()
+        next_poll = 0.0
+        while True:
+            if time.monotonic() >= next_poll:
+                if self.is_leader:
+                    await raw.fetchval("SELECT 1")
+                elif await raw.fetchval("SELECT pg_try_advisory_lock($1)", LEADER_LOCK_KEY):
+                    await self._elected()
+                next_poll = time.monotonic() + CLUSTER_POLL_SECONDS
+            if not self._unsent:
+                try:
+                    self._unsent.append(await asyncio.wait_for(self._outbox.get(), max(next_poll - time.monotonic(), 0.01)))
+                except asyncio.TimeoutError:
+                    continue
+            while not self._outbox.empty():
+                self._unsent.append(self._outbox.get_nowait())
+            # Kept until the transaction commits, so a failed send goes out on the next connection.
+            async with raw.transaction():
+                for payload in self._unsent:
+                    await raw.execute("SELECT pg_notify($1, $2)", CLUSTER_CHANNEL, payload)
+            self.sent += len(self._unsent)
+            self._unsent = []
+
+    def _send(self, kind: str, **fields) -> None:
+        """Queue a notification; safe to call from any thread."""
+        if self._loop is None or self._outbox is None:
+            return
+        payload = json.dumps({"worker": self.worker, "kind": kind, **fields}, separators=(",", ":"))
+        try:
+            self._loop.call_soon_threadsafe(self._outbox.put_nowait, payload)
+        except RuntimeError:
+            # The loop has already closed (shutdown); nobody is left to send it.
+            pass
+
+    def _send_invalidation(self, kind: str, key) -> None:
+        self._send("invalidate", what=kind, key=key if kind == "user" else None)
+
+    def _send_changes(self, seq: int, changes: List[Dict]) -> None:
+        parts = _parts(changes)
+        for i, rows in enumerate(parts):
+            self._send("changes", seq=seq, part=i, parts=len(parts), rows=rows)
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        msg = json.loads(payload)
+        if msg["worker"] == self.worker:
+            return
+        self.received += 1
+        kind = msg["kind"]
+        if kind == "invalidate":
+            if msg["what"] == "data":
+                cache.bump_data_version(propagate=False)
+            elif msg["what"] == "user":
+                auth.forget_principal(msg["key"], propagate=False)
+        elif kind == "changes":
+            self._on_changes(msg)
+        elif kind == "refresh" and self.is_leader:
+            asyncio.ensure_future(self._refresh_for(msg["id"]))
+        elif kind == "refreshed":
+            fut = self._waiting.get(msg["id"])
+            if fut is not None and not fut.done():
+                fut.set_result(msg)
+
+    def _on_changes(self, msg: Dict) -> None:
+        seq = msg["seq"]
+        parts = self._partial.setdefault(seq, {})
+        parts[msg["part"]] = msg["rows"]
+        # A newer batch means the parts still missing from older ones are not coming.
+        for old in [s for s in self._partial if s < seq]:
+            del self._partial[old]
+        if len(parts) < msg["parts"]:
+            return
+        del self._partial[seq]
+        keys = ("match_id", "sport", "book", "market", "odds_team1", "odds_team2", "point")
+        changes = [dict(zip(keys, row)) for i in range(msg["parts"]) for row in parts[i]]
+        self._broadcaster.publish(changes, seq=seq)
+
+    async def _refresh_for(self, request_id: str) -> None:
+        try:
+            result = await self._flights.do("refresh", self._refresh_here)
+            self._send(
+                "refreshed", id=request_id, error=None, odds_changed=result["odds_changed"], status=result["status"]
+            )
+        except Exception as e:
+            self._send("refreshed", id=request_id, error=str(e), odds_changed=None, status=None)
+
+    async def _refresh_here(self) -> Dict:
+        stats = await self._refresher.refresh()
+        # The leader's refresher status: a follower's own refresher never runs.
+        return {"odds_changed": stats.get("odds_changed"), "worker": self.worker, "status": self._refresher.status()}
+
+    async def _forward(self) -> Dict:
+        request_id = uuid.uuid4().hex
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = fut
+        try:
+            self._send("refresh", id=request_id)
+            try:
+                reply = await asyncio.wait_for(fut, REFRESH_FORWARD_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RuntimeError("no ingestion leader answered the refresh request") from None
+        finally:
+            self._waiting.pop(request_id, None)
+        if reply["error"]:
+            raise RuntimeError(reply["error"])
+        return {"odds_changed": reply["odds_changed"], "worker": reply["worker"], "status": reply["status"]}
+
+    async def refresh(self) -> Dict:
+        """
+        Run a manual odds refresh on the leader: here if this worker leads,
+        otherwise forwarded to it, returning once it has finished. Concurrent
+        and closely following calls share one refresh.
+        """
+        if not self.enabled or self.is_leader:
+            return await self._flights.do("refresh", self._refresh_here)
+        return await self._flights.do("refresh-forward", self._forward)
+
+    def status(self) -> Dict:
+        return {
+            "mode": "postgres" if self.enabled else "single-process",
+            "worker": self.worker,
+            "leader": self.is_leader,
+            "leader_since": self.leader_since.isoformat() if self.leader_since else None,
+            "connected": self.connected,
+            "notifications_sent": self.sent,
+            "notifications_received": self.received,
+            "refreshes": self._flights.stats(),
+        }
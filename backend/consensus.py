@@ -0,0 +1,54 @@
+from datetime import datetime
+from typing import Dict, List
+
+
+def summarize_matches(rows: List) -> List[Dict]:
+    """
+    Collapse per-book h2h rows into one market summary per match in a single pass.
+
+    `rows` must carry match_id, team1, team2, match_date, sports_books,
+    odds_team1 and odds_team2. Per match this returns the best price on each side
+    and the book offering it, each book's overround (sum of implied
+    probabilities minus 1), the consensus probability (mean of the books'
+    de-vigged probabilities) and whether the best prices form an arbitrage.
+    """
+    by_match: Dict[int, Dict] = {}
+    for r in rows:
+        o1, o2 = r.odds_team1, r.odds_team2
+        if o1 is None or o2 is None or o1 <= 1.0 or o2 <= 1.0:
+            continue
+
+        m = by_match.get(r.match_id)
+        if m is None:
+            m = by_match[r.match_id] = {
+                "match_id": r.match_id,
+                "team1": r.team1,
+                "team2": r.team2,
+                "match_date": r.match_date.isoformat() if isinstance(r.match_date, datetime) else r.match_date,
+                "books": 0,
+                "best_team1": {"price": o1, "book": r.sports_books},
+                "best_team2": {"price": o2, "book": r.sports_books},
+                "overround": {},
+                "_fair_sum": 0.0,
+            }
+
+        i1, i2 = 1.0 / o1, 1.0 / o2
+        total = i1 + i2
+        m["books"] += 1
+        m["overround"][r.sports_books] = total - 1.0
+        m["_fair_sum"] += i1 / total
+        if o1 > m["best_team1"]["price"]:
+            m["best_team1"] = {"price": o1, "book": r.sports_books}
+        if o2 > m["best_team2"]["price"]:
+            m["best_team2"] = {"price": o2, "book": r.sports_books}
+
+    out = []
+    for m in by_match.values():
+        p1 = m.pop("_fair_sum") / m["books"]
+        best_total = 1.0 / m["best_team1"]["price"] + 1.0 / m["best_team2"]["price"]
+        m["consensus_prob_team1"] = p1
+        m["consensus_prob_team2"] = 1.0 - p1
+        m["best_overround"] = best_total - 1.0
+        m["arbitrage"] = best_total < 1.0
+        out.append(m)
+    return out
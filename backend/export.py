@@ -0,0 +1,236 @@
+"""
+Bulk export of matches, odds, odds snapshots and predictions for any date range.
+
+Rows come off a server-side cursor (stream_results) EXPORT_CHUNK at a time on a
+connection the export opens itself, and each chunk is encoded and yielded
+before the next is fetched, so memory stays flat however long the range is.
+
+Formats:
+
+- ndjson: one JSON object per row;
+- csv: header line, then one line per row;
+- columnar: newline-delimited JSON row groups, Parquet-style. The first line
+  is the schema {"format": "columnar-v1", "dataset", "columns": [{"name", "type"}]};
+  each following line is a row group {"rows": n, "columns": {name: values}}.
+  datetime columns are integer epoch seconds (UTC). String columns are
+  dictionary-encoded per row group as {"dict": [...], "codes": [...]}, since
+  teams, books and markets repeat on nearly every row. A null is a null
+  value, or a null code for a string column.
+
+NaN and infinite floats have no JSON form; every format exports them as null
+(an empty CSV field).
+"""
+import csv
+import io
+import json
+import math
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+
+import models
+
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "5000"))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "columnar": "application/x-ndjson",
+}
+
+# (column name, type) per dataset; the statements below select exactly these, in order.
+COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "matches": [
+        ("match_id", "int"), ("match_date", "datetime"), ("team1", "str"), ("team2", "str"),
+        ("location", "str"), ("final_score", "str"),
+    ],
+    "odds": [
+        ("match_id", "int"), ("match_date", "datetime"), ("team1", "str"), ("team2", "str"),
+        ("sports_books", "str"), ("market", "str"), ("odds_team1", "float"), ("odds_team2", "float"),
+        ("point", "float"), ("updated_at", "datetime"),
+    ],
+    "snapshots": [
+        ("match_id", "int"), ("match_date", "datetime"), ("sports_books", "str"), ("market", "str"),
+        ("odds_team1", "float"), ("odds_team2", "float"), ("point", "float"), ("captured_at", "datetime"),
+    ],
+    "predictions": [
+        ("match_id", "int"), ("match_date", "datetime"), ("team1", "str"), ("team2", "str"),
+        ("model_prob_team1", "float"), ("model_prob_team2", "float"), ("rating_team1", "float"),
+        ("rating_team2", "float"), ("model_version", "str"), ("computed_at", "datetime"),
+    ],
+}
+
+
+def _teams():
+    return aliased(models.SportsTeam), aliased(models.SportsTeam)
+
+
+def statement(dataset: str, start: datetime, end: datetime, book: Optional[str] = None, market: Optional[str] = None) -> Select:
+    """Rows of `dataset` for matches kicking off in [start, end], in (match_date, match_id) order."""
+    m = models.Match
+    window = (m.match_date >= start, m.match_date <= end)
+    if dataset == "matches":
+        team1, team2 = _teams()
+        stmt = (
+            select(m.match_id, m.match_date, team1.team_name, team2.team_name, m.location, m.final_score)
+            .join(team1, m.team1_id == team1.sports_teamsid)
+            .join(team2, m.team2_id == team2.sports_teamsid)
+            .where(*window)
+            .order_by(m.match_date, m.match_id)
+        )
+    elif dataset == "odds":
+        o = models.BettingOdds
+        team1, team2 = _teams()
+        stmt = (
+            select(
+                m.match_id, m.match_date, team1.team_name, team2.team_name, o.sports_books, o.market,
+                o.odds_team1, o.odds_team2, o.point, o.updated_at,
+            )
+            .join(o, o.match_id == m.match_id)
+            .join(team1, m.team1_id == team1.sports_teamsid)
+            .join(team2, m.team2_id == team2.sports_teamsid)
+            .where(*window)
+            .order_by(m.match_date, m.match_id, o.odds_id)
+        )
+    elif dataset == "snapshots":
+        s = models.OddsSnapshot
+        stmt = (
+            select(
+                m.match_id, m.match_date, s.sports_books, s.market, s.odds_team1, s.odds_team2, s.point, s.captured_at,
+            )
+            .join(s, s.match_id == m.match_id)
+            .where(*window)
+            .order_by(m.match_date, m.match_id, s.sports_books, s.captured_at)
+        )
+    elif dataset == "predictions":
+        p = models.Prediction
+        team1, team2 = _teams()
+        stmt = (
+            select(
+                m.match_id, m.match_date, team1.team_name, team2.team_name, p.model_prob_team1, p.model_prob_team2,
+                p.rating_team1, p.rating_team2, p.model_version, p.computed_at,
+            )
+            .join(p, p.match_id == m.match_id)
+            .join(team1, m.team1_id == team1.sports_teamsid)
+            .join(team2, m.team2_id == team2.sports_teamsid)
+            .where(*window)
+            .order_by(m.match_date, m.match_id)
+        )
+    else:
+        raise ValueError(f"unknown dataset {dataset!r}")
+
+    priced = {"odds": models.BettingOdds, "snapshots": models.OddsSnapshot}.get(dataset)
+    if priced is not None and book:
+        stmt = stmt.where(priced.sports_books == book)
+    if priced is not None and market:
+        stmt = stmt.where(priced.market == market)
+    return stmt
+
+
+def _epoch(value: Optional[datetime]) -> Optional[int]:
+    # Naive datetimes in this schema are UTC.
+    return int(value.replace(tzinfo=timezone.utc).timestamp()) if value is not None else None
+
+
+def _finite(value: Optional[float]) -> Optional[float]:
+    return value if value is None or math.isfinite(value) else None
+
+
+def _text_rows(columns: Sequence[Tuple[str, str]], rows: Sequence) -> Iterator[list]:
+    """Rows with their datetime columns as ISO strings and non-finite floats as None, ready for JSON or CSV."""
+    dates = [i for i, (_, kind) in enumerate(columns) if kind == "datetime"]
+    floats = [i for i, (_, kind) in enumerate(columns) if kind == "float"]
+    for r in rows:
+        r = list(r)
+        for i in dates:
+            if r[i] is not None:
+                r[i] = r[i].isoformat()
+        for i in floats:
+            r[i] = _finite(r[i])
+        yield r
+
+
+def _ndjson(columns: Sequence[Tuple[str, str]], chunks: Iterator[Sequence]) -> Iterator[bytes]:
+    names = [n for n, _ in columns]
+    dumps = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+    for rows in chunks:
+        yield "".join(dumps(dict(zip(names, r))) + "\n" for r in _text_rows(columns, rows)).encode()
+
+
+def _csv(columns: Sequence[Tuple[str, str]], chunks: Iterator[Sequence]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow([n for n, _ in columns])
+    for rows in chunks:
+        writer.writerows(_text_rows(columns, rows))
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def _dictionary(values: Sequence[Optional[str]]) -> Dict:
+    index: Dict[str, int] = {}
+    codes = [None if v is None else index.setdefault(v, len(index)) for v in values]
+    return {"dict": list(index), "codes": codes}
+
+
+def _columnar(dataset: str, columns: Sequence[Tuple[str, str]], chunks: Iterator[Sequence]) -> Iterator[bytes]:
+    dumps = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+    yield (dumps({
+        "format": "columnar-v1",
+        "dataset": dataset,
+        "columns": [{"name": n, "type": t} for n, t in columns],
+    }) + "\n").encode()
+    for rows in chunks:
+        data = {}
+        for i, (name, kind) in enumerate(columns):
+            values = [r[i] for r in rows]
+            if kind == "str":
+                data[name] = _dictionary(values)
+            elif kind == "datetime":
+                data[name] = [_epoch(v) for v in values]
+            elif kind == "float":
+                data[name] = [_finite(v) for v in values]
+            else:
+                data[name] = values
+        yield (dumps({"rows": len(rows), "columns": data}) + "\n").encode()
+
+
+def stream_export(
+    engine: Engine,
+    dataset: str,
+    fmt: str,
+    start: datetime,
+    end: datetime,
+    book: Optional[str] = None,
+    market: Optional[str] = None,
+    chunk: int = EXPORT_CHUNK,
+) -> Iterator[bytes]:
+    """
+    Encoded export body, chunk by chunk. The connection is opened on the first
+    next() and closed when the generator finishes or is closed, so it can be
+    handed straight to a StreamingResponse.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    stmt = statement(dataset, start, end, book, market)
+    columns = COLUMNS[dataset]
+
+    def body() -> Iterator[bytes]:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=chunk).execute(stmt)
+            chunks = result.partitions(chunk)
+            if fmt == "ndjson":
+                yield from _ndjson(columns, chunks)
+            elif fmt == "csv":
+                yield from _csv(columns, chunks)
+            else:
+                yield from _columnar(dataset, columns, chunks)
+
+    return body()
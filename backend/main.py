@@ -1,65 +1,130 @@
-from datetime import datetime, timedelta
-import logging, traceback
-from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, Header, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import func
-from sqlalchemy.orm import Session, aliased
-from api_integration import fetch_provider_json
+import time
 
+# Reported as the "import" phase of cold start (see metrics.observe_startup).
+_import_started = time.perf_counter()
 
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from fastapi import Query
-import os
+import asyncio, logging, traceback
+from typing import Literal, NamedTuple
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# database loads .env, so it goes before every module that reads its settings at import.
 import database
+import api_integration
+import auth
+import cache
+import cluster
+import metrics
+import migrations
 import models
-from auth import create_access_token, decode_access_token, hash_password, verify_password
-from api_integration import fetch_and_store_odds
-import math
+import predictions
+import queries
+import ratelimit
+import scheduler
+import serialize
+import simulation
+import stream
+from auth import create_access_token
+# backtest, bets, consensus, export, odds_history and ratings are imported by
+# the routes that use them, so starting the server does not load them.
 
-load_dotenv()
 logger = logging.getLogger("uvicorn.error")
 
-app = FastAPI(title="Sports Betting API", version="0.3.0")
-
+provider = api_integration.OddsApiClient()
+refresher = scheduler.OddsRefresher(database.SessionLocal, provider)
+broadcaster = stream.OddsBroadcaster()
+refresher.add_listener(broadcaster.publish_ingestion)
+# Decides which worker runs ingestion and keeps the others' caches and streams in step.
+coordinator = cluster.Coordinator(database.ASYNC_DATABASE_URL, refresher, broadcaster, scheduler.SCHEDULER_ENABLED)
+rate_limiter = ratelimit.from_env(database.async_engine)
+# Shares one run of the expensive debug endpoints between concurrent callers.
+expensive = cache.SingleFlight()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    imported = time.perf_counter()
+    # The schema check runs on a thread while the read pool opens its first connection.
+    await asyncio.gather(
+        asyncio.to_thread(migrations.prepare_schema, database.engine) if migrations.AUTO_MIGRATE else asyncio.sleep(0),
+        database.warm_up(),
+    )
+    await coordinator.start()
+    simulation.start()
+    if metrics.profiler:
+        metrics.profiler.start()
+    metrics.observe_startup(_import_started, imported, time.perf_counter())
+    yield
+    if metrics.profiler:
+        metrics.profiler.stop()
+    await coordinator.stop()
+    await provider.aclose()
+    await database.dispose_async_engines()
+    simulation.shutdown()
+
+
+app = FastAPI(title="Sports Betting API", version="0.3.0", lifespan=lifespan)
+
+# Added first, so it runs inside CORS and a 429 carries the headers the browser needs to read it.
+app.add_middleware(ratelimit.RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Everything that does not come out of the response cache (which stores its own
+# compressed copies) is gzipped on the way out once it is big enough.
+app.add_middleware(GZipMiddleware, minimum_size=serialize.COMPRESS_MIN_BYTES, compresslevel=serialize.GZIP_LEVEL)
+app.add_middleware(metrics.MetricsMiddleware)
 
-models.Base.metadata.create_all(bind=database.engine)
-
-def implied_prob_from_decimal(decimal_odds: float):
-    """Convert decimal odds like 1.80 or 2.10 to implied probability (0–1)."""
-    if decimal_odds is None:
-        return None
-    try:
-        d = float(decimal_odds)
-    except (TypeError, ValueError):
-        return None
-    if d <= 1.0:
-        return None
-    return 1.0 / d
-
-def model_probs_from_ratings(team1_name: str, team2_name: str, db: Session):
-    """Return (p_team1, p_team2) based on TeamRating.overall_rating and a logistic curve."""
-    r1 = db.query(models.TeamRating).filter(models.TeamRating.team_name == team1_name).first()
-    r2 = db.query(models.TeamRating).filter(models.TeamRating.team_name == team2_name).first()
-
-    if not r1 or not r2:
-        return 0.5, 0.5
+response_cache = cache.ResponseCache()
 
-    diff = (r1.overall_rating or 0.0) - (r2.overall_rating or 0.0)
+class Page(NamedTuple):
+    items: list
+    next_cursor: str | None
 
-    scale = 12.0 
-    p1 = 1.0 / (1.0 + math.exp(-diff / scale))
-    p2 = 1.0 - p1
-    return p1, p2
+async def cached_json(request: Request, key, build) -> Response:
+    """
+    Serve `await build()` as JSON from the response cache, with a strong ETag.
+    `build` only runs (and only touches the database) on a miss. A Page is sent
+    as its items, with the next page's cursor in X-Next-Cursor.
+    """
+    entry = response_cache.get(key)
+    if entry is None:
+        version = cache.data_version()
+        content = await build()
+        extra = {}
+        if isinstance(content, Page):
+            if content.next_cursor:
+                extra["X-Next-Cursor"] = content.next_cursor
+            content = content.items
+        entry = response_cache.put(key, serialize.dumps(content), version, extra)
+    body, etag = entry.body, entry.etag
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding", **entry.headers}
+    coding = serialize.negotiate(request.headers.get("accept-encoding")) if len(body) >= serialize.COMPRESS_MIN_BYTES else None
+    if coding:
+        # Each coding is a separate representation, so it gets its own ETag.
+        body = entry.encoded.get(coding)
+        if body is None:
+            body = entry.encoded[coding] = serialize.compress(entry.body, coding)
+        etag = f'{etag[:-1]}-{coding}"'
+        headers["Content-Encoding"] = coding
+    headers["ETag"] = etag
+    if cache.etag_matches(request.headers.get("if-none-match"), etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 def get_db():
     db = database.SessionLocal()
@@ -68,6 +133,47 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    """Session on the read pool (or replica) for endpoints that never write."""
+    db = database.ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    """AsyncSession on the primary, for async routes that write."""
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    """AsyncSession on the read replica/pool for the hot async read routes."""
+    async with database.AsyncReadSessionLocal() as db:
+        yield db
+
+async def current_user(
+    authorization: str | None = Header(default=None), db: AsyncSession = Depends(get_async_read_db)
+) -> auth.Principal:
+    """
+    The authenticated user for a Bearer token. Decoded tokens and profiles are
+    cached, so a repeat caller never checks out a database connection.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing token")
+    token = authorization.split(" ", 1)[1]
+    try:
+        user_id = int(auth.decode_access_token_cached(token).get("sub"))
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    principal = auth.cached_principal(user_id)
+    if principal is None:
+        generation = auth.principal_generation()
+        user = await db.get(models.User, user_id)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = auth.remember_principal(user, generation)
+    return principal
+
 # Schema
 class UserCreate(BaseModel):
     username: str
@@ -82,6 +188,25 @@ class LoginInput(BaseModel):
     email: EmailStr
     password: str
 
+class FinalScoreInput(BaseModel):
+    team1_score: int = Field(ge=0)
+    team2_score: int = Field(ge=0)
+
+class BetInput(BaseModel):
+    match_id: int
+    selection: Literal["team1", "team2"]
+    sports_books: str
+    amount: float = Field(gt=0)
+
+class ParlayLeg(BaseModel):
+    match_id: int
+    selection: Literal["team1", "team2"]
+
+class ParlayInput(BaseModel):
+    legs: list[ParlayLeg] = Field(min_length=2, max_length=12)
+    correlation: float = Field(default=0.0, ge=-1, le=1)
+    odds: float | None = Field(default=None, gt=1)
+
 # Routes
 @app.get("/")
 def root():
@@ -96,42 +221,27 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 @app.post("/update-odds/")
-def update_odds(db: Session = Depends(get_db)):
+async def update_odds():
+    # Runs on the ingestion leader; concurrent callers, on any worker, share one refresh.
     try:
-        fetch_and_store_odds(db)
-        return {"message": "Odds updated successfully"}
+        result = await coordinator.refresh()
+        return {"message": "Odds updated successfully", "refreshed_by": result["worker"], "status": result["status"]}
     except Exception as e:
         logger.error("update_odds failed: %s\n%s", e, traceback.format_exc())
         return JSONResponse(status_code=500, content={"error": "update_odds failed", "detail": str(e)})
 
-from fastapi import Query
+@app.get("/update-odds/status")
+def update_odds_status():
+    return {**refresher.status(), "cluster": coordinator.status()}
 
-@app.get("/odds")
-def get_odds(
-    db: Session = Depends(get_db),
-    date_from: str | None = Query(default=None),
-    date_to: str | None = Query(default=None),
-    upcoming: bool = Query(default=False),
-    limit: int = Query(default=100, ge=1, le=500),
-):
-    team1 = aliased(models.SportsTeam)
-    team2 = aliased(models.SportsTeam)
-
-    base = (
-        db.query(
-            models.Match.match_id,
-            team1.team_name.label("team1"),
-            team2.team_name.label("team2"),
-            models.BettingOdds.sports_books,
-            models.BettingOdds.odds_team1,
-            models.BettingOdds.odds_team2,
-            models.Match.match_date,
-        )
-        .join(models.BettingOdds, models.Match.match_id == models.BettingOdds.match_id)
-        .join(team1, models.Match.team1_id == team1.sports_teamsid)
-        .join(team2, models.Match.team2_id == team2.sports_teamsid)
-    )
+def odds_cache_key(date_from: str | None, date_to: str | None, upcoming: bool):
+    """Normalize the window parameters the way odds_window reads them, so equivalent queries share an entry."""
+    if date_from and date_to:
+        return (date_from, date_to, False)
+    return (None, None, upcoming)
 
+def odds_window(date_from: str | None, date_to: str | None, upcoming: bool):
+    """(start, end) match_date window shared by the odds list endpoints."""
     if date_from and date_to:
         start_dt = datetime.fromisoformat(f"{date_from}T00:00:00")
         end_dt = datetime.fromisoformat(f"{date_to}T23:59:59")
@@ -140,194 +250,496 @@ def get_odds(
         end_dt = start_dt + timedelta(days=14)
     else:
         today = datetime.utcnow().date()
-        start_of_week = today - timedelta(days=(today.weekday() - 1) % 7)  
+        start_of_week = today - timedelta(days=(today.weekday() - 1) % 7)
         start_dt = datetime.combine(start_of_week, datetime.min.time())
         end_dt = datetime.combine(start_of_week + timedelta(days=6), datetime.max.time())
+    return start_dt, end_dt
 
-    q = base.filter(
-        models.Match.match_date >= start_dt,
-        models.Match.match_date <= end_dt,
-    )
+def parse_cursor(cursor: str | None):
+    if cursor is None:
+        return None
+    try:
+        return queries.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+ODDS_FIELDS = ("match_id", "team1", "team2", "sports_books", "odds_team1", "odds_team2", "point", "match_date")
+
+@app.get("/odds")
+async def get_odds(
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    date_from: str | None = Query(default=None),
+    date_to: str | None = Query(default=None),
+    upcoming: bool = Query(default=False),
+    market: str = Query(default="h2h", pattern="^(h2h|spreads|totals)$"),
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor from the previous page"),
+):
+    after = parse_cursor(cursor)
+
+    async def build():
+        start_dt, end_dt = odds_window(date_from, date_to, upcoming)
+        rows = (await db.execute(queries.odds_rows(start_dt, end_dt, market, limit, after))).all()
+        rows, next_cursor = queries.split_page(rows, limit)
+
+        cols = serialize.columns(rows)
+        if not cols:
+            return Page([], next_cursor)
+        cols["match_date"] = serialize.iso(cols["match_date"])
+        return Page(serialize.records(ODDS_FIELDS, [cols[n] for n in ODDS_FIELDS]), next_cursor)
+
+    key = ("/odds", *odds_cache_key(date_from, date_to, upcoming), market, limit, cursor)
+    return await cached_json(request, key, build)
+
+@app.get("/odds/consensus")
+async def odds_consensus(
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    date_from: str | None = Query(default=None),
+    date_to: str | None = Query(default=None),
+    upcoming: bool = Query(default=False),
+):
+    """One row per match: best price per side, de-vigged consensus, overround per book, arbitrage flag."""
+    import consensus
+
+    async def build():
+        start_dt, end_dt = odds_window(date_from, date_to, upcoming)
+        rows = (await db.execute(queries.consensus_rows(start_dt, end_dt))).all()
+        return consensus.summarize_matches(rows)
+
+    return await cached_json(request, ("/odds/consensus", *odds_cache_key(date_from, date_to, upcoming)), build)
+
+@app.websocket("/ws/odds")
+async def odds_stream(
+    websocket: WebSocket,
+    sport: str | None = Query(default=None),
+    match_id: list[int] | None = Query(default=None),
+    since: int | None = Query(default=None),
+):
+    """
+    Push odds deltas after each ingestion cycle.
 
-    rows = q.order_by(models.Match.match_date.asc()).limit(limit).all()
-
-    return JSONResponse(content=[
-        {
-            "match_id": r.match_id,
-            "team1": r.team1,
-            "team2": r.team2,
-            "sports_books": r.sports_books,
-            "odds_team1": r.odds_team1,
-            "odds_team2": r.odds_team2,
-            "match_date": r.match_date.isoformat() if isinstance(r.match_date, datetime) else r.match_date,
-        }
-        for r in rows
-    ])
+    Subscribe with ?sport= and/or repeated ?match_id=; reconnect with ?since=<seq>
+    to receive missed deltas. A "resync" message means the gap could not be
+    replayed and the client should refetch /odds.
+    """
+    await websocket.accept()
+    sub = broadcaster.subscribe(sport=sport, match_ids=set(match_id) if match_id else None, since=since)
+    try:
+        await websocket.send_json({"type": "hello", "seq": broadcaster.seq})
+        while True:
+            kind, seq, changes = await sub.queue.get()
+            await websocket.send_json({"type": kind, "seq": seq, "changes": changes})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broadcaster.unsubscribe(sub)
+
+# Odds history
+@app.get("/odds/history/{match_id}")
+def odds_line_movement(
+    match_id: int,
+    db: Session = Depends(get_read_db),
+    market: str = Query(default="h2h", pattern="^(h2h|spreads|totals)$"),
+    book: str | None = Query(default=None),
+):
+    import odds_history
+    return odds_history.line_movement(db, match_id, market=market, book=book)
+
+@app.get("/odds/history/{match_id}/open-close")
+def odds_opening_closing(
+    match_id: int,
+    db: Session = Depends(get_read_db),
+    market: str = Query(default="h2h", pattern="^(h2h|spreads|totals)$"),
+):
+    import odds_history
+    return odds_history.opening_closing(db, match_id, market=market)
+
+@app.get("/odds/velocity")
+def odds_velocity(
+    db: Session = Depends(get_read_db),
+    hours: float = Query(default=24, gt=0, le=24 * 14),
+    market: str = Query(default="h2h", pattern="^(h2h|spreads|totals)$"),
+    limit: int = Query(default=100, ge=1, le=500),
+):
+    import odds_history
+    until = datetime.utcnow()
+    since = until - timedelta(hours=hours)
+    return odds_history.velocity(db, since, until, market=market, limit=limit)
 
 # Auth
+def hashing_unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy, please retry",
+        headers={"Retry-After": str(auth.PASSWORD_HASH_RETRY_AFTER)},
+    )
+
 @app.post("/auth/signup")
-def signup(data: SignupInput, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == data.email).first()
+async def signup(data: SignupInput, db: AsyncSession = Depends(get_async_db)):
+    existing = (await db.execute(select(models.User.user_id).where(models.User.email == data.email))).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = models.User(name=data.name, email=data.email, password_hash=hash_password(data.password))
-    db.add(user); db.commit(); db.refresh(user)
+    try:
+        password_hash = await auth.hash_password_async(data.password)
+    except auth.HashingOverloaded:
+        raise hashing_unavailable()
+    user = models.User(name=data.name, email=data.email, password_hash=password_hash)
+    db.add(user); await db.commit()
     return {"message": "Account created successfully", "user": {"id": user.user_id, "email": user.email}}
 
 @app.post("/auth/login")
-def login(data: LoginInput, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == data.email).first()
-    if not user or not verify_password(data.password, user.password_hash):
+async def login(data: LoginInput, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(models.User).where(models.User.email == data.email))).scalar_one_or_none()
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    try:
+        ok, new_hash = await auth.verify_and_update_password_async(data.password, user.password_hash)
+    except auth.HashingOverloaded:
+        raise hashing_unavailable()
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        # Stored hash predates the current argon2 parameters.
+        user.password_hash = new_hash
+        await db.commit()
     token = create_access_token({"sub": str(user.user_id), "email": user.email})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get("/auth/me")
-def me(authorization: str | None = Header(default=None), db: Session = Depends(get_db)):
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
-    token = authorization.split(" ", 1)[1]
-    try:
-        payload = decode_access_token(token)
-        user_id = payload.get("sub")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    user = db.query(models.User).filter(models.User.user_id == int(user_id)).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return {"id": user.user_id, "name": user.name, "email": user.email, "role": user.role}
+async def me(user: auth.Principal = Depends(current_user)):
+    return {"id": user.id, "name": user.name, "email": user.email, "role": user.role}
 
 # Debug helpers
 @app.get("/debug/counts")
-def counts(db: Session = Depends(get_db)):
+async def counts():
+    async def count_rows():
+        # Its own session: the caller that started it may be gone before it finishes.
+        async with database.AsyncReadSessionLocal() as db:
+            row = (await db.execute(select(
+                select(func.count()).select_from(models.SportsTeam).scalar_subquery().label("teams"),
+                select(func.count()).select_from(models.Match).scalar_subquery().label("matches"),
+                select(func.count()).select_from(models.BettingOdds).scalar_subquery().label("odds"),
+            ))).one()
+        return {"teams": row.teams, "matches": row.matches, "odds": row.odds}
+
+    return await expensive.do("debug-counts", count_rows)
+
+@app.get("/debug/pool")
+def pool_stats():
+    stats = {"write": database.pool_stats(database.engine)}
+    if database.read_engine is not database.engine:
+        stats["read"] = database.pool_stats(database.read_engine)
+    for name, async_engine in database.async_engines.items():
+        stats[name] = database.pool_stats(async_engine.sync_engine)
+    return stats
+
+@app.get("/debug/cache")
+def cache_stats():
     return {
-        "teams": db.query(models.SportsTeam).count(),
-        "matches": db.query(models.Match).count(),
-        "odds": db.query(models.BettingOdds).count(),
+        **response_cache.stats(),
+        "auth": auth.cache_stats(),
+        "coalesced": {**expensive.stats(), **coordinator.status()["refreshes"]},
+        "rate_limit": rate_limiter.stats(),
     }
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint; pool and cache gauges are sampled here."""
+    pools = {"write": database.engine, "read": database.read_engine}
+    pools.update({name: e.sync_engine for name, e in database.async_engines.items()})
+    for name, engine in pools.items():
+        if name == "read" and engine is database.engine:
+            continue
+        stats = database.pool_stats(engine)
+        metrics.DB_POOL_CHECKED_OUT.set(stats.get("checked_out", 0), name)
+        metrics.DB_POOL_CHECKOUTS.set(stats.get("checkouts", 0), name)
+        metrics.DB_POOL_TIMEOUTS.set(stats.get("timeouts", 0), name)
+    cache_stats = response_cache.stats()
+    metrics.RESPONSE_CACHE.set(cache_stats["hits"], "hit")
+    metrics.RESPONSE_CACHE.set(cache_stats["misses"], "miss")
+    for operation, calls in {**expensive.stats(), **coordinator.status()["refreshes"]}.items():
+        metrics.COALESCED_CALLS.set(calls["runs"], operation, "ran")
+        metrics.COALESCED_CALLS.set(calls["shared"], operation, "shared")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/debug/slow-requests")
+def slow_requests():
+    """Sampled profiles of the most recent requests slower than PROFILE_SLOW_MS (empty unless it is set)."""
+    if metrics.profiler is None:
+        return {"enabled": False, "profiles": []}
+    return {"enabled": True, "threshold_ms": metrics.profiler.threshold_ms, "profiles": list(metrics.profiler.profiles)}
+
 @app.get("/debug/provider")
-def debug_provider():
-    data = fetch_provider_json()
+async def debug_provider():
+    data = await expensive.do("debug-provider", lambda: provider.fetch_odds(api_integration.SPORTS[0], "h2h"))
     return {
         "count": len(data),
         "sample_keys": list(data[0].keys()) if data else [],
         "first_commence_time": data[0].get("commence_time") if data else None,
+        "quota": provider.status(),
     }
 
 
 
-NFL_INITIAL_RATINGS = [
-    # AFC East
-    {"team_name": "Buffalo Bills", "offense_rating": 88, "defense_rating": 84, "overall_rating": 86},
-    {"team_name": "Miami Dolphins", "offense_rating": 89, "defense_rating": 80, "overall_rating": 85},
-    {"team_name": "New England Patriots", "offense_rating": 74, "defense_rating": 79, "overall_rating": 76},
-    {"team_name": "New York Jets", "offense_rating": 78, "defense_rating": 83, "overall_rating": 80},
-
-    # AFC North
-    {"team_name": "Baltimore Ravens", "offense_rating": 88, "defense_rating": 90, "overall_rating": 89},
-    {"team_name": "Cincinnati Bengals", "offense_rating": 90, "defense_rating": 79, "overall_rating": 86},
-    {"team_name": "Cleveland Browns", "offense_rating": 78, "defense_rating": 88, "overall_rating": 83},
-    {"team_name": "Pittsburgh Steelers", "offense_rating": 76, "defense_rating": 84, "overall_rating": 80},
-
-    # AFC South
-    {"team_name": "Houston Texans", "offense_rating": 84, "defense_rating": 78, "overall_rating": 81},
-    {"team_name": "Indianapolis Colts", "offense_rating": 80, "defense_rating": 76, "overall_rating": 78},
-    {"team_name": "Jacksonville Jaguars", "offense_rating": 82, "defense_rating": 78, "overall_rating": 80},
-    {"team_name": "Tennessee Titans", "offense_rating": 75, "defense_rating": 77, "overall_rating": 76},
-
-    # AFC West
-    {"team_name": "Denver Broncos", "offense_rating": 77, "defense_rating": 76, "overall_rating": 76},
-    {"team_name": "Kansas City Chiefs", "offense_rating": 92, "defense_rating": 86, "overall_rating": 90},
-    {"team_name": "Las Vegas Raiders", "offense_rating": 76, "defense_rating": 75, "overall_rating": 76},
-    {"team_name": "Los Angeles Chargers", "offense_rating": 84, "defense_rating": 76, "overall_rating": 80},
-
-    # NFC East
-    {"team_name": "Dallas Cowboys", "offense_rating": 88, "defense_rating": 87, "overall_rating": 88},
-    {"team_name": "New York Giants", "offense_rating": 74, "defense_rating": 76, "overall_rating": 75},
-    {"team_name": "Philadelphia Eagles", "offense_rating": 90, "defense_rating": 83, "overall_rating": 87},
-    {"team_name": "Washington Commanders", "offense_rating": 74, "defense_rating": 75, "overall_rating": 74},
-
-    # NFC North
-    {"team_name": "Chicago Bears", "offense_rating": 77, "defense_rating": 74, "overall_rating": 75},
-    {"team_name": "Detroit Lions", "offense_rating": 89, "defense_rating": 79, "overall_rating": 85},
-    {"team_name": "Green Bay Packers", "offense_rating": 82, "defense_rating": 79, "overall_rating": 81},
-    {"team_name": "Minnesota Vikings", "offense_rating": 84, "defense_rating": 77, "overall_rating": 81},
-
-    # NFC South
-    {"team_name": "Atlanta Falcons", "offense_rating": 79, "defense_rating": 78, "overall_rating": 79},
-    {"team_name": "Carolina Panthers", "offense_rating": 71, "defense_rating": 75, "overall_rating": 73},
-    {"team_name": "New Orleans Saints", "offense_rating": 80, "defense_rating": 80, "overall_rating": 80},
-    {"team_name": "Tampa Bay Buccaneers", "offense_rating": 82, "defense_rating": 79, "overall_rating": 81},
-
-    # NFC West
-    {"team_name": "Arizona Cardinals", "offense_rating": 75, "defense_rating": 73, "overall_rating": 74},
-    {"team_name": "Los Angeles Rams", "offense_rating": 84, "defense_rating": 78, "overall_rating": 81},
-    {"team_name": "San Francisco 49ers", "offense_rating": 93, "defense_rating": 92, "overall_rating": 93},
-    {"team_name": "Seattle Seahawks", "offense_rating": 82, "defense_rating": 78, "overall_rating": 80},
-]
+# Bets
+@app.post("/bets")
+def place_bet(data: BetInput, user: auth.Principal = Depends(current_user), db: Session = Depends(get_db)):
+    """Record an h2h bet at the book's current price, with the model's probability for that side."""
+    match = db.get(models.Match, data.match_id)
+    if match is None:
+        raise HTTPException(status_code=404, detail="Match not found")
+    if match.match_date is None or match.match_date <= datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Match has already started")
+    odds = db.execute(
+        select(models.BettingOdds.odds_team1, models.BettingOdds.odds_team2).where(
+            models.BettingOdds.match_id == data.match_id,
+            models.BettingOdds.sports_books == data.sports_books,
+            models.BettingOdds.market == "h2h",
+        )
+    ).first()
+    price = odds and (odds.odds_team1 if data.selection == "team1" else odds.odds_team2)
+    if not price or price <= 1.0:
+        raise HTTPException(status_code=400, detail="No h2h price from that book")
+    prediction = db.execute(
+        select(models.Prediction.prediction_id, models.Prediction.model_prob_team1, models.Prediction.model_prob_team2)
+        .where(models.Prediction.match_id == data.match_id)
+    ).first()
+
+    bet = models.Bet(
+        user_id=user.id,
+        match_id=data.match_id,
+        prediction_id=prediction.prediction_id if prediction else None,
+        amount=data.amount,
+        sports_books=data.sports_books,
+        selection=data.selection,
+        odds_taken=price,
+        model_prob=(prediction.model_prob_team1 if data.selection == "team1" else prediction.model_prob_team2)
+        if prediction else None,
+    )
+    db.add(bet)
+    db.commit()
+    return {
+        "bet_id": bet.bet_id,
+        "match_id": bet.match_id,
+        "selection": bet.selection,
+        "sports_books": bet.sports_books,
+        "amount": bet.amount,
+        "odds_taken": bet.odds_taken,
+        "model_prob": bet.model_prob,
+        "placed_at": bet.placed_at,
+    }
+
+@app.get("/bets")
+def list_bets(
+    user: auth.Principal = Depends(current_user),
+    db: Session = Depends(get_read_db),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    b = models.Bet
+    rows = db.execute(
+        select(
+            b.bet_id, b.match_id, b.selection, b.sports_books, b.amount, b.odds_taken,
+            b.model_prob, b.outcome, b.profit_loss, b.placed_at,
+        )
+        .where(b.user_id == user.id)
+        .order_by(b.placed_at.desc(), b.bet_id.desc())
+        .limit(limit)
+    )
+    return [dict(r._mapping) for r in rows]
+
+@app.get("/bets/analytics")
+def bet_analytics(user: auth.Principal = Depends(current_user), db: Session = Depends(get_read_db)):
+    """P&L over time, ROI by book and by edge bucket, and closing-line value for the caller's bets."""
+    import bets
+    return bets.user_dashboard(db, user.id)
+
+@app.post("/bets/parlay")
+def price_parlay(data: ParlayInput, db: Session = Depends(get_read_db)):
+    """
+    Fair probability and odds of a parlay from the de-vigged consensus, with an
+    optional common correlation between legs, and EV/Kelly at the offered odds
+    (default: the best price on each leg multiplied together).
+    """
+    import bets
+    import consensus
+    match_ids = [leg.match_id for leg in data.legs]
+    markets = {m["match_id"]: m for m in consensus.summarize_matches(db.execute(queries.market_rows(match_ids)).all())}
+    try:
+        return bets.parlay_quote([(leg.match_id, leg.selection) for leg in data.legs], markets, data.correlation, data.odds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Ratings
+@app.post("/matches/{match_id}/final-score")
+def set_final_score(match_id: int, data: FinalScoreInput, db: Session = Depends(get_db)):
+    import ratings
+    if db.get(models.Match, match_id) is None:
+        raise HTTPException(status_code=404, detail="Match not found")
+    stats = ratings.record_final_scores(db, {match_id: (data.team1_score, data.team2_score)})
+    if stats["scores_written"] or stats["predictions_written"]:
+        cache.bump_data_version()
+    return stats
+
+@app.post("/update-scores/")
+async def update_scores():
+    try:
+        return await api_integration.fetch_and_store_scores(database.SessionLocal, provider)
+    except Exception as e:
+        logger.error("update_scores failed: %s\n%s", e, traceback.format_exc())
+        return JSONResponse(status_code=500, content={"error": "update_scores failed", "detail": str(e)})
+
+@app.post("/ratings/rebuild")
+def rebuild_ratings(db: Session = Depends(get_db), since: str | None = Query(default=None)):
+    """Replay rating history from `since` (YYYY-MM-DD), or from scratch, e.g. after changing RATING_* settings."""
+    import ratings
+    stats = ratings.rebuild(db, datetime.fromisoformat(f"{since}T00:00:00") if since else None)
+    stats["predictions_written"] = (
+        predictions.materialize_predictions(db, team_names=stats["teams"]) if stats["teams"] else 0
+    )
+    cache.bump_data_version()
+    return stats
+
+@app.get("/ratings")
+def team_ratings(db: Session = Depends(get_read_db), as_of: str | None = Query(default=None)):
+    """Current ratings, or each team's ratings before `as_of` (YYYY-MM-DD) from the rating history."""
+    import ratings
+    if as_of is None:
+        return [
+            {
+                "team_name": r.team_name,
+                "offense_rating": r.offense_rating,
+                "defense_rating": r.defense_rating,
+                "overall_rating": r.overall_rating,
+            }
+            for r in db.execute(select(models.TeamRating).order_by(models.TeamRating.overall_rating.desc())).scalars()
+        ]
+    state = ratings.ratings_as_of(db, datetime.fromisoformat(f"{as_of}T00:00:00"))
+    out = [
+        {"team_name": name, **{f"{k}_rating": v for k, v in r._asdict().items()}, "last_match": last}
+        for name, (r, last) in state.items()
+    ]
+    return sorted(out, key=lambda r: r["overall_rating"], reverse=True)
+
+@app.get("/ratings/predict")
+def predict_as_of(
+    team1: str,
+    team2: str,
+    db: Session = Depends(get_read_db),
+    as_of: str | None = Query(default=None),
+):
+    """Reproduce the model's probability for team1 vs team2 using only results before `as_of`."""
+    import ratings
+    when = datetime.fromisoformat(f"{as_of}T00:00:00") if as_of else datetime.utcnow()
+    return ratings.predict_as_of(db, team1, team2, when)
+
+@app.get("/simulate/season")
+def simulate_season(
+    db: Session = Depends(get_read_db),
+    runs: int = Query(default=simulation.SIM_DEFAULT_RUNS, ge=1, le=simulation.SIM_MAX_RUNS),
+    seed: int = Query(default=0),
+    season: int | None = Query(default=None),
+):
+    """
+    Play out the rest of the regular season `runs` times from the current
+    ratings: projected wins, division title, playoff and first-seed odds per team.
+    """
+    return simulation.projected_season(db, runs=runs, seed=seed, season=season)
+
 
 @app.post("/debug/seed-nfl-ratings")
 def seed_nfl_ratings(db: Session = Depends(get_db)):
-    created = 0
-    for data in NFL_INITIAL_RATINGS:
+    import ratings
+    created = []
+    for data in ratings.NFL_INITIAL_RATINGS:
         existing = db.query(models.TeamRating).filter_by(team_name=data["team_name"]).first()
         if existing:
             continue
         db.add(models.TeamRating(**data))
-        created += 1
+        created.append(data["team_name"])
     db.commit()
-    return {"inserted": created}
+    written = predictions.materialize_predictions(db, team_names=created) if created else 0
+    if written:
+        cache.bump_data_version()
+    return {"inserted": len(created), "predictions_written": written}
 
 
 @app.get("/ai-predictions")
-def ai_predictions(db: Session = Depends(get_db), limit: int = Query(default=100, ge=1, le=500)):
+async def ai_predictions(
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: str | None = Query(default=None, description="X-Next-Cursor from the previous page"),
+):
     """
     AI predictions using TeamRating.overall_rating for each team.
+
+    Model probabilities are read from the materialized Prediction rows; only the
+    per-book edges are derived here, in one batch.
     """
+    after = parse_cursor(cursor)
 
-    team1 = aliased(models.SportsTeam)
-    team2 = aliased(models.SportsTeam)
-
-    base = (
-        db.query(
-            models.Match.match_id,
-            team1.team_name.label("team1"),
-            team2.team_name.label("team2"),
-            models.BettingOdds.sports_books,
-            models.BettingOdds.odds_team1,
-            models.BettingOdds.odds_team2,
-            models.Match.match_date,
-        )
-        .join(models.BettingOdds, models.Match.match_id == models.BettingOdds.match_id)
-        .join(team1, models.Match.team1_id == team1.sports_teamsid)
-        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+    async def build():
+        start_dt = datetime.utcnow()
+        end_dt = start_dt + timedelta(days=14)
+        rows = (await db.execute(queries.prediction_rows(start_dt, end_dt, limit, after))).all()
+        rows, next_cursor = queries.split_page(rows, limit)
+        return Page(predictions.rows_with_predictions(rows), next_cursor)
+
+    return await cached_json(request, ("/ai-predictions", limit, cursor), build)
+
+@app.get("/export/{dataset}")
+def export_rows(
+    dataset: Literal["matches", "odds", "snapshots", "predictions"],
+    format: Literal["ndjson", "csv", "columnar"] = Query(default="ndjson"),
+    date_from: str | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    date_to: str | None = Query(default=None, description="YYYY-MM-DD, inclusive"),
+    book: str | None = Query(default=None),
+    market: str | None = Query(default=None),
+):
+    """
+    Stream every row of `dataset` for matches in the date range (default: all),
+    for bulk pulls that would otherwise page through /odds. The export reads
+    from its own read-pool connection with a server-side cursor; see export.py
+    for the columnar layout.
+    """
+    import export
+    start = datetime.fromisoformat(f"{date_from}T00:00:00") if date_from else datetime.min
+    end = datetime.fromisoformat(f"{date_to}T23:59:59.999999") if date_to else datetime.max
+    filename = f"{dataset}_{date_from or 'start'}_{date_to or 'end'}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        export.stream_export(database.read_engine, dataset, format, start, end, book, market),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
-    start_dt = datetime.utcnow()
-    end_dt = start_dt + timedelta(days=14)
-
-    q = base.filter(
-        models.Match.match_date >= start_dt,
-        models.Match.match_date <= end_dt,
+@app.get("/backtest")
+def run_backtest(
+    db: Session = Depends(get_read_db),
+    date_from: str | None = Query(default=None),
+    date_to: str | None = Query(default=None),
+    book: str | None = Query(default=None),
+    scale_min: float = Query(default=4.0, gt=0),
+    scale_max: float = Query(default=40.0, gt=0),
+    steps: int = Query(default=73, ge=1, le=5000),
+    min_edge: list[float] = Query(default=[0.0, 2.0, 5.0]),
+    full_grid: bool = Query(default=False),
+):
+    """
+    Replay finished matches (final_score set) through the rating model:
+    log-loss, Brier, calibration and value-bet ROI for the current scale, plus a
+    grid search over scale x min_edge.
+    """
+    import backtest
+    report = backtest.run(
+        db,
+        backtest.scale_grid(scale_min, scale_max, steps),
+        min_edge,
+        datetime.fromisoformat(f"{date_from}T00:00:00") if date_from else None,
+        datetime.fromisoformat(f"{date_to}T23:59:59") if date_to else None,
+        book,
     )
-
-    rows = q.order_by(models.Match.match_date.asc()).limit(limit).all()
-
-    results = []
-    for r in rows:
-        p1_model, p2_model = model_probs_from_ratings(r.team1, r.team2, db)
-
-        results.append({
-            "match_id": r.match_id,
-            "team1": r.team1,
-            "team2": r.team2,
-            "sports_books": r.sports_books,
-            "odds_team1": r.odds_team1,
-            "odds_team2": r.odds_team2,
-            "match_date": r.match_date.isoformat() if isinstance(r.match_date, datetime) else r.match_date,
-            "model_prob_team1": p1_model,
-            "model_prob_team2": p2_model,
-        })
-
-    return JSONResponse(content=results)
+    if not full_grid:
+        report.pop("grid")
+    return report
@@ -0,0 +1,410 @@
+"""
+Request, database, provider and ingestion metrics, exposed in the Prometheus
+text format by /metrics. The registry is a few thread-safe dicts rather than a
+client library, so it adds no dependency.
+
+MetricsMiddleware times every HTTP request by route template and puts a
+RequestStats in a context variable; the SQLAlchemy cursor hooks below add each
+query to it (threadpool routes and async sessions run in a copy of that
+context), which gives queries and DB time per request. Requests that run more
+than METRICS_MANY_QUERIES queries are counted and logged once per route, as a
+likely N+1.
+
+The slow-request profiler is off unless PROFILE_SLOW_MS is set. While any
+request is in flight it samples every thread's stack each PROFILE_INTERVAL_MS;
+a request slower than the threshold keeps the samples taken during it, folded
+into collapsed stacks, for /debug/slow-requests. Samples are process-wide, so
+concurrent requests show up in each other's profiles.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+logger = logging.getLogger("uvicorn.error")
+
+METRICS_MANY_QUERIES = int(os.getenv("METRICS_MANY_QUERIES", "20"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 disables the profiler
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+_registry: List["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels, value) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket counts (+Inf last), sum, count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self, labels, value) -> List[str]:
+        counts, total, n = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_num(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+HTTP_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries run per HTTP request.", ("route",), buckets=COUNT_BUCKETS
+)
+HTTP_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in database queries per HTTP request.", ("route",))
+HTTP_MANY_QUERIES = Counter(
+    "http_requests_many_queries_total", "Requests that ran more than METRICS_MANY_QUERIES queries.", ("route",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database cursor execution time by statement type.", ("statement",), buckets=QUERY_BUCKETS
+)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out.", ("pool",))
+DB_POOL_CHECKOUTS = Gauge("db_pool_checkouts", "Connection checkouts since start.", ("pool",))
+DB_POOL_TIMEOUTS = Gauge("db_pool_timeouts", "Checkouts that timed out waiting for a connection.", ("pool",))
+PROVIDER_SECONDS = Histogram(
+    "provider_request_duration_seconds", "Odds provider HTTP call latency.", ("endpoint", "status")
+)
+PROVIDER_QUOTA_REMAINING = Gauge("provider_quota_remaining", "Provider requests remaining, from the last response.")
+INGESTION_CYCLES = Counter("ingestion_cycles_total", "Odds refresh cycles by result.", ("result",))
+INGESTION_SECONDS = Histogram(
+    "ingestion_cycle_duration_seconds", "Odds refresh cycle duration (fetch and store).",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+INGESTION_ODDS_CHANGED = Counter("ingestion_odds_changed_total", "Odds rows changed by refresh cycles.")
+INGESTION_LAST_SUCCESS = Gauge("ingestion_last_success_timestamp_seconds", "Unix time of the last successful refresh.")
+RESPONSE_CACHE = Gauge("response_cache_lookups", "Response cache hits and misses since start.", ("result",))
+RATE_LIMITED = Counter(
+    "http_rate_limited_total", "Requests rejected by the rate limiter, by rule and the bucket that was empty.", ("rule", "scope")
+)
+COALESCED_CALLS = Gauge(
+    "coalesced_calls", "Calls to coalesced operations that ran them, or shared a result, since start.", ("operation", "result")
+)
+STARTUP_SECONDS = Gauge(
+    "app_startup_seconds",
+    "Cold start: importing main, the lifespan's startup work, and from the start of the import to the first response.",
+    ("phase",),
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("metrics_request", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[RequestStats]:
+    """Count the queries run inside the block, as the middleware does for a request."""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    DB_QUERY_SECONDS.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER")
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    starts = context.connection.info.get("metrics_query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+_many_queries_logged = set()
+
+
+def observe_request(method: str, route: str, status: int, elapsed: float, stats: RequestStats) -> None:
+    HTTP_REQUESTS.inc(method, route, str(status))
+    HTTP_LATENCY.observe(elapsed, method, route)
+    HTTP_DB_QUERIES.observe(stats.queries, route)
+    HTTP_DB_SECONDS.observe(stats.db_seconds, route)
+    if stats.queries > METRICS_MANY_QUERIES:
+        HTTP_MANY_QUERIES.inc(route)
+        if route not in _many_queries_logged:
+            _many_queries_logged.add(route)
+            logger.warning("%s %s ran %d queries in one request (possible N+1)", method, route, stats.queries)
+
+
+_first_response_origin: Optional[float] = None
+
+
+def observe_startup(origin: float, imported: float, ready: float) -> None:
+    """perf_counter() readings: main starting to import, the lifespan starting, and the app ready to serve."""
+    global _first_response_origin
+    STARTUP_SECONDS.set(imported - origin, "import")
+    STARTUP_SECONDS.set(ready - imported, "lifespan")
+    _first_response_origin = origin
+    logger.info("startup: import %.0f ms, lifespan %.0f ms", (imported - origin) * 1000, (ready - imported) * 1000)
+
+
+def _observe_first_response() -> None:
+    global _first_response_origin
+    origin, _first_response_origin = _first_response_origin, None
+    if origin is not None:
+        elapsed = time.perf_counter() - origin
+        STARTUP_SECONDS.set(elapsed, "first_request")
+        logger.info("startup: first response %.0f ms after import began", elapsed * 1000)
+
+
+def observe_provider_call(endpoint: str, status: str, elapsed: float, quota_remaining: Optional[int]) -> None:
+    PROVIDER_SECONDS.observe(elapsed, endpoint, status)
+    if quota_remaining is not None:
+        PROVIDER_QUOTA_REMAINING.set(quota_remaining)
+
+
+def observe_ingestion(elapsed: float, odds_changed: Optional[int]) -> None:
+    """One refresh cycle; odds_changed is None when it failed."""
+    INGESTION_SECONDS.observe(elapsed)
+    if odds_changed is None:
+        INGESTION_CYCLES.inc("error")
+        return
+    INGESTION_CYCLES.inc("ok")
+    INGESTION_ODDS_CHANGED.inc(amount=odds_changed)
+    INGESTION_LAST_SUCCESS.set(time.time())
+
+
+# Innermost frames of threads parked in a wait; not worth a sample. Executor
+# workers and aiosqlite's connection thread block inside C calls, so they are
+# matched by function.
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+_IDLE_FRAMES = {("thread.py", "_worker"), ("core.py", "_connection_worker_thread")}
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms: float, interval_ms: float, keep: int):
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.profiles: Deque[Dict] = deque(maxlen=keep)
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=200_000)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                top = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if thread_id == me or top[0] in _IDLE_FILES or top in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self._samples.append((now, ";".join(reversed(stack))))
+            time.sleep(self.interval)
+
+    def begin(self) -> float:
+        with self._lock:
+            self._active += 1
+        self._wake.set()
+        return time.perf_counter()
+
+    def end(self, started: float, method: str, route: str) -> None:
+        ended = time.perf_counter()
+        with self._lock:
+            self._active -= 1
+        elapsed_ms = (ended - started) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        stacks = _Tally(stack for t, stack in list(self._samples) if started <= t <= ended)
+        self.profiles.append({
+            "method": method,
+            "route": route,
+            "duration_ms": elapsed_ms,
+            "at": datetime.utcnow().isoformat(),
+            "samples": sum(stacks.values()),
+            "interval_ms": self.interval * 1000,
+            "stacks": [{"stack": s, "samples": n} for s, n in stacks.most_common(25)],
+        })
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS, PROFILE_INTERVAL_MS, PROFILE_KEEP) if PROFILE_SLOW_MS > 0 else None
+
+
+def _route_template(scope) -> str:
+    """
+    The router stores the matched route in the scope. A request answered before
+    routing (a 429 from the rate limiter) has none, so it is matched against the
+    app's routes here; paths no route matches share one label.
+    """
+    route = scope.get("route")
+    if route is None and "app" in scope:
+        partial = None
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match is Match.FULL:
+                route = candidate
+                break
+            if match is Match.PARTIAL and partial is None:
+                partial = candidate
+        route = route or partial
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware task hop) so downstream code shares the RequestStats context."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = profiler.begin() if profiler else time.perf_counter()
+        try:
+            with track_queries() as stats:
+                await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = _route_template(scope)
+            if profiler:
+                profiler.end(started, scope["method"], route)
+            observe_request(scope["method"], route, status, elapsed, stats)
+            if _first_response_origin is not None:
+                _observe_first_response()
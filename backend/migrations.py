@@ -0,0 +1,287 @@
+"""Idempotent schema changes for databases created before a model change.
+
+`Base.metadata.create_all` only creates missing tables, so constraints added to
+tables that already exist are applied here. Every statement must be safe to
+run on every startup.
+
+prepare_schema() runs both from the app's startup (unless DB_AUTO_MIGRATE is
+off), or once per deploy with `python migrations.py`. On Postgres it holds an
+advisory lock while it works, so several workers starting together take turns
+instead of racing each other's DDL. It then records a fingerprint of the models
+and MIGRATIONS in schema_state; while that still matches and every table is
+there, a later start checks it with a single query and does no DDL at all.
+"""
+import hashlib
+import logging
+import os
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+logger = logging.getLogger("uvicorn.error")
+
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+# pg_advisory_xact_lock key held while the schema is created or migrated.
+SCHEMA_LOCK_KEY = int(os.getenv("DB_SCHEMA_LOCK_KEY", "7340001"))
+
+# Each duplicate team / fixture row (dup) with the row that survives it (keep):
+# the lowest id among rows sharing the key the unique index below is built on.
+_TEAM_DUPES = """
+    (SELECT sports_teamsid AS dup, min(sports_teamsid) OVER (PARTITION BY team_name) AS keep
+     FROM sports_teams) d
+"""
+_MATCH_DUPES = """
+    (SELECT match_id AS dup,
+            min(match_id) OVER (PARTITION BY sport_id, team1_id, team2_id, match_date) AS keep
+     FROM matches
+     WHERE sport_id IS NOT NULL AND team1_id IS NOT NULL AND team2_id IS NOT NULL AND match_date IS NOT NULL) d
+"""
+
+
+def _repoint(table: str, column: str, dupes: str) -> str:
+    return f"UPDATE {table} t SET {column} = d.keep FROM {dupes} WHERE t.{column} = d.dup AND d.dup <> d.keep"
+
+
+# (name, statement) pairs, applied in order. Postgres only: other dialects are
+# only used for fresh schemas, which create_all already builds completely.
+#
+# Databases from before the unique keys can hold duplicate teams and fixtures.
+# Those are merged into the surviving row before the unique indexes are built:
+# every foreign key is re-pointed to it, then the duplicates are deleted. Teams
+# go first, since merging them can turn two fixtures into duplicates.
+MIGRATIONS = [
+    (
+        "betting_odds.market",
+        "ALTER TABLE betting_odds ADD COLUMN IF NOT EXISTS market VARCHAR NOT NULL DEFAULT 'h2h'",
+    ),
+    (
+        "betting_odds.point",
+        "ALTER TABLE betting_odds ADD COLUMN IF NOT EXISTS point FLOAT",
+    ),
+    ("merge duplicate teams: sports_players", _repoint("sports_players", "sports_teamsid", _TEAM_DUPES)),
+    ("merge duplicate teams: matches.team1_id", _repoint("matches", "team1_id", _TEAM_DUPES)),
+    ("merge duplicate teams: matches.team2_id", _repoint("matches", "team2_id", _TEAM_DUPES)),
+    ("merge duplicate teams: historical_stats", _repoint("historical_stats", "team_id", _TEAM_DUPES)),
+    (
+        "merge duplicate teams: delete duplicates",
+        f"DELETE FROM sports_teams t USING {_TEAM_DUPES} WHERE t.sports_teamsid = d.dup AND d.dup <> d.keep",
+    ),
+    ("merge duplicate matches: betting_odds", _repoint("betting_odds", "match_id", _MATCH_DUPES)),
+    ("merge duplicate matches: odds_snapshots", _repoint("odds_snapshots", "match_id", _MATCH_DUPES)),
+    ("merge duplicate matches: predictions", _repoint("predictions", "match_id", _MATCH_DUPES)),
+    ("merge duplicate matches: historical_stats", _repoint("historical_stats", "match_id", _MATCH_DUPES)),
+    ("merge duplicate matches: bets", _repoint("bets", "match_id", _MATCH_DUPES)),
+    (
+        # One row per team and match: drop a duplicate's row where the survivor has one.
+        "merge duplicate matches: team_rating_history conflicts",
+        f"""
+        DELETE FROM team_rating_history t USING {_MATCH_DUPES}
+        WHERE t.match_id = d.dup AND d.dup <> d.keep
+          AND EXISTS (
+            SELECT 1 FROM team_rating_history s WHERE s.match_id = d.keep AND s.team_name = t.team_name
+          )
+        """,
+    ),
+    ("merge duplicate matches: team_rating_history", _repoint("team_rating_history", "match_id", _MATCH_DUPES)),
+    (
+        "merge duplicate matches: delete duplicates",
+        f"DELETE FROM matches t USING {_MATCH_DUPES} WHERE t.match_id = d.dup AND d.dup <> d.keep",
+    ),
+    (
+        "dedupe betting_odds per match/book/market",
+        """
+        DELETE FROM betting_odds a
+        USING betting_odds b
+        WHERE a.match_id = b.match_id
+          AND a.sports_books = b.sports_books
+          AND a.market = b.market
+          AND a.odds_id < b.odds_id
+        """,
+    ),
+    (
+        "uq_sports_teams_team_name",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_sports_teams_team_name "
+        "ON sports_teams (team_name)",
+    ),
+    (
+        "uq_matches_fixture",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_matches_fixture "
+        "ON matches (sport_id, team1_id, team2_id, match_date)",
+    ),
+    (
+        "drop uq_betting_odds_match_book (superseded by per-market key)",
+        "ALTER TABLE betting_odds DROP CONSTRAINT IF EXISTS uq_betting_odds_match_book",
+    ),
+    (
+        "drop uq_betting_odds_match_book index",
+        "DROP INDEX IF EXISTS uq_betting_odds_match_book",
+    ),
+    (
+        "uq_betting_odds_match_book_market",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_betting_odds_match_book_market "
+        "ON betting_odds (match_id, sports_books, market)",
+    ),
+    (
+        # Snapshots are appended in time order, so a BRIN index keeps time-window
+        # scans cheap at a tiny fraction of a btree's size.
+        "ix_odds_snapshots_captured_at_brin",
+        "CREATE INDEX IF NOT EXISTS ix_odds_snapshots_captured_at_brin "
+        "ON odds_snapshots USING brin (captured_at)",
+    ),
+    (
+        "predictions.model_prob_team1",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS model_prob_team1 FLOAT",
+    ),
+    (
+        "predictions.model_prob_team2",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS model_prob_team2 FLOAT",
+    ),
+    (
+        "predictions.rating_team1",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS rating_team1 FLOAT",
+    ),
+    (
+        "predictions.rating_team2",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS rating_team2 FLOAT",
+    ),
+    (
+        "predictions.model_version",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS model_version VARCHAR",
+    ),
+    (
+        "predictions.computed_at",
+        "ALTER TABLE predictions ADD COLUMN IF NOT EXISTS computed_at TIMESTAMP",
+    ),
+    (
+        # Merged fixtures can leave a match with several predictions; keep the newest.
+        "dedupe predictions per match: bets",
+        """
+        UPDATE bets b SET prediction_id = d.keep
+        FROM (SELECT prediction_id AS dup, max(prediction_id) OVER (PARTITION BY match_id) AS keep
+              FROM predictions WHERE match_id IS NOT NULL) d
+        WHERE b.prediction_id = d.dup AND d.dup <> d.keep
+        """,
+    ),
+    (
+        "dedupe predictions per match",
+        """
+        DELETE FROM predictions a
+        USING predictions b
+        WHERE a.match_id = b.match_id
+          AND a.prediction_id < b.prediction_id
+        """,
+    ),
+    (
+        "uq_predictions_match",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_predictions_match "
+        "ON predictions (match_id)",
+    ),
+    (
+        "ix_matches_date_id",
+        "CREATE INDEX IF NOT EXISTS ix_matches_date_id "
+        "ON matches (match_date, match_id) INCLUDE (team1_id, team2_id)",
+    ),
+    (
+        "ix_matches_team1_id",
+        "CREATE INDEX IF NOT EXISTS ix_matches_team1_id ON matches (team1_id)",
+    ),
+    (
+        "ix_matches_team2_id",
+        "CREATE INDEX IF NOT EXISTS ix_matches_team2_id ON matches (team2_id)",
+    ),
+    (
+        "bets.placed_at",
+        "ALTER TABLE bets ADD COLUMN IF NOT EXISTS placed_at TIMESTAMP",
+    ),
+    (
+        "bets.sports_books",
+        "ALTER TABLE bets ADD COLUMN IF NOT EXISTS sports_books VARCHAR",
+    ),
+    (
+        "bets.selection",
+        "ALTER TABLE bets ADD COLUMN IF NOT EXISTS selection VARCHAR",
+    ),
+    (
+        "bets.odds_taken",
+        "ALTER TABLE bets ADD COLUMN IF NOT EXISTS odds_taken FLOAT",
+    ),
+    (
+        "bets.model_prob",
+        "ALTER TABLE bets ADD COLUMN IF NOT EXISTS model_prob FLOAT",
+    ),
+    (
+        "ix_bets_user_placed",
+        "CREATE INDEX IF NOT EXISTS ix_bets_user_placed ON bets (user_id, placed_at)",
+    ),
+    (
+        "ix_bets_match",
+        "CREATE INDEX IF NOT EXISTS ix_bets_match ON bets (match_id)",
+    ),
+]
+
+
+def _apply(conn: Connection) -> None:
+    for name, statement in MIGRATIONS:
+        logger.info("migration: %s", name)
+        conn.execute(text(statement))
+
+
+def fingerprint(metadata: MetaData, dialect) -> str:
+    """Hash of the DDL create_all() would emit plus MIGRATIONS: changes whenever either does."""
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(str(CreateTable(table).compile(dialect=dialect)))
+        parts += sorted(str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes)
+    parts += [statement for _, statement in MIGRATIONS]
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+
+def _is_current(conn: Connection, metadata: MetaData, expected: str) -> bool:
+    try:
+        with conn.begin_nested():
+            row = conn.execute(text(
+                "SELECT fingerprint, (SELECT count(*) FROM pg_tables "
+                "WHERE schemaname = current_schema() AND tablename = ANY(:tables)) "
+                "FROM schema_state WHERE name = 'app'"
+            ), {"tables": list(metadata.tables)}).first()
+    except DBAPIError:
+        # No schema_state yet.
+        return False
+    return row is not None and row[0] == expected and row[1] == len(metadata.tables)
+
+
+def prepare_schema(engine: Engine) -> None:
+    """create_all() plus the migrations, in one transaction and, on Postgres, under SCHEMA_LOCK_KEY."""
+    import models
+
+    metadata = models.Base.metadata
+    if engine.dialect.name != "postgresql":
+        metadata.create_all(bind=engine)
+        return
+    expected = fingerprint(metadata, engine.dialect)
+    with engine.begin() as conn:
+        if _is_current(conn, metadata, expected):
+            return
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        # Another worker may have finished while this one waited for the lock.
+        if _is_current(conn, metadata, expected):
+            return
+        metadata.create_all(bind=conn)
+        _apply(conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_state "
+            "(name VARCHAR PRIMARY KEY, fingerprint VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+        conn.execute(text(
+            "INSERT INTO schema_state (name, fingerprint, applied_at) VALUES ('app', :fingerprint, now()) "
+            "ON CONFLICT (name) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, applied_at = EXCLUDED.applied_at"
+        ), {"fingerprint": expected})
+
+
+if __name__ == "__main__":
+    import database
+
+    logging.basicConfig(level=logging.INFO)
+    prepare_schema(database.engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, Float, ForeignKey, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -27,6 +27,9 @@ class Sport(Base):
 
 class SportsTeam(Base):
     __tablename__ = "sports_teams"
+    __table_args__ = (
+        UniqueConstraint("team_name", name="uq_sports_teams_team_name"),
+    )
 
     sports_teamsid = Column(Integer, primary_key=True, index=True)
     sport_id = Column(Integer, ForeignKey("sports.sport_id"))
@@ -50,6 +53,14 @@ class SportsPlayer(Base):
 
 class Match(Base):
     __tablename__ = "matches"
+    __table_args__ = (
+        UniqueConstraint("sport_id", "team1_id", "team2_id", "match_date", name="uq_matches_fixture"),
+        # Date-window scans ordered by (match_date, match_id); the team ids ride along
+        # so the matches side of the odds join is an index-only scan on Postgres.
+        Index("ix_matches_date_id", "match_date", "match_id", postgresql_include=["team1_id", "team2_id"]),
+        Index("ix_matches_team1_id", "team1_id"),
+        Index("ix_matches_team2_id", "team2_id"),
+    )
 
     match_id = Column(Integer, primary_key=True, index=True)
     sport_id = Column(Integer, ForeignKey("sports.sport_id"))
@@ -67,19 +78,45 @@ class Match(Base):
 
 class BettingOdds(Base):
     __tablename__ = "betting_odds"
+    __table_args__ = (
+        UniqueConstraint("match_id", "sports_books", "market", name="uq_betting_odds_match_book_market"),
+    )
 
     odds_id = Column(Integer, primary_key=True, index=True)
     match_id = Column(Integer, ForeignKey("matches.match_id"))
     sports_books = Column(String)
+    # "h2h" (team1/team2 moneyline), "spreads" (point = team1 handicap) or "totals" (over/under, point = total)
+    market = Column(String, nullable=False, default="h2h", server_default="h2h")
     odds_team1 = Column(Float)
     odds_team2 = Column(Float)
+    point = Column(Float)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
     match = relationship("Match", back_populates="odds")
 
 
+class OddsSnapshot(Base):
+    """Append-only price history: one row per (match, book, market) each time a price changes."""
+    __tablename__ = "odds_snapshots"
+    __table_args__ = (
+        Index("ix_odds_snapshots_match_book_time", "match_id", "sports_books", "captured_at"),
+    )
+
+    snapshot_id = Column(Integer, primary_key=True)
+    match_id = Column(Integer, ForeignKey("matches.match_id"), nullable=False)
+    sports_books = Column(String, nullable=False)
+    market = Column(String, nullable=False, default="h2h")
+    odds_team1 = Column(Float)
+    odds_team2 = Column(Float)
+    point = Column(Float)
+    captured_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class Prediction(Base):
     __tablename__ = "predictions"
+    __table_args__ = (
+        UniqueConstraint("match_id", name="uq_predictions_match"),
+    )
 
     prediction_id = Column(Integer, primary_key=True, index=True)
     match_id = Column(Integer, ForeignKey("matches.match_id"))
@@ -87,6 +124,14 @@ class Prediction(Base):
     predicted_stats = Column(String)
     confidence_score = Column(Float)
 
+    # Materialized model output and the inputs it was computed from
+    model_prob_team1 = Column(Float)
+    model_prob_team2 = Column(Float)
+    rating_team1 = Column(Float)
+    rating_team2 = Column(Float)
+    model_version = Column(String)
+    computed_at = Column(DateTime, default=datetime.utcnow)
+
     match = relationship("Match", back_populates="predictions")
 
 
@@ -103,15 +148,27 @@ class HistoricalStats(Base):
 
 class Bet(Base):
     __tablename__ = "bets"
+    __table_args__ = (
+        Index("ix_bets_user_placed", "user_id", "placed_at"),
+        Index("ix_bets_match", "match_id"),
+    )
 
     bet_id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"))
     match_id = Column(Integer, ForeignKey("matches.match_id"))
     prediction_id = Column(Integer, ForeignKey("predictions.prediction_id"))
     amount = Column(Float)
+    # "win", "loss" or "push" once settled
     outcome = Column(String)
     profit_loss = Column(Float)
 
+    # h2h bet as placed: the side, the book and its decimal price, and the model's probability for that side
+    placed_at = Column(DateTime, default=datetime.utcnow)
+    sports_books = Column(String)
+    selection = Column(String)  # "team1" or "team2"
+    odds_taken = Column(Float)
+    model_prob = Column(Float)
+
     user = relationship("User", back_populates="bets")
 
 
@@ -125,3 +182,33 @@ class TeamRating(Base):
     offense_rating = Column(Float, nullable=False, default=0.0)
     defense_rating = Column(Float, nullable=False, default=0.0)
     overall_rating = Column(Float, nullable=False, default=0.0)
+
+
+class TeamRatingHistory(Base):
+    """A team's ratings after each rated match, so any past date's ratings can be reconstructed."""
+    __tablename__ = "team_rating_history"
+    __table_args__ = (
+        UniqueConstraint("team_name", "match_id", name="uq_team_rating_history_team_match"),
+        Index("ix_team_rating_history_team_time", "team_name", "rated_at"),
+        Index("ix_team_rating_history_match", "match_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    team_name = Column(String, nullable=False)
+    match_id = Column(Integer, ForeignKey("matches.match_id"), nullable=False)
+    # Kickoff of the match the ratings were updated from
+    rated_at = Column(DateTime, nullable=False)
+    offense_rating = Column(Float, nullable=False)
+    defense_rating = Column(Float, nullable=False)
+    overall_rating = Column(Float, nullable=False)
+
+
+class RateLimitBucket(Base):
+    """Token bucket state for ratelimit.PostgresBackend, shared by every worker."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    # Whether the last take() got its tokens
+    allowed = Column(Boolean, nullable=False)
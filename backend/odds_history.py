@@ -0,0 +1,129 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+
+def _iso(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if isinstance(dt, datetime) else dt
+
+
+def _implied(decimal_odds: Optional[float]) -> Optional[float]:
+    if decimal_odds is None or decimal_odds <= 1.0:
+        return None
+    return 1.0 / decimal_odds
+
+
+def line_movement(db: Session, match_id: int, market: str = "h2h", book: Optional[str] = None) -> List[Dict]:
+    """Every recorded price for a match in time order, optionally for one book."""
+    snap = models.OddsSnapshot
+    q = (
+        select(snap.sports_books, snap.odds_team1, snap.odds_team2, snap.point, snap.captured_at)
+        .where(snap.match_id == match_id, snap.market == market)
+        .order_by(snap.sports_books, snap.captured_at)
+    )
+    if book:
+        q = q.where(snap.sports_books == book)
+    return [
+        {
+            "sports_books": r.sports_books,
+            "odds_team1": r.odds_team1,
+            "odds_team2": r.odds_team2,
+            "point": r.point,
+            "captured_at": _iso(r.captured_at),
+        }
+        for r in db.execute(q)
+    ]
+
+
+def opening_closing(db: Session, match_id: int, market: str = "h2h") -> List[Dict]:
+    """
+    First and last price per book. Prices captured after kickoff are ignored, so
+    once the game starts the last price is the closing line.
+    """
+    snap = models.OddsSnapshot
+    kickoff = select(models.Match.match_date).where(models.Match.match_id == match_id).scalar_subquery()
+    ranked = (
+        select(
+            snap.sports_books,
+            snap.odds_team1,
+            snap.odds_team2,
+            snap.point,
+            snap.captured_at,
+            func.row_number().over(partition_by=snap.sports_books, order_by=snap.captured_at.asc()).label("first_rank"),
+            func.row_number().over(partition_by=snap.sports_books, order_by=snap.captured_at.desc()).label("last_rank"),
+        )
+        .where(snap.match_id == match_id, snap.market == market, snap.captured_at <= func.coalesce(kickoff, snap.captured_at))
+        .subquery()
+    )
+    rows = db.execute(
+        select(ranked).where((ranked.c.first_rank == 1) | (ranked.c.last_rank == 1))
+    ).all()
+
+    by_book: Dict[str, Dict] = {}
+    for r in rows:
+        entry = by_book.setdefault(r.sports_books, {"sports_books": r.sports_books, "opening": None, "closing": None})
+        price = {
+            "odds_team1": r.odds_team1,
+            "odds_team2": r.odds_team2,
+            "point": r.point,
+            "captured_at": _iso(r.captured_at),
+        }
+        if r.first_rank == 1:
+            entry["opening"] = price
+        if r.last_rank == 1:
+            entry["closing"] = price
+    return sorted(by_book.values(), key=lambda e: e["sports_books"])
+
+
+def velocity(db: Session, since: datetime, until: datetime, market: str = "h2h", limit: int = 100) -> List[Dict]:
+    """
+    Per (match, book) movement inside [since, until]: number of price changes and
+    how far team1's implied probability moved, in points per hour. Fastest movers first.
+    """
+    snap = models.OddsSnapshot
+    rows = db.execute(
+        select(snap.match_id, snap.sports_books, snap.odds_team1, snap.captured_at)
+        .where(snap.market == market, snap.captured_at >= since, snap.captured_at <= until)
+        .order_by(snap.match_id, snap.sports_books, snap.captured_at)
+    )
+
+    out = []
+    key = None
+    first = last = None
+    changes = 0
+
+    def flush():
+        if key is None:
+            return
+        p_first, p_last = _implied(first.odds_team1), _implied(last.odds_team1)
+        hours = (last.captured_at - first.captured_at).total_seconds() / 3600
+        move = (p_last - p_first) * 100 if p_first is not None and p_last is not None else None
+        out.append({
+            "match_id": key[0],
+            "sports_books": key[1],
+            "changes": changes,
+            "first_odds_team1": first.odds_team1,
+            "last_odds_team1": last.odds_team1,
+            "prob_move_team1": move,
+            "pts_per_hour": move / hours if move is not None and hours > 0 else None,
+            "first_at": _iso(first.captured_at),
+            "last_at": _iso(last.captured_at),
+        })
+
+    for r in rows:
+        if (r.match_id, r.sports_books) != key:
+            flush()
+            key = (r.match_id, r.sports_books)
+            first = last = r
+            changes = 0
+        else:
+            last = r
+            changes += 1
+    flush()
+
+    out.sort(key=lambda e: abs(e["pts_per_hour"] or 0.0), reverse=True)
+    return out[:limit]
@@ -0,0 +1,187 @@
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session, aliased
+
+import models
+import serialize
+from database import dialect_insert
+
+# Rating points per logistic unit: a 12-point overall_rating edge is a ~73% favourite.
+RATING_SCALE = 12.0
+# Bump when the formula changes so materialize_predictions rewrites every row.
+MODEL_VERSION = "logistic-overall-v1"
+
+
+def win_probability(diff: float, scale: float = RATING_SCALE) -> float:
+    return 1.0 / (1.0 + math.exp(-diff / scale))
+
+
+def model_probs(
+    ratings_team1: Sequence[Optional[float]],
+    ratings_team2: Sequence[Optional[float]],
+    scale: float = RATING_SCALE,
+) -> List[float]:
+    """
+    Team1 win probability for every row; 0.5 for a row with a missing rating
+    on either side.
+    """
+    exp = math.exp
+    return [
+        1.0 / (1.0 + exp(-(a - b) / scale)) if a is not None and b is not None else 0.5
+        for a, b in zip(ratings_team1, ratings_team2)
+    ]
+
+
+def score_slate(
+    probs_team1: Sequence[Optional[float]],
+    odds_team1: Sequence[Optional[float]],
+    odds_team2: Sequence[Optional[float]],
+) -> Dict[str, List]:
+    """
+    Score a whole slate column-wise from team1 model probabilities: book implied
+    probabilities, edges (model - book, in percentage points) and the value side
+    ("team1", "team2" or None) for every row at once. A missing probability
+    counts as 0.5.
+    """
+    p1 = [p if p is not None else 0.5 for p in probs_team1]
+    p2 = [1.0 - p for p in p1]
+    b1 = [1.0 / d if d is not None and d > 1.0 else None for d in odds_team1]
+    b2 = [1.0 / d if d is not None and d > 1.0 else None for d in odds_team2]
+    e1 = [(m - b) * 100 if b is not None else None for m, b in zip(p1, b1)]
+    e2 = [(m - b) * 100 if b is not None else None for m, b in zip(p2, b2)]
+
+    best: List[Optional[float]] = []
+    side: List[Optional[str]] = []
+    for x, y in zip(e1, e2):
+        if x is None and y is None:
+            best.append(None)
+            side.append(None)
+            continue
+        x_ = x if x is not None else -math.inf
+        y_ = y if y is not None else -math.inf
+        best.append(max(x_, y_))
+        if x_ >= y_ and x_ > 0:
+            side.append("team1")
+        elif y_ > x_ and y_ > 0:
+            side.append("team2")
+        else:
+            side.append(None)
+
+    return {
+        "model_prob_team1": p1,
+        "model_prob_team2": p2,
+        "book_prob_team1": b1,
+        "book_prob_team2": b2,
+        "edge_team1": e1,
+        "edge_team2": e2,
+        "best_edge": best,
+        "value_side": side,
+    }
+
+
+PREDICTION_FIELDS = (
+    "match_id", "team1", "team2", "sports_books", "odds_team1", "odds_team2", "match_date",
+    "model_prob_team1", "model_prob_team2", "book_prob_team1", "book_prob_team2",
+    "edge_team1", "edge_team2", "best_edge", "value_side",
+)
+
+
+def rows_with_predictions(rows: List) -> List[Dict]:
+    """
+    Attach model output to rows that carry match_id, team1, team2, sports_books,
+    odds_team1, odds_team2, match_date and model_prob_team1 columns.
+    """
+    cols = serialize.columns(rows)
+    if not cols:
+        return []
+    scored = score_slate(cols["model_prob_team1"], cols["odds_team1"], cols["odds_team2"])
+    cols.update(scored)
+    cols["match_date"] = serialize.iso(cols["match_date"])
+    cols["value_side"] = [
+        t1 if side == "team1" else t2 if side == "team2" else None
+        for side, t1, t2 in zip(scored["value_side"], cols["team1"], cols["team2"])
+    ]
+    return serialize.records(PREDICTION_FIELDS, [cols[n] for n in PREDICTION_FIELDS])
+
+
+def materialize_predictions(
+    db: Session,
+    match_ids: Optional[Iterable[int]] = None,
+    team_names: Optional[Iterable[str]] = None,
+    scale: float = RATING_SCALE,
+) -> int:
+    """
+    Recompute and store the Prediction row for the given matches, or for the
+    not-yet-started matches of the given teams (a rating change must not rewrite
+    predictions for games already played). With neither, every match is
+    recomputed.
+
+    Rows whose ratings and model version are unchanged are left alone. Returns
+    the number of Prediction rows written.
+    """
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    rating1 = aliased(models.TeamRating)
+    rating2 = aliased(models.TeamRating)
+
+    q = (
+        select(
+            models.Match.match_id,
+            team1.team_name.label("team1"),
+            team2.team_name.label("team2"),
+            rating1.overall_rating.label("rating1"),
+            rating2.overall_rating.label("rating2"),
+        )
+        .join(team1, models.Match.team1_id == team1.sports_teamsid)
+        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+        .outerjoin(rating1, rating1.team_name == team1.team_name)
+        .outerjoin(rating2, rating2.team_name == team2.team_name)
+    )
+    if match_ids is not None:
+        q = q.where(models.Match.match_id.in_(list(match_ids)))
+    if team_names is not None:
+        names = list(team_names)
+        q = q.where(
+            or_(team1.team_name.in_(names), team2.team_name.in_(names)),
+            models.Match.match_date >= datetime.utcnow(),
+        )
+
+    rows = db.execute(q).all()
+    if not rows:
+        return 0
+
+    version = f"{MODEL_VERSION}:scale={scale:g}"
+    now = datetime.utcnow()
+    p1s = model_probs([r.rating1 for r in rows], [r.rating2 for r in rows], scale=scale)
+    values = [
+        {
+            "match_id": r.match_id,
+            "predicted_winner": r.team1 if p1 >= 0.5 else r.team2,
+            "confidence_score": max(p1, 1.0 - p1),
+            "model_prob_team1": p1,
+            "model_prob_team2": 1.0 - p1,
+            "rating_team1": r.rating1,
+            "rating_team2": r.rating2,
+            "model_version": version,
+            "computed_at": now,
+        }
+        for r, p1 in zip(rows, p1s)
+    ]
+
+    ins = dialect_insert(db, models.Prediction).values(values)
+    table = models.Prediction.__table__
+    stmt = ins.on_conflict_do_update(
+        index_elements=["match_id"],
+        set_={c: ins.excluded[c] for c in values[0] if c != "match_id"},
+        where=or_(
+            table.c.rating_team1.is_distinct_from(ins.excluded.rating_team1),
+            table.c.rating_team2.is_distinct_from(ins.excluded.rating_team2),
+            table.c.model_version.is_distinct_from(ins.excluded.model_version),
+        ),
+    ).returning(table.c.match_id)
+    written = len(db.execute(stmt).all())
+    db.commit()
+    return written
@@ -0,0 +1,115 @@
+"""
+Statements behind the list endpoints, built with select() so the same query runs
+on a sync Session or an AsyncSession.
+
+The list endpoints page with a keyset cursor on (match_date, match_id, odds_id)
+rather than OFFSET, so every page is a bounded range scan of ix_matches_date_id
+no matter how many seasons of matches sit in front of it.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.orm import aliased
+
+import models
+
+Cursor = Tuple[datetime, int, int]
+
+
+def encode_cursor(row) -> str:
+    raw = json.dumps([row.match_date.isoformat(), row.match_id, row.odds_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Cursor:
+    """Raises ValueError for anything encode_cursor did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        match_date, match_id, odds_id = json.loads(raw)
+        return datetime.fromisoformat(match_date), int(match_id), int(odds_id)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def _odds_base(*extra_columns) -> Select:
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    return (
+        select(
+            models.Match.match_id,
+            team1.team_name.label("team1"),
+            team2.team_name.label("team2"),
+            models.BettingOdds.sports_books,
+            models.BettingOdds.odds_team1,
+            models.BettingOdds.odds_team2,
+            *extra_columns,
+            models.Match.match_date,
+            models.BettingOdds.odds_id,
+        )
+        .join(models.BettingOdds, models.Match.match_id == models.BettingOdds.match_id)
+        .join(team1, models.Match.team1_id == team1.sports_teamsid)
+        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+    )
+
+
+def _page(stmt: Select, after: Optional[Cursor], limit: int) -> Select:
+    """Order by the keyset, start after `after` and fetch one extra row to tell whether another page exists."""
+    key = (models.Match.match_date, models.Match.match_id, models.BettingOdds.odds_id)
+    if after is not None:
+        # The two-column bound is the one the matches index can seek on; the full
+        # key then skips rows of the boundary match already sent.
+        stmt = stmt.where(
+            tuple_(*key[:2]) >= tuple_(*after[:2]),
+            tuple_(*key) > tuple_(*after),
+        )
+    return stmt.order_by(*key).limit(limit + 1)
+
+
+def odds_rows(start_dt: datetime, end_dt: datetime, market: str, limit: int, after: Optional[Cursor] = None) -> Select:
+    stmt = _odds_base(models.BettingOdds.point).where(
+        models.BettingOdds.market == market,
+        models.Match.match_date >= start_dt,
+        models.Match.match_date <= end_dt,
+    )
+    return _page(stmt, after, limit)
+
+
+def consensus_rows(start_dt: datetime, end_dt: datetime) -> Select:
+    return (
+        _odds_base()
+        .where(
+            models.BettingOdds.market == "h2h",
+            models.Match.match_date >= start_dt,
+            models.Match.match_date <= end_dt,
+        )
+        .order_by(models.Match.match_date.asc(), models.Match.match_id)
+    )
+
+
+def market_rows(match_ids) -> Select:
+    """consensus_rows() for specific matches, whatever their date."""
+    return _odds_base().where(models.BettingOdds.market == "h2h", models.Match.match_id.in_(list(match_ids)))
+
+
+def prediction_rows(start_dt: datetime, end_dt: datetime, limit: int, after: Optional[Cursor] = None) -> Select:
+    stmt = (
+        _odds_base(models.Prediction.model_prob_team1)
+        .outerjoin(models.Prediction, models.Prediction.match_id == models.Match.match_id)
+        .where(
+            models.BettingOdds.market == "h2h",
+            models.Match.match_date >= start_dt,
+            models.Match.match_date <= end_dt,
+        )
+    )
+    return _page(stmt, after, limit)
+
+
+def split_page(rows, limit: int):
+    """(rows for this page, cursor for the next page or None) from a _page() result."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
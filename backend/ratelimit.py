@@ -0,0 +1,249 @@
+"""
+Token-bucket rate limiting for the expensive endpoints: the ones that call the
+paid odds provider, and the full-table counts.
+
+Each limited route has a Rule with up to two buckets: one per client (the user
+id from a Bearer token, otherwise the client address) and one shared by all
+clients. A request takes a token from both; if either is empty it gets a 429
+with Retry-After and never reaches the route. Routes without a rule are not
+limited.
+
+Buckets live in a backend with one method, take(); a negative cost refunds.
+MemoryBackend keeps them in the process, so with N workers each allows the
+limit on its own. PostgresBackend keeps them in the rate_limit_buckets table
+and updates a bucket in a single statement, so every worker (and host) shares
+them; it fails open if the database is unreachable. RATE_LIMIT_BACKEND picks
+one.
+
+RATE_LIMIT_RULES overrides the defaults with JSON, e.g.
+{"POST /update-odds/": {"client": [6, 3], "global": [30, 10]}}: requests per
+minute, then burst, per scope. null removes a scope, or the whole rule.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Float, String, bindparam, text
+from starlette.responses import JSONResponse
+
+import auth
+import metrics
+
+logger = logging.getLogger("uvicorn.error")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory | postgres
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+# Only behind a proxy that sets X-Forwarded-For; otherwise clients could pick their own key.
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() in ("1", "true", "yes")
+
+
+class Limit(NamedTuple):
+    per_minute: float
+    burst: int
+
+    @property
+    def rate(self) -> float:
+        return self.per_minute / 60.0
+
+
+class Rule(NamedTuple):
+    client: Optional[Limit]
+    total: Optional[Limit]
+
+
+DEFAULT_RULES: Dict[str, Rule] = {
+    "POST /update-odds/": Rule(client=Limit(6, 3), total=Limit(30, 10)),
+    "GET /debug/provider": Rule(client=Limit(6, 2), total=Limit(12, 4)),
+    "GET /debug/counts": Rule(client=Limit(30, 10), total=Limit(120, 30)),
+}
+
+
+def _limit(value) -> Optional[Limit]:
+    return Limit(float(value[0]), int(value[1])) if value else None
+
+
+def rules_from_env(raw: Optional[str] = None) -> Dict[str, Rule]:
+    rules = dict(DEFAULT_RULES)
+    raw = os.getenv("RATE_LIMIT_RULES") if raw is None else raw
+    if not raw:
+        return rules
+    for name, spec in json.loads(raw).items():
+        if spec is None:
+            rules.pop(name, None)
+        else:
+            rules[name] = Rule(client=_limit(spec.get("client")), total=_limit(spec.get("global")))
+    return rules
+
+
+class MemoryBackend:
+    """Buckets in this process, least recently used dropped past max_keys."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        """
+        Take `cost` tokens: 0 if they were there, else the seconds until they
+        will be. A negative cost puts tokens back, up to the burst.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens = min(limit.burst, tokens - cost)
+            else:
+                wait = (cost - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "buckets": len(self._buckets), "max_keys": self.max_keys}
+
+
+# Refill from the database clock (UTC, like every timestamp here), so workers on different hosts agree.
+_NOW = "(now() AT TIME ZONE 'UTC')"
+_REFILLED = f"LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM {_NOW} - b.updated_at) * :rate)"
+_TAKE = text(f"""
+    INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at, allowed)
+    VALUES (:key, LEAST(:burst, GREATEST(:burst - :cost, 0)), {_NOW}, :burst >= :cost)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = CASE WHEN {_REFILLED} >= :cost THEN LEAST(:burst, {_REFILLED} - :cost) ELSE {_REFILLED} END,
+        updated_at = {_NOW},
+        allowed = {_REFILLED} >= :cost
+    RETURNING tokens, allowed
+""").bindparams(
+    bindparam("key", type_=String),
+    bindparam("burst", type_=Float),
+    bindparam("rate", type_=Float),
+    bindparam("cost", type_=Float),
+)
+
+
+class PostgresBackend:
+    """Buckets in the rate_limit_buckets table, shared by every worker on the database."""
+
+    def __init__(self, engine_factory):
+        self._engine = engine_factory
+        self.errors = 0
+        self._last_error_log = 0.0
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        params = {"key": key, "burst": float(limit.burst), "rate": limit.rate, "cost": float(cost)}
+        try:
+            async with self._engine().begin() as conn:
+                tokens, allowed = (await conn.execute(_TAKE, params)).one()
+        except Exception as e:
+            # A limiter outage must not take the endpoints down with it.
+            self.errors += 1
+            if time.monotonic() - self._last_error_log > 60:
+                self._last_error_log = time.monotonic()
+                logger.warning("rate limit backend unavailable, not limiting: %s", e)
+            return 0.0
+        return 0.0 if allowed else (cost - tokens) / limit.rate
+
+    def stats(self) -> dict:
+        return {"backend": "postgres", "errors": self.errors}
+
+
+def client_id(scope) -> str:
+    headers = dict(scope.get("headers") or ())
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization.lower().startswith("bearer "):
+        try:
+            return "user:%s" % auth.decode_access_token_cached(authorization.split(" ", 1)[1])["sub"]
+        except Exception:
+            pass
+    if RATE_LIMIT_TRUST_PROXY and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return "ip:%s" % (client[0] if client else "unknown")
+
+
+class RateLimiter:
+    def __init__(self, backend, rules: Dict[str, Rule], enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.rules = rules
+        self.enabled = enabled
+        self.limited = 0
+
+    async def check(self, name: str, rule: Rule, client: str) -> Tuple[float, str]:
+        """
+        (seconds to wait, scope of the empty bucket), or (0, "") when the
+        request may go ahead. A rejected request costs the client nothing: its
+        token is put back when the global bucket is the one that is empty.
+        """
+        client_key = f"{name}|client|{client}"
+        if rule.client is not None:
+            wait = await self.backend.take(client_key, rule.client)
+            if wait:
+                return wait, "client"
+        if rule.total is not None:
+            wait = await self.backend.take(f"{name}|global", rule.total)
+            if wait:
+                if rule.client is not None:
+                    await self.backend.take(client_key, rule.client, cost=-1.0)
+                return wait, "global"
+        return 0.0, ""
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            # In the RATE_LIMIT_RULES format
+            "rules": {name: {"client": r.client, "global": r.total} for name, r in self.rules.items()},
+            "limited": self.limited,
+            **self.backend.stats(),
+        }
+
+
+def from_env(async_engine_factory) -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "postgres":
+        backend = PostgresBackend(async_engine_factory)
+    elif RATE_LIMIT_BACKEND == "memory":
+        backend = MemoryBackend()
+    else:
+        raise ValueError(f"unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}")
+    return RateLimiter(backend, rules_from_env())
+
+
+class RateLimitMiddleware:
+    """Plain ASGI middleware; a rejected request is answered here, before routing."""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+        name = f"{scope['method']} {scope['path']}"
+        rule = self.limiter.rules.get(name)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+        wait, which = await self.limiter.check(name, rule, client_id(scope))
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+        self.limiter.limited += 1
+        metrics.RATE_LIMITED.inc(name, which)
+        retry_after = max(1, math.ceil(wait))
+        response = JSONResponse(
+            status_code=429,
+            content={"detail": f"Too many requests, please retry in {retry_after} s"},
+            headers={"Retry-After": str(retry_after)},
+        )
+        await response(scope, receive, send)
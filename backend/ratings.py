@@ -0,0 +1,337 @@
+"""
+Online team ratings.
+
+Each finished match updates both teams in O(1):
+
+- overall_rating is an Elo rating on the same logistic scale the predictions
+  use (RATING_SCALE points per logistic unit), with a margin-of-victory
+  multiplier damped for heavy favourites so ratings do not inflate;
+- offense_rating / defense_rating move with points scored / allowed relative to
+  LEAGUE_MEAN_POINTS + POINTS_PER_RATING * (offense - opposing defense).
+
+The current ratings live in TeamRating; every update is also appended to
+TeamRatingHistory so the ratings as of any date can be reproduced. When results
+arrive out of order, or the parameters change, rebuild() replays history from
+a date in one batched pass.
+"""
+import math
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, insert, select, update as sql_update
+from sqlalchemy.orm import Session, aliased
+
+import bets
+import models
+import predictions
+from backtest import parse_final_score
+from database import dialect_insert
+from predictions import RATING_SCALE, win_probability
+
+# Elo K in rating points (FiveThirtyEight's NFL K=20 converted to RATING_SCALE).
+ELO_K = float(os.getenv("RATING_ELO_K", "1.4"))
+# Offense/defense points moved per point of scoring surprise.
+POINTS_K = float(os.getenv("RATING_POINTS_K", "0.1"))
+LEAGUE_MEAN_POINTS = float(os.getenv("RATING_LEAGUE_MEAN_POINTS", "22"))
+POINTS_PER_RATING = float(os.getenv("RATING_POINTS_PER_RATING", "0.5"))
+DEFAULT_RATING = float(os.getenv("RATING_DEFAULT", "80"))
+# A gap this long between a team's games starts a new season: regress toward DEFAULT_RATING.
+SEASON_GAP_DAYS = int(os.getenv("RATING_SEASON_GAP_DAYS", "90"))
+SEASON_REGRESSION = float(os.getenv("RATING_SEASON_REGRESSION", "0.33"))
+
+# Elo points (400 per factor of 10 in odds) per rating point, for the MOV damping term.
+_ELO_PER_RATING = 400 / math.log(10) / RATING_SCALE
+
+# Preseason priors: the starting point for a full rebuild and for teams with no
+# rated games yet.
+NFL_INITIAL_RATINGS = [
+    # AFC East
+    {"team_name": "Buffalo Bills", "offense_rating": 88, "defense_rating": 84, "overall_rating": 86},
+    {"team_name": "Miami Dolphins", "offense_rating": 89, "defense_rating": 80, "overall_rating": 85},
+    {"team_name": "New England Patriots", "offense_rating": 74, "defense_rating": 79, "overall_rating": 76},
+    {"team_name": "New York Jets", "offense_rating": 78, "defense_rating": 83, "overall_rating": 80},
+
+    # AFC North
+    {"team_name": "Baltimore Ravens", "offense_rating": 88, "defense_rating": 90, "overall_rating": 89},
+    {"team_name": "Cincinnati Bengals", "offense_rating": 90, "defense_rating": 79, "overall_rating": 86},
+    {"team_name": "Cleveland Browns", "offense_rating": 78, "defense_rating": 88, "overall_rating": 83},
+    {"team_name": "Pittsburgh Steelers", "offense_rating": 76, "defense_rating": 84, "overall_rating": 80},
+
+    # AFC South
+    {"team_name": "Houston Texans", "offense_rating": 84, "defense_rating": 78, "overall_rating": 81},
+    {"team_name": "Indianapolis Colts", "offense_rating": 80, "defense_rating": 76, "overall_rating": 78},
+    {"team_name": "Jacksonville Jaguars", "offense_rating": 82, "defense_rating": 78, "overall_rating": 80},
+    {"team_name": "Tennessee Titans", "offense_rating": 75, "defense_rating": 77, "overall_rating": 76},
+
+    # AFC West
+    {"team_name": "Denver Broncos", "offense_rating": 77, "defense_rating": 76, "overall_rating": 76},
+    {"team_name": "Kansas City Chiefs", "offense_rating": 92, "defense_rating": 86, "overall_rating": 90},
+    {"team_name": "Las Vegas Raiders", "offense_rating": 76, "defense_rating": 75, "overall_rating": 76},
+    {"team_name": "Los Angeles Chargers", "offense_rating": 84, "defense_rating": 76, "overall_rating": 80},
+
+    # NFC East
+    {"team_name": "Dallas Cowboys", "offense_rating": 88, "defense_rating": 87, "overall_rating": 88},
+    {"team_name": "New York Giants", "offense_rating": 74, "defense_rating": 76, "overall_rating": 75},
+    {"team_name": "Philadelphia Eagles", "offense_rating": 90, "defense_rating": 83, "overall_rating": 87},
+    {"team_name": "Washington Commanders", "offense_rating": 74, "defense_rating": 75, "overall_rating": 74},
+
+    # NFC North
+    {"team_name": "Chicago Bears", "offense_rating": 77, "defense_rating": 74, "overall_rating": 75},
+    {"team_name": "Detroit Lions", "offense_rating": 89, "defense_rating": 79, "overall_rating": 85},
+    {"team_name": "Green Bay Packers", "offense_rating": 82, "defense_rating": 79, "overall_rating": 81},
+    {"team_name": "Minnesota Vikings", "offense_rating": 84, "defense_rating": 77, "overall_rating": 81},
+
+    # NFC South
+    {"team_name": "Atlanta Falcons", "offense_rating": 79, "defense_rating": 78, "overall_rating": 79},
+    {"team_name": "Carolina Panthers", "offense_rating": 71, "defense_rating": 75, "overall_rating": 73},
+    {"team_name": "New Orleans Saints", "offense_rating": 80, "defense_rating": 80, "overall_rating": 80},
+    {"team_name": "Tampa Bay Buccaneers", "offense_rating": 82, "defense_rating": 79, "overall_rating": 81},
+
+    # NFC West
+    {"team_name": "Arizona Cardinals", "offense_rating": 75, "defense_rating": 73, "overall_rating": 74},
+    {"team_name": "Los Angeles Rams", "offense_rating": 84, "defense_rating": 78, "overall_rating": 81},
+    {"team_name": "San Francisco 49ers", "offense_rating": 93, "defense_rating": 92, "overall_rating": 93},
+    {"team_name": "Seattle Seahawks", "offense_rating": 82, "defense_rating": 78, "overall_rating": 80},
+]
+
+
+class Rating(NamedTuple):
+    offense: float
+    defense: float
+    overall: float
+
+
+_PRIORS = {
+    r["team_name"]: Rating(r["offense_rating"], r["defense_rating"], r["overall_rating"])
+    for r in NFL_INITIAL_RATINGS
+}
+
+
+def prior(team_name: str) -> Rating:
+    return _PRIORS.get(team_name) or Rating(DEFAULT_RATING, DEFAULT_RATING, DEFAULT_RATING)
+
+
+def regress(r: Rating, amount: float = SEASON_REGRESSION) -> Rating:
+    return Rating(*(v + (DEFAULT_RATING - v) * amount for v in r))
+
+
+def update(r1: Rating, r2: Rating, points1: int, points2: int) -> Tuple[Rating, Rating]:
+    """Ratings of team1 and team2 after a team1 points1 - points2 team2 result."""
+    diff = r1.overall - r2.overall
+    result = 1.0 if points1 > points2 else 0.0 if points1 < points2 else 0.5
+    winner_diff = diff if result == 1.0 else -diff if result == 0.0 else 0.0
+    mov = math.log(max(abs(points1 - points2), 1) + 1) * 2.2 / (winner_diff * _ELO_PER_RATING * 0.001 + 2.2)
+    delta = ELO_K * mov * (result - win_probability(diff))
+
+    surprise1 = POINTS_K * (points1 - (LEAGUE_MEAN_POINTS + POINTS_PER_RATING * (r1.offense - r2.defense)))
+    surprise2 = POINTS_K * (points2 - (LEAGUE_MEAN_POINTS + POINTS_PER_RATING * (r2.offense - r1.defense)))
+    return (
+        Rating(r1.offense + surprise1, r1.defense - surprise2, r1.overall + delta),
+        Rating(r2.offense + surprise2, r2.defense - surprise1, r2.overall - delta),
+    )
+
+
+def _finished_matches(db: Session, where) -> List:
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    rows = db.execute(
+        select(
+            models.Match.match_id,
+            models.Match.match_date,
+            models.Match.final_score,
+            team1.team_name.label("team1"),
+            team2.team_name.label("team2"),
+        )
+        .join(team1, models.Match.team1_id == team1.sports_teamsid)
+        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+        .where(models.Match.final_score.is_not(None), models.Match.match_date.is_not(None), *where)
+        .order_by(models.Match.match_date, models.Match.match_id)
+    ).all()
+    out = []
+    for r in rows:
+        score = parse_final_score(r.final_score)
+        if score is not None:
+            out.append((r.match_id, r.match_date, r.team1, r.team2, score[0], score[1]))
+    return out
+
+
+def ratings_as_of(
+    db: Session, when: Optional[datetime], team_names: Optional[Iterable[str]] = None
+) -> Dict[str, Tuple[Rating, Optional[datetime]]]:
+    """
+    Each team's ratings from its last match strictly before `when` (latest if
+    None) and that match's date. Teams without history are left out; use
+    prior() for them.
+    """
+    h = models.TeamRatingHistory
+    rn = func.row_number().over(partition_by=h.team_name, order_by=(h.rated_at.desc(), h.match_id.desc()))
+    q = select(h.team_name, h.offense_rating, h.defense_rating, h.overall_rating, h.rated_at, rn.label("rn"))
+    if when is not None:
+        q = q.where(h.rated_at < when)
+    if team_names is not None:
+        q = q.where(h.team_name.in_(list(team_names)))
+    latest = q.subquery()
+    return {
+        r.team_name: (Rating(r.offense_rating, r.defense_rating, r.overall_rating), r.rated_at)
+        for r in db.execute(select(latest).where(latest.c.rn == 1))
+    }
+
+
+def _replay(matches: List, state: Dict[str, Tuple[Rating, Optional[datetime]]]):
+    """Run matches (oldest first) through update(), mutating `state`; returns the history rows."""
+    history = []
+    for match_id, when, team1, team2, p1, p2 in matches:
+        sides = []
+        for name in (team1, team2):
+            r, last = state.get(name) or (prior(name), None)
+            if last is not None and (when - last).days >= SEASON_GAP_DAYS:
+                r = regress(r)
+            sides.append(r)
+        new1, new2 = update(sides[0], sides[1], p1, p2)
+        for name, r in ((team1, new1), (team2, new2)):
+            state[name] = (r, when)
+            history.append({
+                "team_name": name,
+                "match_id": match_id,
+                "rated_at": when,
+                "offense_rating": r.offense,
+                "defense_rating": r.defense,
+                "overall_rating": r.overall,
+            })
+    return history
+
+
+def _store(db: Session, history: List[Dict], state: Dict[str, Tuple[Rating, Optional[datetime]]], teams) -> None:
+    if history:
+        db.execute(insert(models.TeamRatingHistory), history)
+    if teams:
+        values = [
+            {
+                "team_name": name,
+                "offense_rating": state[name][0].offense,
+                "defense_rating": state[name][0].defense,
+                "overall_rating": state[name][0].overall,
+            }
+            for name in sorted(teams)
+        ]
+        ins = dialect_insert(db, models.TeamRating).values(values)
+        db.execute(ins.on_conflict_do_update(
+            index_elements=["team_name"],
+            set_={c: ins.excluded[c] for c in ("offense_rating", "defense_rating", "overall_rating")},
+        ))
+
+
+def rebuild(db: Session, since: Optional[datetime] = None) -> Dict:
+    """
+    Recompute history from `since` (everything if None): drop the history rows
+    from that date on, start from each team's ratings as of `since` (or its
+    prior) and replay every finished match after it in one pass.
+    """
+    h = models.TeamRatingHistory
+    state = ratings_as_of(db, since) if since is not None else {}
+    matches = _finished_matches(db, [models.Match.match_date >= since] if since is not None else [])
+    db.execute(delete(h).where(h.rated_at >= since) if since is not None else delete(h))
+    history = _replay(matches, state)
+    teams = {row["team_name"] for row in history}
+    _store(db, history, state, teams)
+    db.commit()
+    return {"matches_rated": len(matches), "teams": sorted(teams), "rebuilt_from": since}
+
+
+def apply_results(db: Session, match_ids: Optional[Iterable[int]] = None) -> Dict:
+    """
+    Rate finished matches that have no history yet (optionally only `match_ids`).
+
+    The usual case, results arriving in kickoff order, costs O(1) per match on
+    top of one state lookup. A result older than a team's latest rated match
+    triggers rebuild() from its kickoff instead.
+    """
+    h = models.TeamRatingHistory
+    where = [~exists().where(h.match_id == models.Match.match_id)]
+    if match_ids is not None:
+        where.append(models.Match.match_id.in_(list(match_ids)))
+    matches = _finished_matches(db, where)
+    if not matches:
+        return {"matches_rated": 0, "teams": [], "rebuilt_from": None}
+
+    names = {n for m in matches for n in (m[2], m[3])}
+    state = ratings_as_of(db, None, names)
+    earliest = matches[0][1]
+    if any(last is not None and last > earliest for _, last in state.values()):
+        return rebuild(db, since=earliest)
+
+    # Start from the stored current ratings (seeded or engine-written) where present.
+    current = db.execute(
+        select(
+            models.TeamRating.team_name,
+            models.TeamRating.offense_rating,
+            models.TeamRating.defense_rating,
+            models.TeamRating.overall_rating,
+        ).where(models.TeamRating.team_name.in_(names))
+    ).all()
+    for r in current:
+        last = state.get(r.team_name, (None, None))[1]
+        state[r.team_name] = (Rating(r.offense_rating, r.defense_rating, r.overall_rating), last)
+
+    history = _replay(matches, state)
+    _store(db, history, state, names)
+    db.commit()
+    return {"matches_rated": len(matches), "teams": sorted(names), "rebuilt_from": None}
+
+
+def record_final_scores(db: Session, scores: Dict[int, Tuple[int, int]]) -> Dict:
+    """
+    Store final scores ({match_id: (team1 points, team2 points)}), rate the new
+    results, settle bets on those matches and refresh upcoming predictions for
+    the teams involved. A changed
+    score on an already rated match rebuilds from the earliest changed kickoff.
+    """
+    if not scores:
+        return {
+            "scores_written": 0, "matches_rated": 0, "teams": [], "rebuilt_from": None,
+            "bets_settled": 0, "predictions_written": 0,
+        }
+    rows = db.execute(
+        select(models.Match.match_id, models.Match.match_date, models.Match.final_score)
+        .where(models.Match.match_id.in_(list(scores)))
+    ).all()
+    changed = [r for r in rows if r.final_score != "%d-%d" % scores[r.match_id]]
+    if changed:
+        db.execute(
+            sql_update(models.Match),
+            [{"match_id": r.match_id, "final_score": "%d-%d" % scores[r.match_id]} for r in changed],
+        )
+        db.commit()
+
+    h = models.TeamRatingHistory
+    rated = set(db.scalars(
+        select(h.match_id).where(h.match_id.in_([r.match_id for r in changed])).distinct()
+    )) if changed else set()
+    if rated:
+        stats = rebuild(db, since=min(r.match_date for r in changed))
+    else:
+        stats = apply_results(db, [r.match_id for r in changed])
+    stats["scores_written"] = len(changed)
+    stats["bets_settled"] = bets.settle_bets(db, [r.match_id for r in changed])
+    stats["predictions_written"] = (
+        predictions.materialize_predictions(db, team_names=stats["teams"]) if stats["teams"] else 0
+    )
+    return stats
+
+
+def predict_as_of(db: Session, team1: str, team2: str, when: datetime, scale: float = RATING_SCALE) -> Dict:
+    """The model's team1 win probability using only results before `when`."""
+    state = ratings_as_of(db, when, [team1, team2])
+    r1 = state.get(team1, (prior(team1), None))[0]
+    r2 = state.get(team2, (prior(team2), None))[0]
+    p1 = win_probability(r1.overall - r2.overall, scale)
+    return {
+        "team1": team1,
+        "team2": team2,
+        "as_of": when,
+        "rating_team1": r1._asdict(),
+        "rating_team2": r2._asdict(),
+        "model_prob_team1": p1,
+        "model_prob_team2": 1.0 - p1,
+    }
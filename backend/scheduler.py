@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import metrics
+from api_integration import OddsApiClient, fetch_and_store_odds
+
+logger = logging.getLogger("uvicorn.error")
+
+SCHEDULER_ENABLED = os.getenv("ODDS_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Poll interval (seconds) by time until the next kickoff: the first tier whose
+# horizon covers the next commence_time wins, otherwise the idle interval applies.
+REFRESH_TIERS = [
+    (timedelta(hours=3), int(os.getenv("ODDS_REFRESH_GAMEDAY_SECONDS", "120"))),
+    (timedelta(hours=24), int(os.getenv("ODDS_REFRESH_SOON_SECONDS", "600"))),
+    (timedelta(days=3), int(os.getenv("ODDS_REFRESH_WEEK_SECONDS", "1800"))),
+]
+REFRESH_IDLE_SECONDS = int(os.getenv("ODDS_REFRESH_IDLE_SECONDS", "3600"))
+
+
+def interval_until(next_kickoff: Optional[datetime], now: Optional[datetime] = None) -> int:
+    if next_kickoff is None:
+        return REFRESH_IDLE_SECONDS
+    lead = next_kickoff - (now or datetime.utcnow())
+    for horizon, seconds in REFRESH_TIERS:
+        if lead <= horizon:
+            return seconds
+    return REFRESH_IDLE_SECONDS
+
+
+class OddsRefresher:
+    """
+    Polls the odds provider in the background and stores the results.
+
+    Manual refreshes (`refresh()`) join the run that is already in flight instead
+    of starting a second provider call.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], client: OddsApiClient):
+        self._session_factory = session_factory
+        self._client = client
+        self._inflight: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_rows_changed: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.next_run_at: Optional[datetime] = None
+        self.runs = 0
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    def add_listener(self, fn: Callable[[Dict], None]) -> None:
+        """Call `fn(stats)` on the event loop after every successful refresh."""
+        self._listeners.append(fn)
+
+    async def _refresh(self) -> Dict:
+        started = time.perf_counter()
+        self.last_run_at = datetime.utcnow()
+        try:
+            stats = await fetch_and_store_odds(self._session_factory, self._client)
+        except Exception as e:
+            self.last_error = str(e)
+            metrics.observe_ingestion(time.perf_counter() - started, None)
+            raise
+        finally:
+            self.last_duration_ms = (time.perf_counter() - started) * 1000
+            self.runs += 1
+        metrics.observe_ingestion(self.last_duration_ms / 1000, stats["odds_changed"])
+        self.last_error = None
+        self.last_rows_changed = stats["odds_changed"]
+        for fn in self._listeners:
+            try:
+                fn(stats)
+            except Exception as e:
+                logger.error("odds refresh listener failed: %s", e)
+        return stats
+
+    async def refresh(self) -> Dict:
+        """Run a refresh now, or wait for the one already running."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._refresh())
+        return await asyncio.shield(self._inflight)
+
+    async def _run_forever(self) -> None:
+        while True:
+            delay = REFRESH_IDLE_SECONDS
+            try:
+                stats = await self.refresh()
+                delay = interval_until(stats.get("next_kickoff"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("scheduled odds refresh failed: %s", e)
+                delay = min(delay, REFRESH_TIERS[0][1])
+
+            self.next_run_at = datetime.utcnow() + timedelta(seconds=delay)
+            await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    def status(self) -> Dict:
+        return {
+            "enabled": self._loop_task is not None,
+            "running": self._inflight is not None and not self._inflight.done(),
+            "runs": self.runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_rows_changed": self.last_rows_changed,
+            "last_error": self.last_error,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+            "provider": self._client.status(),
+        }
@@ -0,0 +1,78 @@
+"""
+Response encoding for the list endpoints.
+
+dumps() uses orjson when it is installed and the stdlib's C encoder otherwise;
+both give the same compact UTF-8 JSON. Rows are handled column-wise: columns()
+transposes the result rows once, datetime columns are converted in a single
+pass with iso(), and records() zips the columns back into one dict per row
+without any per-row attribute lookups.
+
+Large bodies are compressed once, when they enter the response cache, with
+brotli when that is installed and the client accepts it, gzip otherwise.
+"""
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+_encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return _encode(content).encode("utf-8")
+
+
+def columns(rows: Sequence) -> Dict[str, tuple]:
+    """{column name: values} for a list of result rows (Row or NamedTuple)."""
+    if not rows:
+        return {}
+    return dict(zip(rows[0]._fields, zip(*rows)))
+
+
+def iso(values: Sequence) -> list:
+    return [v.isoformat() if isinstance(v, datetime) else v for v in values]
+
+
+def records(names: Sequence[str], values: Sequence[Sequence]) -> List[dict]:
+    """One dict per row from parallel column sequences, keyed by `names`."""
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The content coding to answer with ("br", "gzip") or None for identity."""
+    if not accept_encoding:
+        return None
+    offered = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        offered.add(coding.strip())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered or "*" in offered:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
@@ -0,0 +1,297 @@
+"""
+Monte Carlo projection of the rest of the NFL season from TeamRating.
+
+Simulations run bit-parallel: one simulation is one bit of a Python int, so a
+game is played in every simulation at once by drawing a Bernoulli(p) bitmask,
+and each team's win total is a bit-sliced counter (one int per binary digit).
+Standings comparisons, division winners and wild cards are then bitwise
+arithmetic over those counters. Ties in the standings are broken randomly;
+NFL tiebreakers are not modelled, and tied games are left out.
+
+Runs are split into fixed-size chunks with their own seed, so a given seed
+gives the same result no matter how many worker processes run the chunks.
+"""
+import hashlib
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased
+
+import cache
+import models
+from backtest import parse_final_score
+from predictions import RATING_SCALE, model_probs
+
+SIM_DEFAULT_RUNS = int(os.getenv("SIM_DEFAULT_RUNS", "100000"))
+SIM_MAX_RUNS = int(os.getenv("SIM_MAX_RUNS", "1000000"))
+# Runs per chunk; chunk i always uses seed "<seed>:<i>".
+SIM_CHUNK = int(os.getenv("SIM_CHUNK", "25000"))
+# Every uvicorn worker starts its own pool, so by default the CPUs are shared
+# between the WEB_CONCURRENCY workers rather than each taking all of them.
+_WEB_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+SIM_WORKERS = int(os.getenv("SIM_WORKERS", str(max(1, (os.cpu_count() or 1) // _WEB_WORKERS))))
+SIM_CACHE_TTL = float(os.getenv("SIM_CACHE_TTL", "86400"))
+
+# Game probabilities are drawn with this many bits of precision.
+PROB_BITS = 16
+# Random low-order bits appended to win totals to break standings ties.
+TIEBREAK_BITS = 8
+WILD_CARDS = 3
+
+NFL_DIVISIONS = {
+    "AFC East": ["Buffalo Bills", "Miami Dolphins", "New England Patriots", "New York Jets"],
+    "AFC North": ["Baltimore Ravens", "Cincinnati Bengals", "Cleveland Browns", "Pittsburgh Steelers"],
+    "AFC South": ["Houston Texans", "Indianapolis Colts", "Jacksonville Jaguars", "Tennessee Titans"],
+    "AFC West": ["Denver Broncos", "Kansas City Chiefs", "Las Vegas Raiders", "Los Angeles Chargers"],
+    "NFC East": ["Dallas Cowboys", "New York Giants", "Philadelphia Eagles", "Washington Commanders"],
+    "NFC North": ["Chicago Bears", "Detroit Lions", "Green Bay Packers", "Minnesota Vikings"],
+    "NFC South": ["Atlanta Falcons", "Carolina Panthers", "New Orleans Saints", "Tampa Bay Buccaneers"],
+    "NFC West": ["Arizona Cardinals", "Los Angeles Rams", "San Francisco 49ers", "Seattle Seahawks"],
+}
+
+
+class SeasonInputs(NamedTuple):
+    season: int
+    teams: List[str]                        # index -> team name
+    divisions: List[List[int]]              # team indexes per division, NFL_DIVISIONS order
+    conferences: List[List[int]]            # AFC, NFC
+    wins: List[int]                         # wins already banked
+    games: List[Tuple[int, int, float]]     # remaining (team1, team2, p_team1), kickoff order
+
+
+def season_window(season: Optional[int] = None) -> Tuple[int, datetime, datetime]:
+    """NFL regular season `season`: August 1 to January 15 (default: the current one)."""
+    now = datetime.utcnow()
+    if season is None:
+        season = now.year if now.month >= 8 else now.year - 1
+    return season, datetime(season, 8, 1), datetime(season + 1, 1, 15)
+
+
+def load_season(db: Session, season: Optional[int] = None, scale: float = RATING_SCALE) -> SeasonInputs:
+    season, start, end = season_window(season)
+    teams = [t for division in NFL_DIVISIONS.values() for t in division]
+    index = {t: i for i, t in enumerate(teams)}
+
+    team1 = aliased(models.SportsTeam)
+    team2 = aliased(models.SportsTeam)
+    rating1 = aliased(models.TeamRating)
+    rating2 = aliased(models.TeamRating)
+    rows = db.execute(
+        select(
+            team1.team_name.label("team1"),
+            team2.team_name.label("team2"),
+            models.Match.final_score,
+            rating1.overall_rating.label("rating1"),
+            rating2.overall_rating.label("rating2"),
+        )
+        .join(team1, models.Match.team1_id == team1.sports_teamsid)
+        .join(team2, models.Match.team2_id == team2.sports_teamsid)
+        .outerjoin(rating1, rating1.team_name == team1.team_name)
+        .outerjoin(rating2, rating2.team_name == team2.team_name)
+        .where(models.Match.match_date >= start, models.Match.match_date < end)
+        .order_by(models.Match.match_date, models.Match.match_id)
+    ).all()
+    rows = [r for r in rows if r.team1 in index and r.team2 in index]
+
+    wins = [0] * len(teams)
+    remaining = []
+    for r in rows:
+        score = parse_final_score(r.final_score)
+        if score is None:
+            remaining.append(r)
+        elif score[0] != score[1]:
+            wins[index[r.team1] if score[0] > score[1] else index[r.team2]] += 1
+    probs = model_probs([r.rating1 for r in remaining], [r.rating2 for r in remaining], scale=scale)
+
+    divisions = [[index[t] for t in division] for division in NFL_DIVISIONS.values()]
+    conferences = [
+        [i for name, d in zip(NFL_DIVISIONS, divisions) if name.startswith(conf) for i in d]
+        for conf in ("AFC", "NFC")
+    ]
+    games = [(index[r.team1], index[r.team2], p) for r, p in zip(remaining, probs)]
+    return SeasonInputs(season, teams, divisions, conferences, wins, games)
+
+
+def _bernoulli(rng: random.Random, p: float, n: int, full: int) -> int:
+    """n-bit mask with each bit set with probability p: compare a uniform n-wide binary fraction with p, bit by bit."""
+    q = round(p * (1 << PROB_BITS))
+    if q <= 0:
+        return 0
+    if q >= 1 << PROB_BITS:
+        return full
+    lt = 0
+    # Trailing zero bits of q cannot change the outcome, so start at its lowest set bit.
+    for bit in range((q & -q).bit_length() - 1, PROB_BITS):
+        u = rng.getrandbits(n)
+        lt = (full ^ u) | lt if (q >> bit) & 1 else (full ^ u) & lt
+    return lt
+
+
+def _increment(planes: List[int], mask: int) -> None:
+    """Add 1 to the bit-sliced counter `planes` (LSB first) in every simulation selected by `mask`."""
+    for i in range(len(planes)):
+        if not mask:
+            return
+        planes[i], mask = planes[i] ^ mask, planes[i] & mask
+
+
+def _greater(a: Sequence[int], b: Sequence[int], full: int) -> Tuple[int, int]:
+    """(a > b, a == b) masks for bit-sliced numbers given MSB first."""
+    gt, eq = 0, full
+    for x, y in zip(a, b):
+        gt |= eq & x & (full ^ y)
+        eq &= full ^ (x ^ y)
+        if not eq:
+            break
+    return gt, eq
+
+
+def _constant(value: int, width: int, full: int) -> List[int]:
+    return [full if (value >> i) & 1 else 0 for i in range(width)]
+
+
+def _simulate_chunk(inputs: SeasonInputs, seed: int, chunk: int, n: int) -> Dict[str, List[int]]:
+    """Play the remaining schedule n times; per team, summed wins and counts of each outcome."""
+    rng = random.Random(f"{seed}:{chunk}")
+    full = (1 << n) - 1
+    teams = range(len(inputs.teams))
+
+    most = max((w + sum(1 for g in inputs.games if t in g[:2]) for t, w in enumerate(inputs.wins)), default=0)
+    width = max(most.bit_length(), 1)
+    planes = [_constant(w, width, full) for w in inputs.wins]
+    for t1, t2, p in inputs.games:
+        won = _bernoulli(rng, p, n, full)
+        _increment(planes[t1], won)
+        _increment(planes[t2], full ^ won)
+
+    # Standings key: wins, then random bits (MSB first). Remaining exact ties go to the lower index.
+    keys = [planes[t][::-1] + [rng.getrandbits(n) for _ in range(TIEBREAK_BITS)] for t in teams]
+    beats = {}
+    for conf in inputs.conferences:
+        for i, a in enumerate(conf):
+            for b in conf[i + 1:]:
+                gt, eq = _greater(keys[a], keys[b], full)
+                beats[a, b] = gt | (eq if a < b else 0)
+                beats[b, a] = full ^ beats[a, b]
+
+    division_winner = [0] * len(inputs.teams)
+    for division in inputs.divisions:
+        for t in division:
+            m = full
+            for u in division:
+                if u != t:
+                    m &= beats[t, u]
+            division_winner[t] = m
+
+    playoffs = [0] * len(inputs.teams)
+    first_seed = [0] * len(inputs.teams)
+    cutoff = _constant(WILD_CARDS, 4, full)[::-1]
+    for conf in inputs.conferences:
+        for t in conf:
+            # How many non-division-winners in the conference finish ahead of t.
+            ahead = [0] * 4
+            top = full
+            for u in conf:
+                if u != t:
+                    _increment(ahead, beats[u, t] & (full ^ division_winner[u]))
+                    top &= beats[t, u]
+            wild_card, _ = _greater(cutoff, ahead[::-1], full)
+            playoffs[t] = division_winner[t] | (wild_card & (full ^ division_winner[t]))
+            first_seed[t] = top
+
+    return {
+        "wins": [sum(p.bit_count() << i for i, p in enumerate(planes[t])) for t in teams],
+        "division": [m.bit_count() for m in division_winner],
+        "playoffs": [m.bit_count() for m in playoffs],
+        "first_seed": [m.bit_count() for m in first_seed],
+    }
+
+
+def _chunk_args(inputs: SeasonInputs, runs: int, seed: int):
+    return [(inputs, seed, i, min(SIM_CHUNK, runs - start)) for i, start in enumerate(range(0, runs, SIM_CHUNK))]
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def start() -> None:
+    """
+    Create the worker pool; the app calls this from its lifespan. Workers are
+    spawned rather than forked: a fork of a running server would copy its event
+    loop, threads and open database connections. Without a pool, simulate()
+    runs the chunks in this process.
+    """
+    global _executor
+    if _executor is None and SIM_WORKERS > 1:
+        _executor = ProcessPoolExecutor(max_workers=SIM_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def simulate(inputs: SeasonInputs, runs: int, seed: int) -> Dict:
+    chunks = _chunk_args(inputs, runs, seed)
+    if _executor is not None and len(chunks) > 1:
+        results = list(_executor.map(_simulate_chunk, *zip(*chunks)))
+    else:
+        results = [_simulate_chunk(*args) for args in chunks]
+
+    totals = {k: [sum(r[k][t] for r in results) for t in range(len(inputs.teams))] for k in results[0]}
+    division_of = {t: name for name, d in zip(NFL_DIVISIONS, inputs.divisions) for t in d}
+    teams = [
+        {
+            "team_name": name,
+            "division": division_of[t],
+            "wins": inputs.wins[t],
+            "projected_wins": totals["wins"][t] / runs,
+            "division_winner": totals["division"][t] / runs,
+            "playoffs": totals["playoffs"][t] / runs,
+            "first_seed": totals["first_seed"][t] / runs,
+        }
+        for t, name in enumerate(inputs.teams)
+    ]
+    teams.sort(key=lambda r: (r["division"], -r["projected_wins"]))
+    return {
+        "season": inputs.season,
+        "runs": runs,
+        "seed": seed,
+        "games_remaining": len(inputs.games),
+        "teams": teams,
+    }
+
+
+_results = cache.TTLCache(16, SIM_CACHE_TTL)
+_run_lock = threading.Lock()
+
+
+def projected_season(db: Session, runs: int = SIM_DEFAULT_RUNS, seed: int = 0, season: Optional[int] = None) -> Dict:
+    """
+    simulate() for the current ratings and schedule, cached on a digest of
+    those inputs, so it only recomputes after a rating, result or fixture
+    changes. One simulation runs at a time; it already uses every pool worker.
+    """
+    inputs = load_season(db, season)
+    key = (hashlib.blake2b(repr(inputs).encode(), digest_size=16).hexdigest(), runs, seed)
+    result = _results.get(key)
+    if result is not None:
+        return {**result, "cached": True}
+    with _run_lock:
+        result = _results.get(key)
+        if result is not None:
+            return {**result, "cached": True}
+        start = time.perf_counter()
+        result = simulate(inputs, runs, seed)
+        result["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        _results.put(key, result)
+    return {**result, "cached": False}
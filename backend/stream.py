@@ -0,0 +1,131 @@
+import asyncio
+import os
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+STREAM_HISTORY = int(os.getenv("ODDS_STREAM_HISTORY", "500"))
+STREAM_QUEUE_SIZE = int(os.getenv("ODDS_STREAM_QUEUE_SIZE", "100"))
+
+
+class Subscription:
+    def __init__(self, sport: Optional[str], match_ids: Optional[Set[int]]):
+        self.sport = sport
+        self.match_ids = match_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def wants(self, change: Dict) -> bool:
+        if self.sport is not None and change["sport"] != self.sport:
+            return False
+        if self.match_ids is not None and change["match_id"] not in self.match_ids:
+            return False
+        return True
+
+    def filter(self, changes: List[Dict]) -> List[Dict]:
+        return [c for c in changes if self.wants(c)]
+
+
+class OddsBroadcaster:
+    """
+    Fans out odds deltas from each ingestion cycle to WebSocket subscribers.
+
+    Each publish gets the next sequence number and is kept in a bounded log, so
+    a reconnecting client can pass the last sequence it saw and receive what it
+    missed. If that sequence has already fallen out of the log, is ahead of
+    this log (the server restarted), or a subscriber cannot keep up, the client
+    is told to resync from /odds instead.
+    """
+
+    def __init__(self, history: int = STREAM_HISTORY):
+        self.seq = 0
+        self._log: Deque[Tuple[int, List[Dict]]] = deque(maxlen=history)
+        self._subscribers: Set[Subscription] = set()
+        # Called as relay(seq, changes) for every batch published by this process,
+        # to hand it to the other workers (see cluster.py).
+        self.relay: Optional[Callable[[int, List[Dict]], None]] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def _send_resync(self, sub: Subscription) -> None:
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(("resync", self.seq, []))
+
+    def resync(self) -> None:
+        """Forget the log and tell every subscriber to refetch, after batches may have been missed."""
+        self._log.clear()
+        for sub in list(self._subscribers):
+            self._send_resync(sub)
+
+    def publish(self, changes: List[Dict], seq: Optional[int] = None) -> Optional[int]:
+        """
+        Publish a batch under the next sequence number, or under `seq` for a
+        batch another worker published, so every worker numbers batches alike.
+        """
+        if not changes:
+            return None
+        if seq is None:
+            self.seq += 1
+        else:
+            if seq <= self.seq:
+                return None
+            gap = seq != self.seq + 1
+            self.seq = seq
+            if gap:
+                self.resync()
+        self._log.append((self.seq, changes))
+        for sub in list(self._subscribers):
+            mine = sub.filter(changes)
+            if not mine:
+                continue
+            try:
+                sub.queue.put_nowait(("delta", self.seq, mine))
+            except asyncio.QueueFull:
+                # Drop the backlog; the client refetches a full snapshot instead.
+                self._send_resync(sub)
+        if seq is None and self.relay is not None:
+            self.relay(self.seq, changes)
+        return self.seq
+
+    def publish_ingestion(self, stats: Dict) -> Optional[int]:
+        """Publish the rows an ingestion cycle reported as new or repriced."""
+        sports = stats.get("match_sports", {})
+        return self.publish([
+            {
+                "match_id": match_id,
+                "sport": sports.get(match_id),
+                "book": book,
+                "market": market,
+                "odds_team1": o1,
+                "odds_team2": o2,
+                "point": point,
+            }
+            for match_id, book, market, o1, o2, point in stats.get("changed", [])
+        ])
+
+    def subscribe(
+        self, sport: Optional[str] = None, match_ids: Optional[Set[int]] = None, since: Optional[int] = None
+    ) -> Subscription:
+        sub = Subscription(sport, match_ids)
+        if since is not None and since > self.seq:
+            # A sequence from before a restart: numbering started over, so the
+            # client's next deltas would look like ones it has already seen.
+            sub.queue.put_nowait(("resync", self.seq, []))
+        elif since is not None and since < self.seq:
+            oldest = self._log[0][0] if self._log else self.seq + 1
+            if since + 1 < oldest:
+                sub.queue.put_nowait(("resync", self.seq, []))
+            else:
+                missed = [(seq, sub.filter(changes)) for seq, changes in self._log if seq > since]
+                missed = [(seq, mine) for seq, mine in missed if mine]
+                if len(missed) > STREAM_QUEUE_SIZE:
+                    sub.queue.put_nowait(("resync", self.seq, []))
+                else:
+                    for seq, mine in missed:
+                        sub.queue.put_nowait(("delta", seq, mine))
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
@@ -0,0 +1,42 @@
+"""
+Tests run against a throwaway SQLite database, created fresh for every test
+that asks for `db`; set TEST_DATABASE_URL to use another (empty) database.
+
+    cd backend && python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+_scratch = tempfile.TemporaryDirectory()
+# Before anything imports database, which builds its engines from these.
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{_scratch.name}/test.db"
+os.environ["ODDS_SCHEDULER_ENABLED"] = "false"
+
+import pytest
+
+
+@pytest.fixture
+def db():
+    import database
+    import fixtures
+
+    fixtures.reset_schema(database.engine)
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def seeded(db):
+    """One season of the benchmark fixtures: finished and upcoming matches, odds, snapshots, ratings."""
+    import fixtures
+
+    fixtures.seed(db, seasons=1, books=3, snapshots=3, users=0)
+    return db
@@ -0,0 +1,84 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import models
+
+
+@pytest.fixture
+def user(db):
+    u = models.User(name="Pat", email="pat@example.com", password_hash="x")
+    db.add(u)
+    db.commit()
+    auth.forget_principal(u.user_id, propagate=False)
+    return u
+
+
+def test_decoded_tokens_are_cached_until_they_expire(monkeypatch):
+    token = auth.create_access_token({"sub": "7"}, minutes=1)
+    decodes = []
+    decode = auth.decode_access_token
+    monkeypatch.setattr(auth, "decode_access_token", lambda t: decodes.append(t) or decode(t))
+
+    assert auth.decode_access_token_cached(token)["sub"] == "7"
+    assert auth.decode_access_token_cached(token)["sub"] == "7"
+    assert len(decodes) == 1
+
+    expired = auth.create_access_token({"sub": "7"}, minutes=-1)
+    with pytest.raises(Exception):
+        auth.decode_access_token_cached(expired)
+
+
+def test_principal_is_forgotten_when_the_user_write_commits(db, user):
+    auth.remember_principal(user, auth.principal_generation())
+    assert auth.cached_principal(user.user_id).name == "Pat"
+
+    user.name = "Pat Smith"
+    db.flush()
+    # Flushed, not committed: a concurrent request still reads and re-caches the old row.
+    stale = models.User(user_id=user.user_id, name="Pat", email=user.email)
+    auth.remember_principal(stale, auth.principal_generation())
+    assert auth.cached_principal(user.user_id).name == "Pat"
+
+    db.commit()
+    assert auth.cached_principal(user.user_id) is None
+
+
+def test_deleting_a_user_forgets_its_principal(db, user):
+    auth.remember_principal(user, auth.principal_generation())
+    db.delete(user)
+    db.commit()
+
+    assert auth.cached_principal(user.user_id) is None
+
+
+def test_a_load_that_overlaps_a_write_is_not_cached(user):
+    generation = auth.principal_generation()
+    auth.forget_principal(user.user_id, propagate=False)
+
+    auth.remember_principal(user, generation)
+    assert auth.cached_principal(user.user_id) is None
+
+
+def test_me_reflects_a_committed_profile_change(db, monkeypatch):
+    # Cheap argon2 parameters keep the test fast; the hash is still real.
+    monkeypatch.setattr(auth, "ARGON2_TIME_COST", 1)
+    monkeypatch.setattr(auth, "ARGON2_MEMORY_COST", 1024)
+    auth._pwd.cache_clear()
+    import main
+
+    try:
+        with TestClient(main.app) as client:
+            client.post("/auth/signup", json={"name": "Pat", "email": "pat@example.com", "password": "pw"})
+            login = client.post("/auth/login", json={"email": "pat@example.com", "password": "pw"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            assert client.get("/auth/me", headers=headers).json()["name"] == "Pat"
+
+            user = db.query(models.User).filter_by(email="pat@example.com").one()
+            user.name = "Pat Smith"
+            db.commit()
+            assert client.get("/auth/me", headers=headers).json()["name"] == "Pat Smith"
+            assert client.get("/auth/me", headers={"Authorization": "Bearer nope"}).status_code == 401
+            assert client.post("/auth/login", json={"email": "pat@example.com", "password": "no"}).status_code == 401
+    finally:
+        auth._pwd.cache_clear()
@@ -0,0 +1,122 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+import backtest
+import models
+import ratings
+
+
+def sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+
+# Four finished matches at scale 10: team1 is favoured by 1, -1, 0 and 2 logistic units.
+KNOWN = backtest.History(
+    match_id=[1, 2, 3, 4],
+    match_date=[datetime(2024, 9, d) for d in (1, 8, 15, 22)],
+    rating_diff=[10.0, -10.0, 0.0, 20.0],
+    team1_won=[1, 0, 1, 0],
+    odds_team1=[2.0, 2.5, None, 1.2],
+    odds_team2=[2.0, 1.5, None, 5.0],
+)
+# Probability the model gave the side that actually won.
+P_ACTUAL = [sigmoid(1), sigmoid(1), 0.5, 1 - sigmoid(2)]
+
+
+def test_evaluate_scores_a_known_history():
+    report = backtest.evaluate(KNOWN, scale=10.0)
+
+    assert report["log_loss"] == pytest.approx(sum(-math.log(p) for p in P_ACTUAL) / 4)
+    assert report["brier"] == pytest.approx(sum((1 - p) ** 2 for p in P_ACTUAL) / 4)
+    assert report["accuracy"] == 0.75
+    # Value bets: team1 in match 1 (won, +1), team2 in match 2 (won, +0.5),
+    # team1 in match 4 (lost, -1); match 3 has no prices.
+    roi = report["value_bets"]
+    assert roi["bets"] == 3
+    assert roi["profit"] == pytest.approx(0.5)
+    assert roi["max_drawdown"] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("arrays", [True, False])
+def test_grid_search_matches_evaluate(monkeypatch, arrays):
+    if arrays and backtest._numpy() is None:
+        pytest.skip("numpy is not installed")
+    if not arrays:
+        monkeypatch.setattr(backtest, "_numpy", lambda: None)
+
+    grid = backtest.grid_search(KNOWN, [5.0, 10.0], [0.0, 5.0, 10.0])
+
+    at_10 = {g["min_edge"]: g for g in grid if g["scale"] == 10.0}
+    expected = backtest.evaluate(KNOWN, scale=10.0)
+    for g in at_10.values():
+        for metric in ("log_loss", "brier", "accuracy"):
+            assert g[metric] == pytest.approx(expected[metric])
+    # Edges at scale 10: 23.1 (match 1), 6.4 (match 2), 4.7 (match 4) points.
+    assert [(at_10[t]["bets"], at_10[t]["profit"]) for t in (0.0, 5.0, 10.0)] == [
+        (3, pytest.approx(0.5)), (2, pytest.approx(1.5)), (1, pytest.approx(1.0)),
+    ]
+    assert len(grid) == 6
+
+
+def _league(db):
+    sport = models.Sport(sport_name="American Football")
+    db.add(sport)
+    db.flush()
+    teams = {}
+    for name in ("Kansas City Chiefs", "Denver Broncos"):
+        teams[name] = models.SportsTeam(sport_id=sport.sport_id, team_name=name)
+        db.add(teams[name])
+    db.flush()
+    return sport, teams["Kansas City Chiefs"], teams["Denver Broncos"]
+
+
+def test_load_history_uses_only_what_was_known_at_kickoff(db):
+    sport, chiefs, broncos = _league(db)
+    first_kickoff = datetime(2024, 9, 8, 17)
+    first = models.Match(
+        sport_id=sport.sport_id, team1_id=chiefs.sports_teamsid, team2_id=broncos.sports_teamsid,
+        match_date=first_kickoff, final_score="38-3",
+    )
+    second = models.Match(
+        sport_id=sport.sport_id, team1_id=broncos.sports_teamsid, team2_id=chiefs.sports_teamsid,
+        match_date=first_kickoff + timedelta(weeks=1), final_score="20-17",
+    )
+    db.add_all([first, second])
+    db.flush()
+    db.add_all([
+        models.OddsSnapshot(match_id=first.match_id, sports_books="Book A", odds_team1=1.50, odds_team2=2.70,
+                            captured_at=first_kickoff - timedelta(days=1)),
+        models.OddsSnapshot(match_id=first.match_id, sports_books="Book A", odds_team1=1.40, odds_team2=3.00,
+                            captured_at=first_kickoff - timedelta(hours=1)),
+        # In-play, after kickoff: not a price anyone could have bet before the game.
+        models.OddsSnapshot(match_id=first.match_id, sports_books="Book A", odds_team1=1.01, odds_team2=21.0,
+                            captured_at=first_kickoff + timedelta(hours=2)),
+        models.OddsSnapshot(match_id=first.match_id, sports_books="Book B", odds_team1=1.45, odds_team2=2.80,
+                            captured_at=first_kickoff - timedelta(hours=2)),
+        # The live table holds today's price, long after the game.
+        models.BettingOdds(match_id=first.match_id, sports_books="Book A", market="h2h", odds_team1=9.0, odds_team2=9.0),
+        # Written after the result: its ratings already include the second match.
+        models.Prediction(match_id=second.match_id, rating_team1=1.0, rating_team2=99.0,
+                          computed_at=first_kickoff + timedelta(weeks=2)),
+    ])
+    db.commit()
+    ratings.rebuild(db)
+
+    h = backtest.load_history(db)
+
+    chiefs_prior = ratings.prior("Kansas City Chiefs").overall
+    broncos_prior = ratings.prior("Denver Broncos").overall
+    assert h.match_id == [first.match_id, second.match_id]
+    assert h.rating_diff[0] == pytest.approx(chiefs_prior - broncos_prior)
+    after_first = ratings.ratings_as_of(db, second.match_date)
+    assert h.rating_diff[1] == pytest.approx(
+        after_first["Denver Broncos"][0].overall - after_first["Kansas City Chiefs"][0].overall
+    )
+    # Best last pre-kickoff price per side across books.
+    assert (h.odds_team1[0], h.odds_team2[0]) == (1.45, 3.00)
+    assert (h.odds_team1[1], h.odds_team2[1]) == (None, None)
+    assert h.team1_won == [1, 1]
+
+    assert backtest.load_history(db, book="Book A").odds_team1[0] == 1.40
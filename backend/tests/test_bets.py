@@ -0,0 +1,109 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import bets
+import models
+
+
+def test_settle_bets_pays_wins_takes_losses_and_pushes_ties(db):
+    sport = models.Sport(sport_name="American Football")
+    db.add(sport)
+    db.flush()
+    chiefs = models.SportsTeam(sport_id=sport.sport_id, team_name="Kansas City Chiefs")
+    broncos = models.SportsTeam(sport_id=sport.sport_id, team_name="Denver Broncos")
+    db.add_all([chiefs, broncos])
+    db.flush()
+    won = models.Match(sport_id=sport.sport_id, team1_id=chiefs.sports_teamsid, team2_id=broncos.sports_teamsid,
+                       match_date=datetime(2024, 9, 8), final_score="24-17")
+    tied = models.Match(sport_id=sport.sport_id, team1_id=broncos.sports_teamsid, team2_id=chiefs.sports_teamsid,
+                        match_date=datetime(2024, 9, 15), final_score="20-20")
+    upcoming = models.Match(sport_id=sport.sport_id, team1_id=chiefs.sports_teamsid, team2_id=broncos.sports_teamsid,
+                            match_date=datetime(2024, 9, 22))
+    db.add_all([won, tied, upcoming])
+    db.flush()
+    placed = [
+        models.Bet(match_id=won.match_id, selection="team1", amount=10, odds_taken=1.8),
+        models.Bet(match_id=won.match_id, selection="team2", amount=10, odds_taken=2.2),
+        models.Bet(match_id=tied.match_id, selection="team1", amount=10, odds_taken=2.0),
+        models.Bet(match_id=upcoming.match_id, selection="team1", amount=10, odds_taken=1.5),
+        # Not an h2h side, or no price taken: left alone.
+        models.Bet(match_id=won.match_id, selection="over", amount=10, odds_taken=1.9),
+        models.Bet(match_id=won.match_id, selection="team1", amount=10),
+    ]
+    db.add_all(placed)
+    db.commit()
+
+    assert bets.settle_bets(db, [won.match_id, tied.match_id, upcoming.match_id]) == 3
+
+    settled = db.execute(
+        select(models.Bet.outcome, models.Bet.profit_loss).order_by(models.Bet.bet_id)
+    ).all()
+    assert [tuple(s) for s in settled] == [
+        ("win", pytest.approx(8.0)), ("loss", -10.0), ("push", 0.0), (None, None), (None, None), (None, None),
+    ]
+
+
+def test_closing_line_value_uses_only_prices_from_before_kickoff(db):
+    sport = models.Sport(sport_name="American Football")
+    user = models.User(name="u", email="u@example.com", password_hash="x")
+    db.add_all([sport, user])
+    db.flush()
+    chiefs = models.SportsTeam(sport_id=sport.sport_id, team_name="Kansas City Chiefs")
+    broncos = models.SportsTeam(sport_id=sport.sport_id, team_name="Denver Broncos")
+    db.add_all([chiefs, broncos])
+    db.flush()
+    kickoffs = [datetime(2024, 9, 8, 17) + timedelta(weeks=w) for w in range(3)]
+    matches = [
+        models.Match(sport_id=sport.sport_id, team1_id=chiefs.sports_teamsid, team2_id=broncos.sports_teamsid,
+                     match_date=k, final_score="24-17")
+        for k in kickoffs
+    ]
+    db.add_all(matches)
+    db.flush()
+    snapshotted, quoted, in_play = (m.match_id for m in matches)
+    db.add_all([
+        # Closing line from the last snapshot before kickoff, not the in-play one after it.
+        models.OddsSnapshot(match_id=snapshotted, sports_books="Book A", odds_team1=2.0, odds_team2=1.9,
+                            captured_at=kickoffs[0] - timedelta(hours=1)),
+        models.OddsSnapshot(match_id=snapshotted, sports_books="Book A", odds_team1=1.1, odds_team2=7.0,
+                            captured_at=kickoffs[0] + timedelta(hours=1)),
+        # No snapshots: the live row counts only if it was last updated before kickoff.
+        models.BettingOdds(match_id=quoted, sports_books="Book A", market="h2h", odds_team1=1.8, odds_team2=2.1,
+                           updated_at=kickoffs[1] - timedelta(hours=2)),
+        models.BettingOdds(match_id=in_play, sports_books="Book A", market="h2h", odds_team1=1.05, odds_team2=9.0,
+                           updated_at=kickoffs[2] + timedelta(hours=2)),
+    ])
+    db.add_all([
+        models.Bet(user_id=user.user_id, match_id=m, sports_books="Book A", selection="team1", amount=10, odds_taken=t)
+        for m, t in ((snapshotted, 2.2), (quoted, 1.7), (in_play, 1.9))
+    ])
+    db.commit()
+
+    clv = bets.user_dashboard(db, user.user_id)["clv"]
+
+    assert clv["bets"] == 2
+    assert clv["avg_pct"] == pytest.approx(((2.2 / 2.0 - 1) + (1.7 / 1.8 - 1)) / 2 * 100)
+    assert clv["beat_close_rate"] == 0.5
+
+
+def test_parlay_probability_is_the_product_for_independent_legs():
+    assert bets.parlay_probability([0.6, 0.5, 0.7]) == pytest.approx(0.21)
+    assert bets.parlay_probability([0.6]) == 0.6
+
+
+def test_parlay_probability_rises_with_positive_correlation():
+    probs = [0.6, 0.5]
+    # Two legs: P(both) = p1 p2 + rho sqrt(p1 q1 p2 q2).
+    expected = 0.3 + 0.1 * math.sqrt(0.6 * 0.4 * 0.5 * 0.5)
+    assert bets.parlay_probability(probs, 0.1) == pytest.approx(expected)
+    assert bets.parlay_probability(probs, -0.1) < 0.3 < bets.parlay_probability(probs, 0.1)
+
+
+@pytest.mark.parametrize("correlation", [-1.0, -0.5, 0.5, 1.0])
+def test_parlay_probability_stays_within_the_frechet_bounds(correlation):
+    probs = [0.9, 0.8, 0.85]
+    joint = bets.parlay_probability(probs, correlation)
+    assert max(0.0, sum(probs) - 2) <= joint <= min(probs)
@@ -0,0 +1,21 @@
+import cache
+
+
+def test_etag_is_the_same_on_every_worker_for_the_same_content():
+    # Workers bump their data versions independently, so theirs rarely agree.
+    one, other = cache.ResponseCache(), cache.ResponseCache()
+    body = b'[{"match_id":1}]'
+
+    assert one.put("k", body, 3).etag == other.put("k", body, 17).etag
+    assert one.put("k", body, 3).etag != other.put("k", b'[{"match_id":2}]', 3).etag
+    assert (one.put("k", body, 3, {"X-Next-Cursor": "a"}).etag
+            != other.put("k", body, 3, {"X-Next-Cursor": "b"}).etag)
+
+
+def test_entries_do_not_share_their_compressed_copies():
+    c = cache.ResponseCache()
+    one, other = c.put("a", b"1", 0), c.put("b", b"2", 0)
+    one.encoded["gzip"] = b"..."
+
+    assert other.encoded == {}
+    assert one.headers is not other.headers
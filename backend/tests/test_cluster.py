@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import cache
+import cluster
+import database
+from stream import OddsBroadcaster
+
+pytestmark = pytest.mark.skipif(
+    not database.ASYNC_DATABASE_URL.startswith("postgresql"), reason="leader election needs Postgres"
+)
+
+
+class StubRefresher:
+    def __init__(self):
+        self.runs = 0
+        self.scheduled = False
+
+    async def refresh(self):
+        self.runs += 1
+        await asyncio.sleep(0.05)
+        return {"odds_changed": 3}
+
+    def start(self):
+        self.scheduled = True
+
+    async def stop(self):
+        self.scheduled = False
+
+    def status(self):
+        return {"runs": self.runs}
+
+
+def run_cluster(monkeypatch, body):
+    """Start two workers' coordinators, wait for one to lead, and run body(leader, follower)."""
+    monkeypatch.setattr(cluster, "CLUSTER_POLL_SECONDS", 0.05)
+    monkeypatch.setattr(cache, "_listeners", [])
+
+    async def go():
+        workers = [
+            cluster.Coordinator(database.ASYNC_DATABASE_URL, StubRefresher(), OddsBroadcaster(), schedule=True)
+            for _ in range(2)
+        ]
+        for w in workers:
+            await w.start()
+        try:
+            for _ in range(100):
+                if all(w.connected for w in workers) and any(w.is_leader for w in workers):
+                    break
+                await asyncio.sleep(0.05)
+            leader, follower = sorted(workers, key=lambda w: not w.is_leader)
+            assert leader.is_leader and not follower.is_leader
+            return await body(leader, follower)
+        finally:
+            for w in workers:
+                await w.stop()
+
+    return asyncio.run(go())
+
+
+def test_only_the_leader_schedules_ingestion(monkeypatch):
+    async def body(leader, follower):
+        return leader._refresher.scheduled, follower._refresher.scheduled
+
+    assert run_cluster(monkeypatch, body) == (True, False)
+
+
+def test_a_follower_forwards_manual_refreshes_to_the_leader(monkeypatch):
+    async def body(leader, follower):
+        results = await asyncio.gather(follower.refresh(), follower.refresh())
+        return results, leader._refresher.runs, follower._refresher.runs, leader.worker
+
+    results, leader_runs, follower_runs, leader_worker = run_cluster(monkeypatch, body)
+
+    # Both calls share one forward, run once by the leader's refresher.
+    assert results[0] == results[1] == {"odds_changed": 3, "worker": leader_worker, "status": {"runs": 1}}
+    assert (leader_runs, follower_runs) == (1, 0)
+
+
+def test_odds_changes_reach_the_other_workers_subscribers(monkeypatch):
+    change = {"match_id": 1, "sport": "americanfootball_nfl", "book": "Book A", "market": "h2h",
+              "odds_team1": 1.9, "odds_team2": 2.0, "point": None}
+
+    async def body(leader, follower):
+        sub = follower._broadcaster.subscribe()
+        seq = leader._broadcaster.publish([change])
+        for _ in range(100):
+            if not sub.queue.empty():
+                break
+            await asyncio.sleep(0.02)
+        return seq, sub.queue.get_nowait()
+
+    seq, message = run_cluster(monkeypatch, body)
+
+    assert message == ("delta", seq, [change])
@@ -0,0 +1,65 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import pytest
+
+from consensus import summarize_matches
+
+
+class Row(NamedTuple):
+    match_id: int
+    sports_books: str
+    odds_team1: Optional[float]
+    odds_team2: Optional[float]
+    team1: str = "Kansas City Chiefs"
+    team2: str = "Denver Broncos"
+    match_date: datetime = datetime(2024, 9, 8, 17)
+
+
+def test_books_are_de_vigged_before_they_are_averaged():
+    (m,) = summarize_matches([Row(1, "Book A", 1.5, 2.5), Row(1, "Book B", 1.6, 2.2)])
+
+    fair_a = (1 / 1.5) / (1 / 1.5 + 1 / 2.5)
+    fair_b = (1 / 1.6) / (1 / 1.6 + 1 / 2.2)
+    assert m["consensus_prob_team1"] == pytest.approx((fair_a + fair_b) / 2)
+    assert m["consensus_prob_team1"] + m["consensus_prob_team2"] == pytest.approx(1.0)
+    assert m["overround"] == {
+        "Book A": pytest.approx(1 / 1.5 + 1 / 2.5 - 1),
+        "Book B": pytest.approx(1 / 1.6 + 1 / 2.2 - 1),
+    }
+    assert m["books"] == 2
+    assert m["match_date"] == "2024-09-08T17:00:00"
+
+
+def test_best_prices_come_from_whichever_book_offers_them():
+    (m,) = summarize_matches([Row(1, "Book A", 1.5, 2.5), Row(1, "Book B", 1.6, 2.2)])
+
+    assert m["best_team1"] == {"price": 1.6, "book": "Book B"}
+    assert m["best_team2"] == {"price": 2.5, "book": "Book A"}
+    assert m["best_overround"] == pytest.approx(1 / 1.6 + 1 / 2.5 - 1)
+    assert m["arbitrage"] is False
+
+
+def test_best_prices_that_sum_below_one_are_an_arbitrage():
+    # Each book keeps a margin, but backing each side at its best price does not.
+    (m,) = summarize_matches([Row(1, "Book A", 2.1, 1.85), Row(1, "Book B", 1.85, 2.1)])
+
+    assert m["overround"]["Book A"] > 0 and m["overround"]["Book B"] > 0
+    assert m["best_overround"] == pytest.approx(2 / 2.1 - 1)
+    assert m["arbitrage"] is True
+
+
+def test_missing_or_impossible_prices_are_skipped():
+    rows = [
+        Row(1, "Book A", 1.9, 1.9),
+        Row(1, "Book B", 1.0, 30.0),
+        Row(1, "Book C", None, 2.0),
+        Row(2, "Book A", 0.5, 2.0),
+    ]
+
+    (m,) = summarize_matches(rows)
+
+    assert m["match_id"] == 1
+    assert m["books"] == 1
+    assert m["best_team2"] == {"price": 1.9, "book": "Book A"}
+    assert m["consensus_prob_team1"] == pytest.approx(0.5)
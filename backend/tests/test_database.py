@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import database
+
+
+@pytest.fixture
+def engine(tmp_path):
+    e = create_engine(
+        f"sqlite:///{tmp_path}/pool.db", poolclass=database.InstrumentedQueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=0.05,
+    )
+    yield e
+    e.dispose()
+
+
+def test_pool_counts_checkouts_and_timeouts(engine):
+    with engine.connect() as held:
+        held.execute(text("SELECT 1"))
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    with engine.connect():
+        pass
+
+    stats = database.pool_stats(engine)
+    assert (stats["checkouts"], stats["timeouts"]) == (3, 1)
+    assert stats["checked_out"] == 0 and stats["size"] == 1
+    # The timed-out caller waited out pool_timeout.
+    assert stats["wait_max_ms"] >= 50
+    assert 0 < stats["wait_avg_ms"] < stats["wait_max_ms"]
+
+
+def test_pool_settings_come_from_the_prefixed_environment(monkeypatch):
+    monkeypatch.setenv("READ_DB_POOL_SIZE", "3")
+    monkeypatch.setenv("READ_DB_POOL_TIMEOUT", "2.5")
+    monkeypatch.setenv("READ_DB_POOL_PRE_PING", "false")
+    monkeypatch.delenv("READ_DB_MAX_OVERFLOW", raising=False)
+
+    settings = database._pool_settings("READ_DB")
+
+    assert settings["pool_size"] == 3 and settings["pool_timeout"] == 2.5 and settings["pool_pre_ping"] is False
+    assert settings["max_overflow"] == 10
+
+
+@pytest.mark.skipif(database.engine.dialect.name == "sqlite", reason="SQLite keeps its default pool")
+def test_server_databases_get_the_instrumented_pool():
+    assert isinstance(database.engine.pool, database.InstrumentedQueuePool)
+    assert {"checkouts", "timeouts", "wait_avg_ms", "wait_max_ms"} <= set(database.pool_stats(database.engine))
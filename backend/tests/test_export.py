@@ -0,0 +1,39 @@
+import json
+from datetime import datetime
+
+import export
+
+COLUMNS = [("match_id", "int"), ("sports_books", "str"), ("odds_team1", "float"), ("captured_at", "datetime")]
+ROWS = [
+    (1, "Book A", float("nan"), datetime(2024, 9, 8, 17)),
+    (2, "Book A", float("inf"), None),
+    (3, None, 1.91, None),
+]
+
+
+def lines(body):
+    return [json.loads(line) for line in b"".join(body).decode().splitlines()]
+
+
+def test_ndjson_writes_non_finite_floats_as_null():
+    assert [r["odds_team1"] for r in lines(export._ndjson(COLUMNS, iter([ROWS])))] == [None, None, 1.91]
+
+
+def test_columnar_writes_non_finite_floats_as_null():
+    schema, group = lines(export._columnar("odds", COLUMNS, iter([ROWS])))
+
+    assert schema["columns"][2] == {"name": "odds_team1", "type": "float"}
+    assert group["columns"]["odds_team1"] == [None, None, 1.91]
+    assert group["columns"]["sports_books"] == {"dict": ["Book A"], "codes": [0, 0, None]}
+    assert group["columns"]["captured_at"] == [1725814800, None, None]
+
+
+def test_csv_leaves_non_finite_floats_empty():
+    body = b"".join(export._csv(COLUMNS, iter([ROWS]))).decode()
+
+    assert body.splitlines() == [
+        "match_id,sports_books,odds_team1,captured_at",
+        "1,Book A,,2024-09-08T17:00:00",
+        "2,Book A,,",
+        "3,,1.91,",
+    ]
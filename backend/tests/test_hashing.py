@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import models
+
+
+def test_hashes_past_the_pool_and_queue_are_turned_away(monkeypatch):
+    monkeypatch.setattr(auth, "_hash_slots", threading.BoundedSemaphore(2))
+    release = threading.Event()
+    monkeypatch.setattr(auth, "hash_password", lambda password: release.wait(5) and f"hashed {password}")
+
+    async def go():
+        admitted = [asyncio.ensure_future(auth.hash_password_async(p)) for p in ("a", "b")]
+        await asyncio.sleep(0)
+        with pytest.raises(auth.HashingOverloaded):
+            await auth.hash_password_async("c")
+        release.set()
+        done = await asyncio.gather(*admitted)
+        # The slots come back when the hashes finish.
+        return done, await auth.hash_password_async("d")
+
+    assert asyncio.run(go()) == (["hashed a", "hashed b"], "hashed d")
+
+
+def test_signup_and_login_answer_503_with_retry_after_when_hashing_is_full(db, monkeypatch):
+    monkeypatch.setattr(auth, "_hash_slots", threading.BoundedSemaphore(1))
+    auth._hash_slots.acquire()
+    import main
+
+    with TestClient(main.app) as client:
+        r = client.post("/auth/signup", json={"name": "Pat", "email": "pat@example.com", "password": "pw"})
+        assert r.status_code == 503
+        assert r.headers["Retry-After"] == str(auth.PASSWORD_HASH_RETRY_AFTER)
+
+        db.add(models.User(name="Pat", email="pat@example.com", password_hash="x"))
+        db.commit()
+        r = client.post("/auth/login", json={"email": "pat@example.com", "password": "pw"})
+        assert r.status_code == 503
@@ -0,0 +1,74 @@
+from sqlalchemy import func, select
+
+import api_integration
+import models
+
+
+def event(home_price, away_price=2.40):
+    return {
+        "sport_key": "americanfootball_nfl",
+        "home_team": "Kansas City Chiefs",
+        "away_team": "Denver Broncos",
+        "commence_time": "2024-09-08T17:00:00Z",
+        "bookmakers": [
+            {
+                "title": "Book A",
+                "markets": [
+                    {"key": "h2h", "outcomes": [
+                        {"name": "Kansas City Chiefs", "price": home_price},
+                        {"name": "Denver Broncos", "price": away_price},
+                    ]},
+                    {"key": "totals", "outcomes": [
+                        {"name": "Over", "price": 1.91, "point": 44.5},
+                        {"name": "Under", "price": 1.91, "point": 44.5},
+                    ]},
+                ],
+            },
+            {
+                "title": "Book B",
+                "markets": [
+                    {"key": "h2h", "outcomes": [
+                        {"name": "Kansas City Chiefs", "price": 1.60},
+                        {"name": "Denver Broncos", "price": 2.35},
+                    ]},
+                ],
+            },
+        ],
+    }
+
+
+def counts(db):
+    return {
+        model.__tablename__: db.scalar(select(func.count()).select_from(model))
+        for model in (models.SportsTeam, models.Match, models.BettingOdds, models.OddsSnapshot)
+    }
+
+
+def test_store_odds_upserts_and_snapshots_only_changed_prices(db):
+    first = api_integration.store_odds(db, [event(1.55)])
+    assert (first["odds_seen"], first["odds_changed"]) == (3, 3)
+    assert counts(db) == {"sports_teams": 2, "matches": 1, "betting_odds": 3, "odds_snapshots": 3}
+
+    # The same prices again: nothing new to record.
+    again = api_integration.store_odds(db, [event(1.55)])
+    assert (again["odds_seen"], again["odds_changed"]) == (3, 0)
+    assert again["changed"] == []
+    assert counts(db) == {"sports_teams": 2, "matches": 1, "betting_odds": 3, "odds_snapshots": 3}
+
+    # One book moves one market: that row is updated in place and snapshotted once.
+    moved = api_integration.store_odds(db, [event(1.50, 2.55)])
+    assert moved["odds_changed"] == 1
+    match_id = db.scalar(select(models.Match.match_id))
+    assert moved["changed"] == [(match_id, "Book A", "h2h", 1.50, 2.55, None)]
+    assert counts(db) == {"sports_teams": 2, "matches": 1, "betting_odds": 3, "odds_snapshots": 4}
+    live = db.execute(
+        select(models.BettingOdds.odds_team1, models.BettingOdds.odds_team2)
+        .where(models.BettingOdds.sports_books == "Book A", models.BettingOdds.market == "h2h")
+    ).one()
+    assert tuple(live) == (1.50, 2.55)
+    history = db.scalars(
+        select(models.OddsSnapshot.odds_team1)
+        .where(models.OddsSnapshot.sports_books == "Book A", models.OddsSnapshot.market == "h2h")
+        .order_by(models.OddsSnapshot.snapshot_id)
+    ).all()
+    assert history == [1.55, 1.50]
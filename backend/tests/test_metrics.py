@@ -0,0 +1,63 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+import ratelimit
+from ratelimit import Limit, Rule
+
+
+def requests_counted():
+    return dict(metrics.HTTP_REQUESTS._values)
+
+
+def counted_since(before):
+    return {k: v - before.get(k, 0) for k, v in requests_counted().items() if v != before.get(k, 0)}
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    import main
+
+    # One request to /odds/history/7, then a 429.
+    monkeypatch.setattr(main.rate_limiter, "backend", ratelimit.MemoryBackend())
+    monkeypatch.setattr(main.rate_limiter, "rules", {"GET /odds/history/7": Rule(client=Limit(0.06, 1), total=None)})
+    monkeypatch.setattr(main.rate_limiter, "enabled", True)
+    return TestClient(main.app)
+
+
+def test_requests_are_counted_by_route_template_and_status(client):
+    before = requests_counted()
+
+    client.get("/odds/history/3")
+    client.get("/odds/history/4")
+    client.post("/odds/history/3")
+    client.get("/no/such/path")
+
+    assert counted_since(before) == {
+        ("GET", "/odds/history/{match_id}", "200"): 2,
+        ("POST", "/odds/history/{match_id}", "405"): 1,
+        ("GET", "unmatched", "404"): 1,
+    }
+
+
+def test_rate_limited_requests_keep_their_route_label(client):
+    before = requests_counted()
+
+    assert client.get("/odds/history/7").status_code == 200
+    assert client.get("/odds/history/7").status_code == 429
+
+    assert counted_since(before) == {
+        ("GET", "/odds/history/{match_id}", "200"): 1,
+        ("GET", "/odds/history/{match_id}", "429"): 1,
+    }
+
+
+def test_queries_run_by_a_request_are_counted_for_its_route(client):
+    route = ("/odds/history/{match_id}",)
+    before = metrics.HTTP_DB_QUERIES._values.get(route, [None, 0.0, 0])[1:]
+
+    client.get("/odds/history/3")
+
+    total, n = metrics.HTTP_DB_QUERIES._values[route][1:]
+    assert n == before[1] + 1
+    assert total > before[0]
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import database
+import migrations
+
+pytestmark = pytest.mark.skipif(
+    database.engine.dialect.name != "postgresql", reason="migrations only run on Postgres (TEST_DATABASE_URL)"
+)
+
+# The unique keys the migrations add, which a database from before them lacks.
+UNIQUE_KEYS = {
+    "sports_teams": "uq_sports_teams_team_name",
+    "matches": "uq_matches_fixture",
+    "betting_odds": "uq_betting_odds_match_book_market",
+    "predictions": "uq_predictions_match",
+}
+
+
+def test_prepare_schema_merges_duplicate_teams_and_matches(db):
+    kickoff = datetime(2024, 9, 8, 17)
+    with database.engine.begin() as conn:
+        for table, name in UNIQUE_KEYS.items():
+            conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {name}"))
+        conn.execute(text("DROP TABLE IF EXISTS schema_state"))
+
+        def run(sql, **params):
+            return conn.execute(text(sql), params).scalar() if "RETURNING" in sql else conn.execute(text(sql), params)
+
+        sport = run("INSERT INTO sports (sport_name) VALUES ('American Football') RETURNING sport_id")
+        chiefs = run("INSERT INTO sports_teams (sport_id, team_name) VALUES (:s, 'Kansas City Chiefs') "
+                     "RETURNING sports_teamsid", s=sport)
+        chiefs_dup = run("INSERT INTO sports_teams (sport_id, team_name) VALUES (:s, 'Kansas City Chiefs') "
+                         "RETURNING sports_teamsid", s=sport)
+        broncos = run("INSERT INTO sports_teams (sport_id, team_name) VALUES (:s, 'Denver Broncos') "
+                      "RETURNING sports_teamsid", s=sport)
+        run("INSERT INTO sports_players (sports_teamsid, player_name) VALUES (:t, 'QB')", t=chiefs_dup)
+        # The same fixture twice, once through each copy of the team.
+        match = run("INSERT INTO matches (sport_id, team1_id, team2_id, match_date) VALUES (:s, :a, :b, :d) "
+                    "RETURNING match_id", s=sport, a=chiefs, b=broncos, d=kickoff)
+        match_dup = run("INSERT INTO matches (sport_id, team1_id, team2_id, match_date) VALUES (:s, :a, :b, :d) "
+                        "RETURNING match_id", s=sport, a=chiefs_dup, b=broncos, d=kickoff)
+        for m, price in ((match, 1.5), (match_dup, 1.6)):
+            run("INSERT INTO betting_odds (match_id, sports_books, market, odds_team1, odds_team2) "
+                "VALUES (:m, 'Book A', 'h2h', :p, 2.5)", m=m, p=price)
+            run("INSERT INTO odds_snapshots (match_id, sports_books, market, odds_team1, odds_team2, captured_at) "
+                "VALUES (:m, 'Book A', 'h2h', :p, 2.5, :d)", m=m, p=price, d=kickoff)
+        prediction = run("INSERT INTO predictions (match_id) VALUES (:m) RETURNING prediction_id", m=match)
+        prediction_dup = run("INSERT INTO predictions (match_id) VALUES (:m) RETURNING prediction_id", m=match_dup)
+        run("INSERT INTO bets (match_id, prediction_id, amount) VALUES (:m, :p, 10)", m=match_dup, p=prediction)
+
+    migrations.prepare_schema(database.engine)
+
+    with database.engine.connect() as conn:
+        def q(sql):
+            return conn.execute(text(sql)).all()
+
+        assert q("SELECT sports_teamsid FROM sports_teams WHERE team_name = 'Kansas City Chiefs'") == [(chiefs,)]
+        assert q("SELECT sports_teamsid FROM sports_players") == [(chiefs,)]
+        assert q("SELECT match_id, team1_id FROM matches") == [(match, chiefs)]
+        # The newer duplicate price wins, as for any duplicate odds row.
+        assert q("SELECT match_id, odds_team1 FROM betting_odds") == [(match, 1.6)]
+        assert sorted(q("SELECT match_id FROM odds_snapshots")) == [(match,), (match,)]
+        assert q("SELECT prediction_id, match_id FROM predictions") == [(prediction_dup, match)]
+        assert q("SELECT match_id, prediction_id FROM bets") == [(match, prediction_dup)]
+        indexes = {r[0] for r in q("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")}
+        assert set(UNIQUE_KEYS.values()) <= indexes
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import queries
+
+START, END = datetime(2000, 1, 1), datetime(2100, 1, 1)
+
+
+def test_odds_pages_follow_their_cursors_to_the_full_result(db, seeded):
+    everything = db.execute(queries.odds_rows(START, END, "h2h", limit=100000)).all()
+    assert len(everything) > 20
+
+    pages, after = [], None
+    while True:
+        rows, cursor = queries.split_page(db.execute(queries.odds_rows(START, END, "h2h", 7, after)).all(), 7)
+        pages.append(rows)
+        if cursor is None:
+            break
+        after = queries.decode_cursor(cursor)
+        assert after == (rows[-1].match_date, rows[-1].match_id, rows[-1].odds_id)
+
+    assert all(len(p) == 7 for p in pages[:-1])
+    assert [r.odds_id for p in pages for r in p] == [r.odds_id for r in everything]
+
+
+def test_last_page_has_no_cursor():
+    rows = [object()] * 3
+    assert queries.split_page(rows, 3) == (rows, None)
+
+
+@pytest.mark.parametrize("token", ["", "not-a-cursor", "WzEsMl0"])
+def test_decode_cursor_rejects_what_encode_cursor_did_not_produce(token):
+    with pytest.raises(ValueError):
+        queries.decode_cursor(token)
+
+
+def pages(client, path, **params):
+    """Every row of an async list endpoint, following X-Next-Cursor."""
+    rows, cursor = [], None
+    while True:
+        response = client.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        rows += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return rows
+
+
+def test_async_odds_route_returns_the_sync_querys_rows(db, seeded):
+    import cache
+    import main
+
+    cache.bump_data_version()
+    with TestClient(main.app) as client:
+        served = pages(client, "/odds", date_from="2000-01-01", date_to="2099-12-31", limit=37)
+
+    expected = db.execute(queries.odds_rows(START, END, "h2h", limit=100000)).all()
+
+    assert [(r["match_id"], r["sports_books"], r["odds_team1"], r["odds_team2"]) for r in served] == [
+        (r.match_id, r.sports_books, r.odds_team1, r.odds_team2) for r in expected
+    ]
+
+
+def test_async_predictions_route_reads_the_materialized_probabilities(db, seeded):
+    import cache
+    import main
+
+    cache.bump_data_version()
+    now = datetime.utcnow()
+    with TestClient(main.app) as client:
+        served = pages(client, "/ai-predictions", limit=41)
+
+    expected = db.execute(queries.prediction_rows(now, now + timedelta(days=14), limit=100000)).all()
+    assert expected and all(r.model_prob_team1 is not None for r in expected)
+
+    assert [(r["match_id"], r["sports_books"]) for r in served] == [(r.match_id, r.sports_books) for r in expected]
+    assert [r["model_prob_team1"] for r in served] == pytest.approx([r.model_prob_team1 for r in expected])
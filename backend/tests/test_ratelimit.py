@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import database
+import ratelimit
+from ratelimit import Limit, Rule
+
+
+BACKENDS = ["memory"] + (["postgres"] if database.engine.dialect.name == "postgresql" else [])
+
+
+def limiter(kind, rule):
+    backend = ratelimit.MemoryBackend() if kind == "memory" else ratelimit.PostgresBackend(database.async_engine)
+    return ratelimit.RateLimiter(backend, {"GET /x": rule}, enabled=True)
+
+
+def checks(rl, rule, clients):
+    async def go():
+        try:
+            return [await rl.check("GET /x", rule, c) for c in clients]
+        finally:
+            await database.dispose_async_engines()
+    return asyncio.run(go())
+
+
+# Slow enough that nothing refills during a test.
+SLOW = 0.06
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_client_bucket_allows_its_burst_then_waits_for_a_refill(db, kind):
+    rule = Rule(client=Limit(SLOW, 2), total=None)
+    rl = limiter(kind, rule)
+
+    results = checks(rl, rule, ["a", "a", "a", "b"])
+
+    assert [r[1] for r in results] == ["", "", "client", ""]
+    # One token every 1000 s.
+    assert results[2][0] == pytest.approx(1000, rel=0.01)
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_global_rejection_does_not_use_up_the_clients_tokens(db, kind):
+    rule = Rule(client=Limit(SLOW, 2), total=Limit(SLOW, 2))
+    rl = limiter(kind, rule)
+
+    # b and c empty the global bucket; a's requests are then rejected by it...
+    assert [r[1] for r in checks(rl, rule, ["b", "c", "a", "a"])] == ["", "", "global", "global"]
+    # ...without touching a's own bucket, which still holds its full burst.
+    client_only = Rule(client=rule.client, total=None)
+    assert [r[1] for r in checks(rl, client_only, ["a", "a", "a"])] == ["", "", "client"]
+
+
+def test_refund_never_overfills_a_bucket():
+    backend = ratelimit.MemoryBackend()
+    limit = Limit(SLOW, 2)
+
+    async def go():
+        await backend.take("k", limit, cost=-1.0)
+        return [await backend.take("k", limit) for _ in range(3)]
+
+    assert [wait == 0 for wait in asyncio.run(go())] == [True, True, False]
+
+
+def test_rules_from_env_overrides_and_removes_defaults():
+    rules = ratelimit.rules_from_env('{"GET /debug/counts": null, "POST /update-odds/": {"client": [1, 1]}}')
+
+    assert "GET /debug/counts" not in rules
+    assert rules["POST /update-odds/"] == Rule(client=Limit(1.0, 1), total=None)
+    assert rules["GET /debug/provider"] == ratelimit.DEFAULT_RULES["GET /debug/provider"]
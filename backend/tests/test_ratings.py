@@ -0,0 +1,57 @@
+from itertools import groupby
+
+import pytest
+from sqlalchemy import delete, select
+
+import models
+import ratings
+
+
+def snapshot(db):
+    h = models.TeamRatingHistory
+    history = db.execute(
+        select(h.team_name, h.match_id, h.rated_at, h.overall_rating).order_by(h.match_id, h.team_name)
+    ).all()
+    current = db.execute(
+        select(models.TeamRating.team_name, models.TeamRating.overall_rating).order_by(models.TeamRating.team_name)
+    ).all()
+    return [tuple(r) for r in history], [tuple(r) for r in current]
+
+
+def finished_by_week(db):
+    m = models.Match
+    rows = db.execute(
+        select(m.match_id, m.match_date).where(m.final_score.is_not(None)).order_by(m.match_date, m.match_id)
+    ).all()
+    return [[r.match_id for r in week] for _, week in groupby(rows, key=lambda r: r.match_date.date())]
+
+
+def clear(db):
+    db.execute(delete(models.TeamRatingHistory))
+    db.execute(delete(models.TeamRating))
+    db.commit()
+
+
+def approx(snap):
+    history, current = snap
+    return (
+        [(t, m, d, pytest.approx(o)) for t, m, d, o in history],
+        [(t, pytest.approx(o)) for t, o in current],
+    )
+
+
+@pytest.mark.parametrize("order", ["kickoff", "late result"])
+def test_apply_results_week_by_week_matches_a_full_rebuild(db, seeded, order):
+    ratings.rebuild(db)
+    rebuilt = snapshot(db)
+    assert rebuilt[0]
+
+    weeks = finished_by_week(db)
+    if order == "late result":
+        # One week's results arrive after the next week's: apply_results must rebuild from it.
+        weeks[1], weeks[2] = weeks[2], weeks[1]
+    clear(db)
+    for ids in weeks:
+        ratings.apply_results(db, ids)
+
+    assert snapshot(db) == approx(rebuilt)
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+import cache
+import models
+import simulation
+
+SEASON = 2024
+
+
+@pytest.fixture
+def league(db, monkeypatch):
+    """Four AFC East teams in 2024: one result in, two games to play."""
+    monkeypatch.setattr(simulation, "_results", cache.TTLCache(16, 60))
+    sport = models.Sport(sport_name="American Football")
+    db.add(sport)
+    db.flush()
+    names = simulation.NFL_DIVISIONS["AFC East"]
+    teams = [models.SportsTeam(sport_id=sport.sport_id, team_name=n) for n in names]
+    db.add_all(teams)
+    db.add_all([models.TeamRating(team_name=n, overall_rating=r) for n, r in zip(names, (60, 40, 30, 50))])
+    db.flush()
+    bills, dolphins, patriots, jets = (t.sports_teamsid for t in teams)
+    db.add_all([
+        models.Match(sport_id=sport.sport_id, team1_id=bills, team2_id=jets,
+                     match_date=datetime(2024, 9, 8, 17), final_score="24-17"),
+        models.Match(sport_id=sport.sport_id, team1_id=dolphins, team2_id=patriots,
+                     match_date=datetime(2024, 9, 15, 17)),
+        models.Match(sport_id=sport.sport_id, team1_id=bills, team2_id=dolphins, match_date=datetime(2024, 9, 22, 17)),
+    ])
+    db.commit()
+    return db
+
+
+def test_a_repeat_run_is_served_from_the_cache(league):
+    first = simulation.projected_season(league, runs=500, seed=1, season=SEASON)
+    again = simulation.projected_season(league, runs=500, seed=1, season=SEASON)
+
+    assert first["cached"] is False and again["cached"] is True
+    assert again["teams"] == first["teams"]
+    assert first["games_remaining"] == 2
+    bills = next(t for t in first["teams"] if t["team_name"] == "Buffalo Bills")
+    assert 1 <= bills["projected_wins"] <= 2
+
+
+def test_another_seed_or_run_count_is_simulated_afresh(league):
+    simulation.projected_season(league, runs=500, seed=1, season=SEASON)
+
+    assert simulation.projected_season(league, runs=500, seed=2, season=SEASON)["cached"] is False
+    assert simulation.projected_season(league, runs=400, seed=1, season=SEASON)["cached"] is False
+
+
+@pytest.mark.parametrize("change", ["rating", "result"])
+def test_a_rating_or_result_change_invalidates_the_cached_run(league, change):
+    simulation.projected_season(league, runs=500, seed=1, season=SEASON)
+    if change == "rating":
+        league.execute(update(models.TeamRating).where(models.TeamRating.team_name == "Miami Dolphins")
+                       .values(overall_rating=70))
+    else:
+        league.execute(update(models.Match).where(models.Match.match_date == datetime(2024, 9, 15, 17))
+                       .values(final_score="20-10"))
+    league.commit()
+
+    after = simulation.projected_season(league, runs=500, seed=1, season=SEASON)
+
+    assert after["cached"] is False
+    assert after["games_remaining"] == (2 if change == "rating" else 1)
+
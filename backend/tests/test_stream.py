@@ -0,0 +1,115 @@
+import pytest
+
+import stream
+
+
+def change(match_id, sport="americanfootball_nfl"):
+    return {"match_id": match_id, "sport": sport, "book": "Book A", "market": "h2h",
+            "odds_team1": 1.9, "odds_team2": 1.9, "point": None}
+
+
+def drain(sub):
+    out = []
+    while not sub.queue.empty():
+        kind, seq, changes = sub.queue.get_nowait()
+        out.append((kind, seq, [c["match_id"] for c in changes]))
+    return out
+
+
+def test_subscribers_get_only_the_changes_they_asked_for():
+    b = stream.OddsBroadcaster()
+    everything = b.subscribe()
+    one_match = b.subscribe(match_ids={2})
+    other_sport = b.subscribe(sport="basketball_nba")
+
+    b.publish([change(1), change(2)])
+
+    assert drain(everything) == [("delta", 1, [1, 2])]
+    assert drain(one_match) == [("delta", 1, [2])]
+    assert drain(other_sport) == []
+
+
+def test_reconnecting_with_since_replays_what_was_missed():
+    b = stream.OddsBroadcaster()
+    for m in (1, 2, 3):
+        b.publish([change(m)])
+
+    assert drain(b.subscribe(since=1)) == [("delta", 2, [2]), ("delta", 3, [3])]
+    assert drain(b.subscribe(since=1, match_ids={3})) == [("delta", 3, [3])]
+    assert drain(b.subscribe(since=3)) == []
+
+
+def test_since_older_than_the_log_gets_a_resync():
+    b = stream.OddsBroadcaster(history=2)
+    for m in (1, 2, 3, 4):
+        b.publish([change(m)])
+
+    assert drain(b.subscribe(since=1)) == [("resync", 4, [])]
+    assert drain(b.subscribe(since=2)) == [("delta", 3, [3]), ("delta", 4, [4])]
+
+
+def test_since_ahead_of_the_server_gets_a_resync():
+    # The server restarted and numbering started over below what the client saw.
+    b = stream.OddsBroadcaster()
+    b.publish([change(1)])
+
+    sub = b.subscribe(since=40)
+    assert drain(sub) == [("resync", 1, [])]
+    b.publish([change(2)])
+    assert drain(sub) == [("delta", 2, [2])]
+
+
+def test_a_subscriber_that_falls_behind_is_told_to_resync(monkeypatch):
+    monkeypatch.setattr(stream, "STREAM_QUEUE_SIZE", 2)
+    b = stream.OddsBroadcaster()
+    sub = b.subscribe()
+    for m in (1, 2, 3):
+        b.publish([change(m)])
+
+    assert drain(sub) == [("resync", 3, [])]
+
+
+def test_batches_from_other_workers_keep_their_numbers():
+    b = stream.OddsBroadcaster()
+    relayed = []
+    b.relay = lambda seq, changes: relayed.append(seq)
+    sub = b.subscribe()
+
+    assert b.publish([change(1)]) == 1
+    assert b.publish([change(2)], seq=2) == 2
+    # Already seen: ignored.
+    assert b.publish([change(2)], seq=2) is None
+    assert drain(sub) == [("delta", 1, [1]), ("delta", 2, [2])]
+    # A gap means batches were lost on the way: everyone resyncs.
+    assert b.publish([change(5)], seq=5) == 5
+    assert drain(sub) == [("resync", 5, []), ("delta", 5, [5])]
+    # Only this process's own batch is handed on to the other workers.
+    assert relayed == [1]
+
+
+@pytest.mark.parametrize("stats, expected", [
+    ({"changed": []}, None),
+    ({"changed": [(7, "Book A", "h2h", 1.5, 2.6, None)], "match_sports": {7: "American Football"}}, 1),
+])
+def test_publish_ingestion_publishes_changed_rows(stats, expected):
+    b = stream.OddsBroadcaster()
+    sub = b.subscribe(sport="American Football")
+
+    assert b.publish_ingestion(stats) == expected
+    assert drain(sub) == ([("delta", 1, [7])] if expected else [])
+
+
+def test_websocket_resumes_from_since(db):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        main.broadcaster.publish([change(1)])
+        seq = main.broadcaster.seq
+        with client.websocket_connect(f"/ws/odds?since={seq - 1}") as ws:
+            assert ws.receive_json() == {"type": "hello", "seq": seq}
+            assert ws.receive_json()["changes"][0]["match_id"] == 1
+        with client.websocket_connect(f"/ws/odds?since={seq + 10}") as ws:
+            ws.receive_json()
+            assert ws.receive_json() == {"type": "resync", "seq": seq, "changes": []}
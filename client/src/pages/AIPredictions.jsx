@@ -13,10 +13,9 @@ function toPercent(p) {
   return `${(p * 100).toFixed(1)}%`;
 }
 
-function impliedProbFromDecimal(decimalOdds) {
-  const d = Number(decimalOdds);
-  if (!Number.isFinite(d) || d <= 1) return NaN;
-  return 1 / d;
+// null/undefined -> NaN so the Number.isFinite checks below render "-"
+function toNumber(v) {
+  return v === null || v === undefined ? NaN : Number(v);
 }
 
 export default function AIPredictions() {
@@ -53,33 +52,9 @@ export default function AIPredictions() {
 
     return rows
       .map((m) => {
-        const t1Dec = Number(m.odds_team1);
-        const t2Dec = Number(m.odds_team2);
-        const p1Model = Number(m.model_prob_team1);
-        const p2Model = Number(m.model_prob_team2);
-
-        const p1Book = impliedProbFromDecimal(t1Dec);
-        const p2Book = impliedProbFromDecimal(t2Dec);
-
-        const edge1 =
-          Number.isFinite(p1Model) && Number.isFinite(p1Book)
-            ? (p1Model - p1Book) * 100
-            : NaN;
-        const edge2 =
-          Number.isFinite(p2Model) && Number.isFinite(p2Book)
-            ? (p2Model - p2Book) * 100
-            : NaN;
-
-        const bestEdge = Math.max(
-          edge1 ?? Number.NEGATIVE_INFINITY,
-          edge2 ?? Number.NEGATIVE_INFINITY
-        );
-
-        let valueSide = "-";
-        if (Number.isFinite(edge1) || Number.isFinite(edge2)) {
-          if (edge1 >= edge2 && edge1 > 0) valueSide = m.team1;
-          if (edge2 > edge1 && edge2 > 0) valueSide = m.team2;
-        }
+        // Probabilities, edges and the value side come from the server.
+        const t1Dec = toNumber(m.odds_team1);
+        const t2Dec = toNumber(m.odds_team2);
 
         return {
           ...m,
@@ -87,14 +62,14 @@ export default function AIPredictions() {
           t2Dec,
           t1Money: toAmericanOdds(t1Dec),
           t2Money: toAmericanOdds(t2Dec),
-          p1Model,
-          p2Model,
-          p1Book,
-          p2Book,
-          edge1,
-          edge2,
-          bestEdge,
-          valueSide,
+          p1Model: toNumber(m.model_prob_team1),
+          p2Model: toNumber(m.model_prob_team2),
+          p1Book: toNumber(m.book_prob_team1),
+          p2Book: toNumber(m.book_prob_team2),
+          edge1: toNumber(m.edge_team1),
+          edge2: toNumber(m.edge_team2),
+          bestEdge: toNumber(m.best_edge),
+          valueSide: m.value_side || "-",
         };
       })
       .filter((row) => {
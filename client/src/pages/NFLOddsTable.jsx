@@ -106,6 +106,8 @@ export default function NFLOddsTable({ filters = {}, onTeamsReady }) {
     setErr("");
     fetch(`${API}/update-odds/`, { method: "POST" })
       .then((r) => {
+        // Rate limited: the odds were refreshed moments ago, so just reload them.
+        if (r.status === 429) return null;
         if (!r.ok)
           return r.json().then((j) => {
             throw new Error(j.detail || `POST /update-odds ${r.status}`);
@@ -161,7 +163,9 @@ export default function NFLOddsTable({ filters = {}, onTeamsReady }) {
       {/* Controls row */}
       <div style={{ display: "flex", gap: 8, marginBottom: 8, flexWrap: "wrap" }}>
         <button onClick={load}>Reload</button>
-        <button onClick={refreshFromBook}>Refresh from sportsbook</button>
+        <button onClick={refreshFromBook} disabled={loading}>
+          Refresh from sportsbook
+        </button>
         {!err ? null : (
           <span style={{ color: "crimson", marginLeft: 8 }}>Error: {err}</span>
         )}